@@ -1,13 +1,246 @@
+import heapq
+from collections import defaultdict
+from itertools import islice
+
+from django.conf import settings
 from django.contrib import admin
-from .models import Profile, MedicalRecord
+from django.contrib.admin.utils import quote, unquote
+from django.contrib.admin.views.main import ChangeList
+from django.db.models import Count, F, OrderBy
+from django.urls import reverse
+from django.utils.html import format_html
+from django.utils.http import urlencode
+from .models import AccountMember, AccountShard, Profile, MedicalRecord, Specialist, UploadSession
+from .sharding import databases_for, shard_aliases, use_shard
+
+class _SortValue:
+    """One ordering column of a row, compared the way SQLite orders it (NULL first)."""
+    __slots__ = ('value', 'descending')
+
+    def __init__(self, value, descending):
+        self.value = value
+        self.descending = descending
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        if self.value == other.value:
+            return False
+        less = self.value is None or (other.value is not None and self.value < other.value)
+        return not less if self.descending else less
+
+def _ordering(order_by):
+    """``(field, descending)`` for each field ordering of a queryset; other expressions are skipped."""
+    for part in order_by:
+        if isinstance(part, str) and part != '?':
+            yield part.lstrip('-'), part.startswith('-')
+        elif isinstance(part, OrderBy) and isinstance(part.expression, F):
+            yield part.expression.name, part.descending
+        elif isinstance(part, F):
+            yield part.name, False
+
+class ShardedResults:
+    """
+    The rows of a changelist queryset from every database holding its model,
+    merged in the queryset's order. Provides what ChangeList and its paginator
+    use: count(), slicing and iteration. A page fetches the ordering columns of
+    the rows up to its end from each database, merges them, then loads only
+    the page's rows.
+    """
+    ordered = True
+
+    def __init__(self, queryset):
+        self.queryset = queryset
+        self.aliases = databases_for(queryset.model)
+        self.ordering = list(_ordering(queryset.query.order_by)) or [('pk', False)]
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            self._count = sum(self.queryset.using(alias).count() for alias in self.aliases)
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def _clone(self):
+        return self
+
+    def _keyed_rows(self, alias, stop):
+        names = [name for name, _ in self.ordering]
+        for pk, *values in self.queryset.using(alias).values_list('pk', *names)[:stop]:
+            yield [_SortValue(value, descending) for value, (_, descending) in zip(values, self.ordering)], alias, pk
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        start, stop = key.start or 0, self.count() if key.stop is None else key.stop
+        merged = heapq.merge(*(self._keyed_rows(alias, stop) for alias in self.aliases), key=lambda row: row[0])
+        page = [(alias, pk) for _, alias, pk in islice(merged, start, stop)]
+
+        pks = defaultdict(list)
+        for alias, pk in page:
+            pks[alias].append(pk)
+        objects = {}
+        for alias, alias_pks in pks.items():
+            for obj in self.queryset.using(alias).filter(pk__in=alias_pks):
+                objects[alias, obj.pk] = obj
+        return [objects[row] for row in page if row in objects]
+
+class ShardedChangeList(ChangeList):
+    """A changelist of every shard's rows; each row links to ``<database>:<id>``."""
+
+    def get_results(self, request):
+        queryset, root_queryset = self.queryset, self.root_queryset
+        self.queryset, self.root_queryset = ShardedResults(queryset), ShardedResults(root_queryset)
+        try:
+            super().get_results(request)
+        finally:
+            self.queryset, self.root_queryset = queryset, root_queryset
+
+    def url_for_result(self, result):
+        return reverse(
+            f'admin:{self.opts.app_label}_{self.opts.model_name}_change',
+            args=(quote(f'{result._state.db}:{result.pk}'),),
+            current_app=self.model_admin.admin_site.name,
+        )
+
+class ShardedValuesFilter(admin.AllValuesFieldListFilter):
+    """AllValuesFieldListFilter offering the values found in every shard."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        values = self.lookup_choices
+        self.lookup_choices = sorted(
+            {value for alias in databases_for(values.model) for value in values.using(alias)},
+            key=lambda value: (value is not None, value),
+        )
+
+class ShardedModelAdmin(admin.ModelAdmin):
+    """
+    Admin for a sharded model. With shards, the list shows the rows of every
+    database, and an object's pages are opened on its own database. Ids are
+    only unique within a database, so bulk actions (which select by id) and
+    adding (the account's shard isn't known yet) are turned off.
+    """
+
+    def get_changelist(self, request, **kwargs):
+        return ShardedChangeList if shard_aliases() else super().get_changelist(request, **kwargs)
+
+    def get_list_display(self, request):
+        list_display = super().get_list_display(request)
+        return (*list_display, 'database') if shard_aliases() else list_display
+
+    @admin.display(description='database')
+    def database(self, obj):
+        return obj._state.db
+
+    def get_actions(self, request):
+        return {} if shard_aliases() else super().get_actions(request)
+
+    def has_add_permission(self, request):
+        return not shard_aliases() and super().has_add_permission(request)
+
+    def _on_shard(self, view, request, object_id, *args, **kwargs):
+        # Object ids from the merged list are "<database>:<id>"
+        alias, sep, pk = unquote(object_id).partition(':')
+        if not (sep and alias in databases_for(self.model)):
+            alias, pk = None, unquote(object_id)
+        with use_shard(alias):
+            response = view(request, quote(pk), *args, **kwargs)
+            if hasattr(response, 'render'):
+                response.render()  # Form choices and related objects come from the same shard
+        return response
+
+    def change_view(self, request, object_id, form_url='', extra_context=None):
+        return self._on_shard(super().change_view, request, object_id, form_url, extra_context)
+
+    def delete_view(self, request, object_id, extra_context=None):
+        return self._on_shard(super().delete_view, request, object_id, extra_context)
+
+    def history_view(self, request, object_id, extra_context=None):
+        return self._on_shard(super().history_view, request, object_id, extra_context)
+
+class AccountShardChangeList(ChangeList):
+    """Counts the listed accounts' profiles and records with one grouped query per shard."""
+
+    def get_results(self, request):
+        super().get_results(request)
+        self.result_list = list(self.result_list)
+        accounts = defaultdict(list)
+        for entry in self.result_list:
+            accounts[entry.shard].append(entry.account)
+        counts = {}
+        for alias, shard_accounts in accounts.items():
+            if alias not in settings.DATABASES:
+                continue  # Not configured here; see sharding.check_shard_map
+            rows = (Profile.objects.using(alias).filter(account__in=shard_accounts).values('account')
+                    .annotate(profiles=Count('id', distinct=True), records=Count('records')))
+            for row in rows:
+                counts[alias, row['account']] = row
+        for entry in self.result_list:
+            row = counts.get((entry.shard, entry.account), {})
+            entry.profile_count = row.get('profiles', 0) if entry.shard in settings.DATABASES else None
+            entry.record_count = row.get('records', 0) if entry.shard in settings.DATABASES else None
+
+@admin.register(AccountShard)
+class AccountShardAdmin(admin.ModelAdmin):
+    """The shard map, with each account's profiles and records counted on its shard."""
+    list_display = ('account', 'shard', 'profiles', 'records', 'moving', 'browse')
+    list_filter = ('shard', 'moving')
+    search_fields = ('account',)
+    readonly_fields = ('account', 'shard', 'moving') # Changed with rebalance_shards, which moves the rows too
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_changelist(self, request, **kwargs):
+        return AccountShardChangeList
+
+    @admin.display(description='profiles')
+    def profiles(self, obj):
+        return getattr(obj, 'profile_count', None)
+
+    @admin.display(description='records')
+    def records(self, obj):
+        return getattr(obj, 'record_count', None)
+
+    def browse(self, obj):
+        url = reverse('admin:api_profile_changelist') + '?' + urlencode({'account__exact': obj.account})
+        return format_html('<a href="{}">Profiles</a>', url)
+
+@admin.register(AccountMember)
+class AccountMemberAdmin(admin.ModelAdmin):
+    """Users who share a family account; users without one use the default account."""
+    list_display = ('user', 'account')
+    search_fields = ('user__username', 'account')
+    autocomplete_fields = ('user',)
 
 @admin.register(Profile)
-class ProfileAdmin(admin.ModelAdmin):
-    list_display = ('name', 'relationship', 'created_at', 'updated_at')
-    search_fields = ('name', 'relationship')
+class ProfileAdmin(ShardedModelAdmin):
+    list_display = ('name', 'relationship', 'account', 'created_at', 'updated_at')
+    list_filter = (('account', ShardedValuesFilter),)
+    search_fields = ('name', 'relationship', 'account')
 
 @admin.register(MedicalRecord)
-class MedicalRecordAdmin(admin.ModelAdmin):
+class MedicalRecordAdmin(ShardedModelAdmin):
     list_display = ('title', 'profile', 'date', 'created_at')
-    list_filter = ('profile', 'date')
-    search_fields = ('title', 'description')
+    list_filter = (('profile__account', ShardedValuesFilter), 'date') # Profile ids repeat across shards
+    search_fields = ('title',) # description is stored compressed and can't be searched in SQL
+
+@admin.register(Specialist)
+class SpecialistAdmin(admin.ModelAdmin):
+    list_display = ('name', 'specialty', 'address', 'phone')
+    list_filter = ('specialty',)
+    search_fields = ('name', 'specialty', 'address')
+    readonly_fields = ('geohash',)
+
+@admin.register(UploadSession)
+class UploadSessionAdmin(ShardedModelAdmin):
+    list_display = ('id', 'filename', 'profile', 'offset', 'length', 'status', 'updated_at')
+    list_filter = ('status',)
+    readonly_fields = ('offset', 'length', 'record')
@@ -0,0 +1,178 @@
+"""
+Async endpoints that proxy the external AI providers.
+
+These are plain Django async views rather than DRF viewsets: under ASGI
+(``backend.asgi``) a request waiting on a 5-30 s provider call is just a
+suspended coroutine, so slow analyses no longer hold a worker thread that the
+Kanban and records API need.
+"""
+import json
+
+from django.conf import settings
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from . import documents, prompts, providers, terms
+from .models import MedicalRecord
+from .sharding import for_account
+
+
+def _error(message, status=400):
+    return JsonResponse({'error': message}, status=status)
+
+
+def _load_json(request):
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _strip_data_url(image):
+    # The frontend holds images as data URLs; providers want the bare base64 payload.
+    return image.split(',', 1)[1] if image.startswith('data:') else image
+
+
+@csrf_exempt
+@require_POST
+async def ocr(request):
+    """Run text detection on ``{"image": <base64>}`` and return the raw annotations."""
+    data = _load_json(request)
+    if not data or not data.get('image'):
+        return _error("'image' is required.")
+    try:
+        annotations = await providers.annotate_image(_strip_data_url(data['image']))
+    except providers.ProviderError as e:
+        return _error(str(e), status=e.status_code)
+    return JsonResponse({'text_annotations': annotations})
+
+
+@csrf_exempt
+@require_POST
+async def analyze(request):
+    """Generate the three-part layman summary for ``{"image": <base64>}``."""
+    data = _load_json(request)
+    if not data or not data.get('image'):
+        return _error("'image' is required.")
+    try:
+        summary = await providers.generate_content(
+            prompts.ANALYSIS_PROMPT,
+            image_base64=_strip_data_url(data['image']),
+        )
+    except providers.ProviderError as e:
+        return _error(str(e), status=e.status_code)
+    return JsonResponse({'summary': summary})
+
+
+@csrf_exempt
+@require_POST
+async def interpret(request):
+    """
+    Explain detected values. Expects ``{"values": [{"test_name": ..., "value": ...}, ...]}``
+    and returns the raw model text, which contains a JSON object keyed by value.
+    """
+    data = _load_json(request)
+    values = data.get('values') if data else None
+    if not isinstance(values, list) or not values:
+        return _error("'values' must be a non-empty list.")
+    lines = '\n'.join(
+        f"{item.get('test_name') or 'Unknown Test'}: {item.get('value', '')}"
+        for item in values if isinstance(item, dict)
+    )
+    try:
+        text = await providers.generate_content(
+            prompts.INTERPRETATION_PROMPT.format(values=lines),
+            temperature=0.2,
+            max_output_tokens=1000,
+        )
+    except providers.ProviderError as e:
+        return _error(str(e), status=e.status_code)
+    return JsonResponse({'interpretations': text})
+
+
+@csrf_exempt
+@require_POST
+async def define(request):
+    """
+    Define a single term, or explain a selected passage in plain words when
+    ``"explain": true``. Nearby specialists come from the directory
+    (``/api/specialists/``), not the LLM.
+    """
+    data = _load_json(request)
+    term = (data.get('term') or '').strip() if data else ''
+    if not term:
+        return _error("'term' is required.")
+
+    if data.get('explain'):
+        messages = [
+            {'role': 'system', 'content': prompts.EXPLANATION_SYSTEM_PROMPT},
+            {'role': 'user', 'content': prompts.EXPLANATION_USER_PROMPT.format(text=term)},
+        ]
+    else:
+        messages = [
+            {'role': 'system', 'content': prompts.DEFINITION_SYSTEM_PROMPT},
+            {'role': 'user', 'content': f"Define the medical term: {term}"},
+        ]
+
+    try:
+        content, citations = await providers.chat_completion(messages, model='sonar')
+    except providers.ProviderError as e:
+        return _error(str(e), status=e.status_code)
+    return JsonResponse({'content': content, 'citations': citations})
+
+
+@csrf_exempt
+@require_POST
+async def term_definitions(request):
+    """
+    Define every highlighted term of a record in one call. Expects
+    ``{"terms": [...]}``; cached terms are answered immediately and the rest
+    are fetched in as few batched prompts as possible. Terms the provider
+    couldn't answer are listed under ``missing``.
+    """
+    data = _load_json(request)
+    requested = data.get('terms') if data else None
+    if not isinstance(requested, list) or not all(isinstance(t, str) for t in requested):
+        return _error("'terms' must be a list of strings.")
+    if len(requested) > settings.TERM_DEFINITION_MAX_TERMS:
+        return _error(f"At most {settings.TERM_DEFINITION_MAX_TERMS} terms can be requested at once.")
+
+    definitions, missing = await terms.resolve_definitions(requested)
+    # Answer under the terms exactly as the client sent them.
+    response = {}
+    for term in requested:
+        key = terms.normalize_term(term)
+        if key in definitions:
+            response[term] = definitions[key]
+    return JsonResponse({
+        'definitions': response,
+        'missing': [term for term in requested if terms.normalize_term(term) in missing],
+    })
+
+
+@csrf_exempt
+@require_POST
+async def analyze_record(request, record_id):
+    """
+    Analyze all pages of a stored record. Pages are OCR'd in parallel (only
+    new or changed ones), the text is analyzed in chunks and the merged
+    result is saved on the record.
+    """
+    try:
+        record = await for_account(MedicalRecord, request.account).aget(id=record_id)
+    except MedicalRecord.DoesNotExist:
+        return _error("Record not found", status=404)
+    try:
+        result = await documents.analyze_record(record)
+    except documents.DocumentError as e:
+        return _error(str(e))
+    except providers.ProviderError as e:
+        return _error(str(e), status=e.status_code)
+    result.update({
+        'analysis_summary': record.analysis_summary,
+        'analysis_actions': record.analysis_actions,
+        'analysis_recommendations': record.analysis_recommendations,
+    })
+    return JsonResponse(result)
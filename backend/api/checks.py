@@ -0,0 +1,20 @@
+from django.core.checks import Error, register
+from django.db import DatabaseError
+
+from .sharding import unconfigured_shards
+
+
+@register()
+def shard_map_check(app_configs, **kwargs):
+    """Refuse to start while the shard map names shards that aren't configured (see api.sharding)."""
+    try:
+        missing = unconfigured_shards()
+    except DatabaseError:
+        return []  # Not migrated yet
+    if not missing:
+        return []
+    return [Error(
+        f"The shard map assigns accounts to {', '.join(missing)}, which aren't configured.",
+        hint="Restore the shard files to SHARD_DIR, or set SHARD_COUNT to include them.",
+        id='api.E001',
+    )]
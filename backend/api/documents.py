@@ -0,0 +1,304 @@
+"""
+Multi-page documents: PDF rasterization, per-page OCR and chunked analysis.
+
+A record's pages are OCR'd concurrently (bounded by the Vision semaphore in
+``api.providers``), the page text is split into chunks under
+``DOCUMENT_CHUNK_TOKENS``, each chunk is analyzed on its own and the partial
+analyses are merged with one final prompt. Work is keyed by content hash, so
+adding a page to a record only OCRs the new page and re-analyzes the last
+chunk.
+"""
+import asyncio
+import base64
+import hashlib
+import re
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.core.files.temp import NamedTemporaryFile
+from django.db import models, transaction
+from django.forms import ImageField
+from django.utils import timezone
+
+from . import prompts, providers
+from .media import file_digest
+from .models import DocumentChunkAnalysis, MedicalRecordPage
+from .terms import estimate_tokens
+
+PDF_RENDER_SCALE = 2  # 72 dpi * 2 = 144 dpi, plenty for OCR of printed text
+
+
+class DocumentError(Exception):
+    """Raised for uploads that can't be turned into pages."""
+
+
+def is_pdf(uploaded_file):
+    if getattr(uploaded_file, 'content_type', None) == 'application/pdf':
+        return True
+    uploaded_file.seek(0)
+    header = uploaded_file.read(5)
+    uploaded_file.seek(0)
+    return header == b'%PDF-'
+
+
+def rasterize_pdf(uploaded_file):
+    """
+    Render every page of a PDF to a PNG in a temporary file and return them as
+    ``File`` objects. Rendering is slow, so do it before opening a transaction;
+    close the files (see ``close_files``) to remove them.
+    """
+    try:
+        import pypdfium2 as pdfium
+    except ImportError:
+        raise DocumentError("PDF uploads require the pypdfium2 package (pip install pypdfium2).")
+
+    try:
+        pdf = pdfium.PdfDocument(uploaded_file.read())
+    except pdfium.PdfiumError as e:
+        raise DocumentError(f"Could not read PDF: {e}")
+
+    try:
+        if len(pdf) > settings.DOCUMENT_MAX_PAGES:
+            raise DocumentError(f"PDFs can have at most {settings.DOCUMENT_MAX_PAGES} pages.")
+        files = []
+        try:
+            for number in range(len(pdf)):
+                image = pdf[number].render(scale=PDF_RENDER_SCALE).to_pil()
+                page_file = NamedTemporaryFile(suffix='.png')
+                files.append(File(page_file, name=f'page-{number + 1}.png'))
+                image.save(page_file, format='PNG', optimize=True)
+                page_file.seek(0)
+        except BaseException:
+            close_files(files)
+            raise
+        return files
+    finally:
+        pdf.close()
+
+
+def close_files(files):
+    for page_file in files:
+        page_file.close()
+
+
+def ensure_pages(record):
+    """Give single-image records a page 0 that points at their existing image."""
+    if record.pages.exists() or not record.image:
+        return
+    record.image.open('rb')
+    try:
+        digest = file_digest(record.image)
+    finally:
+        record.image.close()
+    # Assigning the name reuses the stored file instead of uploading a copy.
+    MedicalRecordPage.objects.create(record=record, index=0, image=record.image.name, content_hash=digest)
+
+
+def add_pages(record, uploaded_file):
+    """Append the pages of an uploaded image or PDF to ``record`` and return them."""
+    # Render and validate first: only the inserts hold the transaction (and SQLite's write lock).
+    rendered = is_pdf(uploaded_file)
+    if rendered:
+        files = rasterize_pdf(uploaded_file)
+    else:
+        try:
+            ImageField().to_python(uploaded_file)
+        except ValidationError as e:
+            raise DocumentError(e.messages[0])
+        files = [uploaded_file]
+    try:
+        with transaction.atomic(using=record._state.db):
+            ensure_pages(record)
+            return append_page_files(record, files)
+    finally:
+        if rendered:
+            close_files(files)
+
+
+def append_page_files(record, files):
+    """Save already validated page images after the record's existing pages."""
+    last_index = record.pages.aggregate(models.Max('index'))['index__max']
+    next_index = 0 if last_index is None else last_index + 1
+    if next_index + len(files) > settings.DOCUMENT_MAX_PAGES:
+        raise DocumentError(f"A record can have at most {settings.DOCUMENT_MAX_PAGES} pages.")
+
+    created = []
+    for offset, page_file in enumerate(files):
+        digest = file_digest(page_file)
+        page = MedicalRecordPage(record=record, index=next_index + offset, content_hash=digest)
+        # The same page uploaded before (to any record) doesn't need another OCR pass.
+        known = (MedicalRecordPage.objects
+                 .filter(content_hash=digest, ocr_hash=digest, ocr_text__isnull=False)
+                 .values_list('ocr_text', flat=True).first())
+        if known is not None:
+            page.ocr_text, page.ocr_hash = known, digest
+        page.image = page_file
+        page.save()
+        created.append(page)
+    return created
+
+
+def chunk_pages(pages, token_budget):
+    """
+    Group consecutive page texts into chunks of at most ``token_budget``
+    estimated tokens. Returns ``(first_page, last_page, text)`` tuples with
+    1-based page numbers; a page larger than the budget is split on lines.
+    """
+    chunks = []
+    current, first, last, used = [], None, None, 0
+
+    def flush():
+        nonlocal current, first, used
+        if current:
+            chunks.append((first, last, '\n\n'.join(current)))
+        current, first, used = [], None, 0
+
+    for page in pages:
+        number = page.index + 1
+        text = (page.ocr_text or '').strip()
+        if not text:
+            continue
+        pieces = [text]
+        if estimate_tokens(text) > token_budget:
+            pieces, piece = [], ''
+            for line in text.splitlines():
+                if piece and estimate_tokens(piece + line) > token_budget:
+                    pieces.append(piece)
+                    piece = ''
+                piece += line + '\n'
+            pieces.append(piece)
+        for piece in pieces:
+            block = f"--- Page {number} ---\n{piece.strip()}"
+            cost = estimate_tokens(block)
+            if current and used + cost > token_budget:
+                flush()
+            if first is None:
+                first = number
+            current.append(block)
+            last = number
+            used += cost
+    flush()
+    return chunks
+
+
+def split_analysis_sections(text):
+    """
+    Split a three-part analysis into ``(summary, actions, recommendations)``,
+    the same way the frontend splits it on the numbered headings.
+    """
+    body = re.sub(r'_included-specialists:.*?(?:\n|$)', '', text)
+    sections = [section.strip() for section in re.split(r'\d+\.\s+', body)[1:]]
+    sections += [''] * (3 - len(sections))
+    return sections[0], sections[1], sections[2]
+
+
+def _read_base64(page):
+    with page.image.open('rb') as f:
+        return base64.b64encode(f.read()).decode()
+
+
+async def ocr_page(page):
+    image_base64 = await sync_to_async(_read_base64, thread_sensitive=False)(page)
+    annotations = await providers.annotate_image(image_base64)
+    # The first annotation is the full text of the page.
+    page.ocr_text = annotations[0].get('description', '') if annotations else ''
+    page.ocr_hash = page.content_hash
+    await page.asave(update_fields=['ocr_text', 'ocr_hash', 'updated_at'])
+
+
+def analysis_fingerprint():
+    """
+    Short hash of everything that determines an analysis: the Gemini model
+    and every prompt template whose output is stored on a record (the server's
+    chunk and merge prompts, and the single-image prompt of /api/ai/analyze/
+    whose results the app saves). Changing any of them makes existing analyses stale.
+    """
+    source = '\n'.join([
+        provider_model(),
+        prompts.ANALYSIS_PROMPT,
+        prompts.CHUNK_ANALYSIS_PROMPT,
+        prompts.MERGE_ANALYSIS_PROMPT,
+    ])
+    return hashlib.sha256(source.encode()).hexdigest()[:16]
+
+
+def provider_model():
+    return providers.provider_config('gemini')['model']
+
+
+def _chunk_hash(prompt):
+    # The model is part of the key so a model upgrade doesn't reuse old partials.
+    return hashlib.sha256(f"{provider_model()}\n{prompt}".encode()).hexdigest()
+
+
+async def analyze_chunk(record, prompt, cached):
+    chunk_hash = _chunk_hash(prompt)
+    if chunk_hash in cached:
+        return chunk_hash, cached[chunk_hash], True
+    analysis = await providers.generate_content(prompt, max_output_tokens=500)
+    await DocumentChunkAnalysis.objects.aupdate_or_create(
+        record=record, chunk_hash=chunk_hash, defaults={'analysis': analysis},
+    )
+    return chunk_hash, analysis, False
+
+
+async def analyze_record(record):
+    """
+    OCR any new or changed pages of ``record``, analyze its text chunk by
+    chunk, merge the partial analyses and save the result on the record.
+    """
+    await sync_to_async(ensure_pages)(record)
+    pages = [page async for page in record.pages.all()]
+
+    stale = [page for page in pages if page.needs_ocr]
+    await asyncio.gather(*(ocr_page(page) for page in stale))
+
+    chunks = chunk_pages(pages, settings.DOCUMENT_CHUNK_TOKENS)
+    if not chunks:
+        raise DocumentError("No text could be read from this record's pages.")
+
+    chunk_prompts = [
+        # No page count here: it would change every chunk's hash whenever a page is added.
+        prompts.CHUNK_ANALYSIS_PROMPT.format(first_page=first, last_page=last, text=text)
+        for first, last, text in chunks
+    ]
+    cached = {
+        chunk.chunk_hash: chunk.analysis
+        async for chunk in record.chunk_analyses.filter(chunk_hash__in=[_chunk_hash(p) for p in chunk_prompts])
+    }
+    results = await asyncio.gather(*(analyze_chunk(record, prompt, cached) for prompt in chunk_prompts))
+    # Partials of chunks that no longer exist (pages were replaced) are dropped.
+    await record.chunk_analyses.exclude(chunk_hash__in=[chunk_hash for chunk_hash, _, _ in results]).adelete()
+
+    partials = [analysis for _, analysis, _ in results]
+    if len(partials) == 1:
+        summary = partials[0]
+    else:
+        summary = await providers.generate_content(
+            prompts.MERGE_ANALYSIS_PROMPT.format(
+                page_count=len(pages),
+                analyses='\n\n'.join(
+                    f"Analysis of pages {first}-{last}:\n{partial}"
+                    for (first, last, _), partial in zip(chunks, partials)
+                ),
+            ),
+            max_output_tokens=500,
+        )
+
+    record.analysis_summary, record.analysis_actions, record.analysis_recommendations = split_analysis_sections(summary)
+    record.analysis_fingerprint = analysis_fingerprint()
+    record.analyzed_at = timezone.now()
+    await record.asave(update_fields=[
+        'analysis_summary', 'analysis_actions', 'analysis_recommendations',
+        'analysis_fingerprint', 'analyzed_at', 'updated_at',
+    ])
+    return {
+        'summary': summary,
+        'analysis_fingerprint': record.analysis_fingerprint,
+        'pages': len(pages),
+        'ocr_pages': len(stale),
+        'chunks': len(chunks),
+        'reused_chunks': sum(1 for _, _, reused in results if reused),
+    }
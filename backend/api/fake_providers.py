@@ -0,0 +1,347 @@
+"""
+A local stand-in for the Vision, Gemini and Perplexity APIs.
+
+Answers the same paths the real providers expose with canned responses after
+a configurable delay, so the async AI views can be exercised (and loaded with
+hundreds of concurrent analyses) without network access or API keys. Point
+the backend at it with ``AI_PROVIDER_URL=http://127.0.0.1:<port>``.
+
+    with FakeProviderServer(latency=0.5) as server:
+        settings.AI_PROVIDERS['gemini']['base_url'] = server.url
+
+Instead of the canned answers it can replay real ones: with ``record_to`` it
+forwards every request to the real provider and saves the response and how
+long it took to a fixtures file, and with ``fixtures`` it answers from such a
+file. Responses are kept per request kind (``request_kind``) so that, say,
+a recorded summary is never replayed to an interpretation request. Delays are
+drawn per provider from a latency distribution (see ``parse_latency``), e.g.
+the recorded latencies themselves.
+"""
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+from . import prompts
+
+PROVIDERS = ('vision', 'gemini', 'perplexity')
+
+# What a request asks for; fixtures are recorded and replayed per kind.
+REQUEST_KINDS = (
+    'vision',
+    'gemini:image',  # Summary of a scan
+    'gemini:text',  # Summary of OCR text: document chunks and their merge
+    'gemini:interpret',  # JSON object keyed by detected value
+    'perplexity:chat',  # Single definition or explanation
+    'perplexity:batch',  # JSON object keyed by term
+)
+INTERPRETATION_MARKER = prompts.INTERPRETATION_PROMPT.strip().splitlines()[0]
+
+# Where requests are forwarded while recording
+UPSTREAM_URLS = {
+    'vision': 'https://vision.googleapis.com',
+    'gemini': 'https://generativelanguage.googleapis.com',
+    'perplexity': 'https://api.perplexity.ai',
+}
+
+FAKE_SUMMARY = (
+    "1. Summary: Your ||hemoglobin|| is slightly low, which can make you feel tired.\n\n"
+    "2. What can I do?: Eat more iron-rich foods such as spinach and lentils.\n\n"
+    "3. Where to go?: Consider seeing a ||hematologist|| if the fatigue continues.\n\n"
+    "_included-specialists: hematologist"
+)
+
+FAKE_DEFINITION = "- A protein in red blood cells that carries oxygen around the body."
+
+FAKE_INTERPRETATION = "Within the normal range for adults."
+
+
+def fake_text_annotations():
+    words = [('Hemoglobin', 10, 100), ('11.2', 200, 100), ('Glucose', 10, 140), ('98', 200, 140)]
+    annotations = [{'description': '\n'.join(w for w, _, _ in words)}]
+    for text, x, y in words:
+        annotations.append({
+            'description': text,
+            'boundingPoly': {'vertices': [
+                {'x': x, 'y': y}, {'x': x + 80, 'y': y}, {'x': x + 80, 'y': y + 20}, {'x': x, 'y': y + 20},
+            ]},
+        })
+    return annotations
+
+
+def provider_for_path(path):
+    if path == '/v1/images:annotate':
+        return 'vision'
+    if re.fullmatch(r'/v1beta/models/[^/:]+:generateContent', path):
+        return 'gemini'
+    if path == '/chat/completions':
+        return 'perplexity'
+    return None
+
+
+def _gemini_parts(payload):
+    contents = payload.get('contents') or [{}]
+    return [part for part in contents[0].get('parts') or [] if isinstance(part, dict)]
+
+
+def batch_terms(payload):
+    """The terms of a batched definition prompt (its last message ends with a JSON list), or None."""
+    messages = payload.get('messages') or [{}]
+    match = re.search(r'\[[\s\S]*\]\s*$', messages[-1].get('content', ''))
+    if not match:
+        return None
+    try:
+        terms = json.loads(match.group(0))
+    except ValueError:
+        return None
+    return terms if isinstance(terms, list) else None
+
+
+def interpreted_values(payload):
+    """The values listed in an interpretation prompt, or None for other Gemini prompts."""
+    text = ''.join(part.get('text', '') for part in _gemini_parts(payload))
+    if INTERPRETATION_MARKER not in text:
+        return None
+    listed = text.split(INTERPRETATION_MARKER, 1)[1].split('For each value', 1)[0]
+    return [line.rpartition(': ')[2] for line in listed.strip().splitlines() if ': ' in line]
+
+
+def request_kind(provider, payload):
+    """One of REQUEST_KINDS, from the provider and the shape of the prompt."""
+    if provider == 'gemini':
+        if any('inline_data' in part for part in _gemini_parts(payload)):
+            return 'gemini:image'
+        return 'gemini:interpret' if interpreted_values(payload) is not None else 'gemini:text'
+    if provider == 'perplexity':
+        return 'perplexity:batch' if batch_terms(payload) is not None else 'perplexity:chat'
+    return provider
+
+
+def answers_batch(fixture, terms):
+    """Whether a recorded batch answer defines every one of ``terms`` (errors always fit)."""
+    if fixture['status'] != 200:
+        return True
+    try:
+        content = fixture['body']['choices'][0]['message']['content']
+        answered = json.loads(re.search(r'\{[\s\S]*\}', content).group(0))
+    except (KeyError, IndexError, TypeError, AttributeError, ValueError):
+        return False
+    if not isinstance(answered, dict):
+        return False
+    keys = {str(key).strip().lower() for key in answered}
+    return all(str(term).strip().lower() in keys for term in terms)
+
+
+def parse_latency(spec):
+    """
+    Parse a latency distribution into a function ``sample(recorded)`` that
+    returns seconds to wait; ``recorded`` is the replayed fixture's latency
+    or None. Specs:
+
+    * ``0.5``: always 0.5 s
+    * ``uniform:LOW,HIGH``
+    * ``normal:MEAN,STDDEV`` (never below 0)
+    * ``lognormal:MEDIAN,SIGMA``: the long tail real APIs have
+    * ``recorded``: the latency stored with each fixture (0 for canned answers)
+    """
+    name, _, args = spec.partition(':')
+    try:
+        if not args:
+            if name == 'recorded':
+                return lambda recorded: recorded or 0.0
+            seconds = float(name)
+            if seconds < 0:
+                raise ValueError
+            return lambda recorded: seconds
+        values = [float(value) for value in args.split(',')]
+        if name == 'uniform':
+            low, high = values
+            return lambda recorded: random.uniform(low, high)
+        if name == 'normal':
+            mean, stddev = values
+            return lambda recorded: max(0.0, random.gauss(mean, stddev))
+        if name == 'lognormal':
+            median, sigma = values
+            return lambda recorded: random.lognormvariate(math.log(median), sigma)
+    except ValueError:
+        pass
+    raise ValueError(f"Invalid latency distribution {spec!r}")
+
+
+class ProviderFixtures:
+    """
+    Recorded provider responses by request kind, stored as JSON:
+    ``{kind: [{"status": 200, "body": {...}, "latency": 0.81}, ...]}``.
+    """
+
+    def __init__(self, responses=None):
+        responses = responses or {}
+        unknown = set(responses) - set(REQUEST_KINDS)
+        if unknown:
+            raise ValueError(f"Unknown request kinds {', '.join(sorted(unknown))}; expected some of "
+                             f"{', '.join(REQUEST_KINDS)} (fixtures recorded per provider must be recorded again)")
+        self.responses = {kind: list(responses.get(kind, [])) for kind in REQUEST_KINDS}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def save(self, path):
+        tmp_path = f'{path}.tmp'
+        with self._lock, open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.responses, f, indent=1)
+        os.replace(tmp_path, path)
+
+    def add(self, kind, status, body, latency):
+        with self._lock:
+            self.responses[kind].append({'status': status, 'body': body, 'latency': round(latency, 4)})
+
+    def sample(self, kind):
+        """A random recorded response to a request of ``kind``, or None if there are none."""
+        responses = self.responses.get(kind)
+        return random.choice(responses) if responses else None
+
+
+class FakeProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like the real providers
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return self._send(400, {'error': 'invalid JSON'})
+
+        path = self.path.split('?', 1)[0]
+        provider = provider_for_path(path)
+        if provider is None:
+            return self._send(404, {'error': f'unknown path {path}'})
+        kind = request_kind(provider, payload)
+        if self.server.record_to:
+            return self._send(*self.server.forward(provider, kind, self.path, payload, self.headers))
+
+        fixture = self.server.fixtures.sample(kind) if self.server.fixtures else None
+        self.server.delay(provider, fixture['latency'] if fixture else None)
+        # A recorded batch answer is for other terms than most requests ask
+        # about; those get the canned answer (after the recorded delay).
+        if fixture is not None and (kind != 'perplexity:batch' or answers_batch(fixture, batch_terms(payload))):
+            return self._send(fixture['status'], fixture['body'])
+        if provider == 'vision':
+            return self._send(200, {'responses': [{'textAnnotations': fake_text_annotations()}]})
+        if provider == 'gemini':
+            return self._send(200, self.server.gemini_response(payload))
+        return self._send(200, self.server.chat_response(payload))
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except ConnectionError:
+            pass  # The client gave up waiting (timed out) before the answer came
+
+
+class FakeProviderServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # Room for a burst of concurrent load-test connections
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, verbose=False,
+                 fixtures=None, record_to=None):
+        """
+        ``latency`` is seconds, a ``parse_latency`` spec, or a dict of either
+        per provider (others get no delay); ``jitter`` adds up to that many
+        seconds on top. ``fixtures`` (a ProviderFixtures) replays recorded
+        responses; with ``record_to`` (a path) requests are forwarded to the
+        real providers and their responses appended to that file instead.
+        """
+        super().__init__((host, port), FakeProviderHandler)
+        if not isinstance(latency, dict):
+            latency = dict.fromkeys(PROVIDERS, latency)
+        self.latencies = {provider: parse_latency(str(spec)) for provider, spec in latency.items()}
+        self.jitter = jitter
+        self.verbose = verbose
+        self.fixtures = fixtures
+        self.record_to = record_to
+        self._recorded = None
+        self._upstream = None
+        if record_to:
+            self._recorded = ProviderFixtures.load(record_to) if os.path.exists(record_to) else ProviderFixtures()
+            self._upstream = httpx.Client(timeout=120)
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def delay(self, provider, recorded=None):
+        sample = self.latencies.get(provider)
+        seconds = (sample(recorded) if sample else 0.0) + random.uniform(0, self.jitter)
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def forward(self, provider, kind, path, payload, headers):
+        """Send the request to the real provider, record the answer and return ``(status, body)``."""
+        forwarded = {'Authorization': headers['Authorization']} if headers.get('Authorization') else None
+        started = time.monotonic()
+        try:
+            response = self._upstream.post(UPSTREAM_URLS[provider] + path, json=payload, headers=forwarded)
+            body = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            return 502, {'error': f'{provider} upstream failed: {e}'}
+        # Only the response is stored: the request carries the API key.
+        self._recorded.add(kind, response.status_code, body, time.monotonic() - started)
+        self._recorded.save(self.record_to)
+        return response.status_code, body
+
+    def gemini_response(self, payload):
+        text = FAKE_SUMMARY
+        values = interpreted_values(payload)
+        if values is not None:
+            text = json.dumps({value: FAKE_INTERPRETATION for value in values}, indent=2)
+        return {'candidates': [{'content': {'parts': [{'text': text}]}}]}
+
+    def chat_response(self, payload):
+        content = FAKE_DEFINITION
+        terms = batch_terms(payload)
+        if terms is not None:
+            content = json.dumps({term: FAKE_DEFINITION for term in terms})
+        return {
+            'choices': [{'message': {'role': 'assistant', 'content': content}}],
+            'citations': ['https://example.org/fake-source'],
+        }
+
+    def start(self):
+        """Serve from a background thread; returns immediately."""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._upstream is not None:
+            self._upstream.close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
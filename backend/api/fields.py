@@ -0,0 +1,163 @@
+"""
+Compressed storage for long text columns.
+
+``CompressedTextField`` behaves like a ``TextField`` in models, forms and
+serializers, but stores its value compressed in a binary column. Values come
+out of the database still compressed and are only decompressed the first
+time the attribute is read, so listing records, or saving a record whose
+analysis wasn't touched, never inflates the text.
+
+Values are zlib by default. With ``COMPRESSED_TEXT_CODEC = 'zstd'`` and a
+dictionary trained by ``python manage.py train_compression_dictionary``, new
+values are written with zstd and the shared dictionary, which compresses
+short, similar texts (analyses, OCR pages) far better. Each value records its
+codec in a one-byte header, so both kinds can be read side by side. A
+dictionary file must be kept as long as any value written with it exists.
+"""
+import struct
+import zlib
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import models
+from django.db.models.query_utils import DeferredAttribute
+
+ZLIB_HEADER = b'Z'
+ZSTD_HEADER = b'S'  # Followed by the 4-byte id of the dictionary used
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 9
+
+
+class CompressedText(bytes):
+    """A value as stored in the database, not yet decompressed."""
+
+    def __str__(self):
+        return decompress(self)
+
+
+@lru_cache(maxsize=None)
+def _zstd_dictionary(path):
+    import zstandard
+    with open(path, 'rb') as f:
+        return zstandard.ZstdCompressionDict(f.read())
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImproperlyConfigured("COMPRESSED_TEXT_CODEC = 'zstd' requires the zstandard package.")
+    path = getattr(settings, 'COMPRESSED_TEXT_ZSTD_DICTIONARY', None)
+    dictionary = _zstd_dictionary(str(path)) if path else None
+    return zstandard, dictionary
+
+
+def compress(text):
+    if text == '':
+        return b''  # Keeps exact lookups against '' working
+    data = text.encode('utf-8')
+    if getattr(settings, 'COMPRESSED_TEXT_CODEC', 'zlib') == 'zstd':
+        zstandard, dictionary = _zstd()
+        compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=dictionary)
+        dict_id = dictionary.dict_id() if dictionary else 0
+        return ZSTD_HEADER + struct.pack('>I', dict_id) + compressor.compress(data)
+    return ZLIB_HEADER + zlib.compress(data, ZLIB_LEVEL)
+
+
+def decompress(value):
+    value = bytes(value)
+    if not value:
+        return ''
+    header, body = value[:1], value[1:]
+    if header == ZLIB_HEADER:
+        return zlib.decompress(body).decode('utf-8')
+    if header == ZSTD_HEADER:
+        zstandard, dictionary = _zstd()
+        (dict_id,) = struct.unpack('>I', body[:4])
+        if dict_id and (dictionary is None or dictionary.dict_id() != dict_id):
+            raise ImproperlyConfigured(
+                f"Value was compressed with zstd dictionary {dict_id}, which is not the configured "
+                f"COMPRESSED_TEXT_ZSTD_DICTIONARY."
+            )
+        decompressor = zstandard.ZstdDecompressor(dict_data=dictionary if dict_id else None)
+        return decompressor.decompress(body[4:]).decode('utf-8')
+    raise ValueError(f"Unknown compressed text header {header!r}")
+
+
+class CompressedTextDescriptor(DeferredAttribute):
+    # A data descriptor (it defines __set__), so reads go through __get__ even
+    # though the loaded value lives in the instance __dict__.
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.attname] = value
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        value = super().__get__(instance, cls)
+        if isinstance(value, CompressedText):
+            value = decompress(value)
+            instance.__dict__[self.field.attname] = value
+        return value
+
+
+class CompressedTextField(models.TextField):
+    descriptor_class = CompressedTextDescriptor
+
+    def get_internal_type(self):
+        # Stored as a BLOB/bytea column; everything above the database sees text.
+        return 'BinaryField'
+
+    def from_db_value(self, value, expression, connection):
+        if value is None or isinstance(value, str):
+            # Rows written before the column was compressed hold plain text.
+            return value
+        return CompressedText(value)
+
+    def to_python(self, value):
+        if isinstance(value, CompressedText):
+            return decompress(value)
+        return super().to_python(value)
+
+    def pre_save(self, model_instance, add):
+        # Pass a value that was never read straight back, without a decompress/compress round trip.
+        value = model_instance.__dict__.get(self.attname)
+        if isinstance(value, CompressedText):
+            return value
+        return super().pre_save(model_instance, add)
+
+    def get_prep_value(self, value):
+        if value is None or isinstance(value, CompressedText):
+            return value
+        return compress(str(value))
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if not prepared:
+            value = self.get_prep_value(value)
+        if value is not None:
+            return connection.Database.Binary(value)
+        return value
+
+
+def compressed_columns():
+    """Yield ``(model, field_name)`` for every CompressedTextField in the project."""
+    from django.apps import apps
+    for model in apps.get_models():
+        for field in model._meta.concrete_fields:
+            if isinstance(field, CompressedTextField):
+                yield model, field.name
+
+
+def iter_stored_values(model, field_name, chunk_size=500):
+    """Yield the raw stored values of one column in primary-key order, a chunk at a time."""
+    last_pk = None
+    while True:
+        queryset = model.objects.order_by('pk')
+        if last_pk is not None:
+            queryset = queryset.filter(pk__gt=last_pk)
+        rows = list(queryset.values_list('pk', field_name)[:chunk_size])
+        if not rows:
+            return
+        for _, value in rows:
+            yield value
+        last_pk = rows[-1][0]
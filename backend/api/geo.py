@@ -0,0 +1,123 @@
+"""
+Geohash indexing and nearest-neighbour search for the specialist directory.
+
+Every specialist is stored with a 12-character geohash. Points that share a
+geohash prefix lie in the same cell, so "everything in this cell" is a range
+scan on the indexed ``(specialty, geohash)`` column pair. A search starts
+with small cells around the query point and widens them until the k-th
+nearest candidate is provably closer than anything outside the searched
+cells.
+"""
+import math
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+EARTH_RADIUS_KM = 6371.0088
+GEOHASH_PRECISION = 12
+
+# Approximate cell height and width (km, at the equator) for each precision.
+CELL_SIZE_KM = {
+    1: (4992.6, 5009.4),
+    2: (624.1, 1252.3),
+    3: (156.0, 156.5),
+    4: (19.5, 39.1),
+    5: (4.89, 4.89),
+    6: (0.61, 1.22),
+    7: (0.153, 0.153),
+    8: (0.019, 0.038),
+}
+
+
+def encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    geohash, bits, bit_count, even = [], 0, 0, True
+    while len(geohash) < precision:
+        value, interval = (longitude, lng_range) if even else (latitude, lat_range)
+        mid = (interval[0] + interval[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            interval[0] = mid
+        else:
+            interval[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(BASE32[bits])
+            bits, bit_count = 0, 0
+    return ''.join(geohash)
+
+
+def decode_bounds(geohash):
+    """Return ``(min_lat, max_lat, min_lng, max_lng)`` of a geohash cell."""
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        bits = BASE32.index(char)
+        for shift in range(4, -1, -1):
+            interval = lng_range if even else lat_range
+            mid = (interval[0] + interval[1]) / 2
+            if bits >> shift & 1:
+                interval[0] = mid
+            else:
+                interval[1] = mid
+            even = not even
+    return lat_range[0], lat_range[1], lng_range[0], lng_range[1]
+
+
+def neighbours(geohash):
+    """The cell itself plus the (up to) eight cells around it."""
+    min_lat, max_lat, min_lng, max_lng = decode_bounds(geohash)
+    height, width = max_lat - min_lat, max_lng - min_lng
+    center_lat, center_lng = (min_lat + max_lat) / 2, (min_lng + max_lng) / 2
+    cells = []
+    for d_lat in (-1, 0, 1):
+        lat = center_lat + d_lat * height
+        if not -90 < lat < 90:
+            continue
+        for d_lng in (-1, 0, 1):
+            lng = (center_lng + d_lng * width + 180) % 360 - 180
+            cell = encode(lat, lng, len(geohash))
+            if cell not in cells:
+                cells.append(cell)
+    return cells
+
+
+def covered_radius_km(latitude, longitude, geohash):
+    """
+    Distance from the point within which everything lies inside ``geohash``
+    (the point's cell) or its ring of neighbours.
+
+    It is the distance to the nearest edge of that 3x3 block: the parallels
+    above and below it, or the meridians east and west of it. Near the poles
+    those meridians converge, and so does the radius. Going over a pole means
+    crossing every meridian, so a block that touches a pole needs no northern
+    (or southern) limit.
+    """
+    min_lat, max_lat, min_lng, max_lng = decode_bounds(geohash)
+    height, width = max_lat - min_lat, max_lng - min_lng
+    km_per_degree = math.radians(EARTH_RADIUS_KM)
+    limits = []
+    if min_lat > -90:
+        limits.append((latitude - (min_lat - height)) * km_per_degree)
+    if max_lat < 90:
+        limits.append(((max_lat + height) - latitude) * km_per_degree)
+    cos_lat = math.cos(math.radians(latitude))
+    for d_lng in (longitude - (min_lng - width), (max_lng + width) - longitude):
+        # Great-circle distance from the point to the meridian d_lng degrees away
+        limits.append(EARTH_RADIUS_KM * math.asin(min(1.0, cos_lat * abs(math.sin(math.radians(d_lng))))))
+    return max(0.0, min(limits))
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def prefix_range(prefix):
+    """
+    ``(low, high)`` bounds matching every geohash that starts with ``prefix``.
+    Range comparisons use the B-tree index on SQLite, where LIKE 'x%' does not.
+    """
+    return prefix, prefix + '~'  # '~' sorts after every geohash character
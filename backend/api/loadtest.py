@@ -0,0 +1,304 @@
+"""
+Load generator for the real HTTP endpoints (see the ``load_test`` command).
+
+Virtual users run a weighted mix of the operations the frontend performs
+against a running server, as many at once as ``concurrency``:
+
+* ``list_records``: open a profile's record list
+* ``upload_record``: upload a scan, analyze it (Vision OCR, then Gemini) and
+  open the saved result
+* ``define_terms``: look up highlighted terms (Perplexity, cached after the
+  first time)
+* ``create_task`` / ``reorder_task``: add a task to the board or drag one to
+  another column or position
+
+Run the server against the fake providers (``run_fake_providers``, ideally
+replaying recorded fixtures) so the AI calls cost nothing but take realistic
+time. Every request is timed under its endpoint (``POST
+/api/records/{id}/analyze/``); ``summarize`` turns the timings into a report
+with p50/p95/p99 latency and throughput per endpoint, and ``compare`` sets
+two reports side by side.
+"""
+import asyncio
+import io
+import random
+import time
+import uuid
+from collections import defaultdict
+
+import httpx
+from PIL import Image
+
+DEFAULT_MIX = {
+    'list_records': 40,
+    'upload_record': 10,
+    'define_terms': 10,
+    'create_task': 20,
+    'reorder_task': 20,
+}
+
+TERMS = [
+    'hemoglobin', 'hematocrit', 'creatinine', 'glucose', 'cholesterol', 'triglycerides', 'thyroxine',
+    'platelets', 'leukocytes', 'bilirubin', 'albumin', 'ferritin', 'troponin', 'hba1c', 'tsh',
+]
+TASK_STATUSES = ['todo', 'inprogress', 'done']
+TASKS_PER_PROFILE = 3  # Created during setup so reorder_task has something to move
+
+
+def parse_mix(spec):
+    """Parse ``name=weight,...`` into a mix dict; unknown names raise ValueError."""
+    mix = {}
+    for part in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, weight = part.partition('=')
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation {name!r}; expected one of {', '.join(OPERATIONS)}")
+        mix[name] = float(weight)
+        if mix[name] < 0:
+            raise ValueError(f"Weight of {name} can't be negative")
+    if not any(mix.values()):
+        raise ValueError("The mix needs at least one operation with a positive weight")
+    return mix
+
+
+def scan_image():
+    """A small JPEG with a random colour, so every upload has new content (and a new name)."""
+    colour = tuple(random.randrange(256) for _ in range(3))
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64), colour).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+class Timings:
+    """Latencies and status codes of every request, by endpoint."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)  # Successful requests only, in seconds
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.errors = defaultdict(int)
+
+    def add(self, endpoint, status, seconds):
+        self.statuses[endpoint][str(status)] += 1
+        if isinstance(status, int) and status < 400:
+            self.latencies[endpoint].append(seconds)
+        else:
+            self.errors[endpoint] += 1
+
+    @property
+    def endpoints(self):
+        return sorted(self.statuses)
+
+
+class VirtualProfile:
+    """A profile created for the run, with the task ids reorder_task picks from."""
+
+    def __init__(self, id):
+        self.id = id
+        self.tasks = []
+
+
+class LoadTest:
+    def __init__(self, base_url, concurrency=10, duration=30.0, operations=None, mix=None,
+                 profiles=3, timeout=120.0, seed=None):
+        self.base_url = base_url.rstrip('/')
+        self.concurrency = concurrency
+        self.duration = duration
+        self.operations = operations  # Stop after this many operations, if set
+        self.mix = mix or DEFAULT_MIX
+        self.profile_count = profiles
+        self.timeout = timeout
+        self.random = random.Random(seed)
+        self.timings = Timings()
+        self.profiles = []
+        self.started = 0
+        self.elapsed = 0.0
+        self.client = None
+
+    async def request(self, method, path, endpoint, **kwargs):
+        """Send a timed request; returns the response, or None if it didn't complete."""
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, path, **kwargs)
+        except httpx.HTTPError as e:
+            self.timings.add(f'{method} {endpoint}', type(e).__name__, time.perf_counter() - started)
+            return None
+        self.timings.add(f'{method} {endpoint}', response.status_code, time.perf_counter() - started)
+        return response
+
+    # Setup and teardown aren't timed.
+
+    async def setup(self):
+        run = uuid.uuid4().hex[:8]
+        for index in range(self.profile_count):
+            response = await self.client.post('/api/profiles/', json={
+                'name': f'Load test {run} #{index}', 'relationship': 'Self',
+            })
+            response.raise_for_status()
+            profile = VirtualProfile(response.json()['id'])
+            for number in range(TASKS_PER_PROFILE):
+                response = await self.client.post(f'/api/profiles/{profile.id}/tasks/', json={
+                    'title': f'Task {number} {uuid.uuid4().hex[:8]}',
+                })
+                response.raise_for_status()
+                profile.tasks.append(response.json()['id'])
+            self.profiles.append(profile)
+
+    async def teardown(self):
+        # Deleting the profiles cascades to their records and tasks; the
+        # scans are left to the media garbage collector.
+        for profile in self.profiles:
+            await self.client.delete(f'/api/profiles/{profile.id}/')
+
+    # Operations
+
+    async def list_records(self, profile):
+        await self.request('GET', f'/api/profiles/{profile.id}/records/', '/api/profiles/{id}/records/')
+
+    async def upload_record(self, profile):
+        response = await self.request(
+            'POST', f'/api/profiles/{profile.id}/records/', '/api/profiles/{id}/records/',
+            data={'title': 'Blood test', 'date': '2025-01-15', 'description': 'Load test upload'},
+            files={'image': ('scan.jpg', scan_image(), 'image/jpeg')},
+        )
+        if response is None or response.status_code != 201:
+            return
+        record_id = response.json()['id']
+        response = await self.request('POST', f'/api/records/{record_id}/analyze/', '/api/records/{id}/analyze/')
+        if response is not None and response.status_code < 400:
+            await self.request('GET', f'/api/records/{record_id}/', '/api/records/{id}/')
+
+    async def define_terms(self, profile):
+        terms = self.random.sample(TERMS, 3)
+        await self.request('POST', '/api/terms/definitions/', '/api/terms/definitions/', json={'terms': terms})
+
+    async def create_task(self, profile):
+        response = await self.request(
+            'POST', f'/api/profiles/{profile.id}/tasks/', '/api/profiles/{id}/tasks/',
+            json={'title': f'Follow up {uuid.uuid4().hex[:8]}', 'status': self.random.choice(TASK_STATUSES)},
+        )
+        if response is not None and response.status_code == 201:
+            profile.tasks.append(response.json()['id'])
+
+    async def reorder_task(self, profile):
+        task_id = self.random.choice(profile.tasks)
+        await self.request('PATCH', f'/api/tasks/{task_id}/', '/api/tasks/{id}/', json={
+            'status': self.random.choice(TASK_STATUSES),
+            'order': self.random.randrange(len(profile.tasks)),
+        })
+
+    async def user(self, deadline):
+        names = list(self.mix)
+        weights = [self.mix[name] for name in names]
+        while time.monotonic() < deadline:
+            if self.operations is not None:
+                if self.started >= self.operations:
+                    break
+                self.started += 1
+            name = self.random.choices(names, weights)[0]
+            await getattr(self, name)(self.random.choice(self.profiles))
+
+    async def run(self):
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        async with httpx.AsyncClient(base_url=self.base_url, limits=limits, timeout=self.timeout) as client:
+            self.client = client
+            await self.setup()
+            try:
+                started = time.monotonic()
+                deadline = started + self.duration
+                await asyncio.gather(*(self.user(deadline) for _ in range(self.concurrency)))
+                self.elapsed = time.monotonic() - started
+            finally:
+                await self.teardown()
+        return self.timings
+
+
+OPERATIONS = {name: getattr(LoadTest, name) for name in DEFAULT_MIX}
+
+
+def percentile(values, q):
+    """The ``q``-th percentile (0-100) of sorted ``values``, linearly interpolated."""
+    if not values:
+        return None
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def _stats(latencies, errors, statuses, elapsed):
+    latencies = sorted(latencies)
+    count = len(latencies) + errors
+
+    def ms(value):
+        return round(value * 1000, 1) if value is not None else None
+
+    return {
+        'requests': count,
+        'errors': errors,
+        'statuses': dict(sorted(statuses.items())),
+        'throughput_rps': round(count / elapsed, 2) if elapsed else None,
+        'mean_ms': ms(sum(latencies) / len(latencies)) if latencies else None,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'max_ms': ms(latencies[-1]) if latencies else None,
+    }
+
+
+def summarize(timings, elapsed, config=None):
+    """The JSON report: overall and per-endpoint counts, throughput and latency percentiles."""
+    total_statuses = defaultdict(int)
+    for statuses in timings.statuses.values():
+        for status, count in statuses.items():
+            total_statuses[status] += count
+    return {
+        'config': config or {},
+        'elapsed_s': round(elapsed, 2),
+        'total': _stats(
+            [seconds for latencies in timings.latencies.values() for seconds in latencies],
+            sum(timings.errors.values()), total_statuses, elapsed,
+        ),
+        'endpoints': {
+            endpoint: _stats(timings.latencies[endpoint], timings.errors[endpoint],
+                             timings.statuses[endpoint], elapsed)
+            for endpoint in timings.endpoints
+        },
+    }
+
+
+COMPARED = ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps')
+
+
+def _change(before, after):
+    if before is None or after is None or before == 0:
+        return None
+    return round((after - before) / before * 100, 1)
+
+
+def compare(baseline, report):
+    """
+    ``{endpoint: {metric: {'baseline', 'current', 'change_pct'}}}`` for every
+    endpoint in either report (``total`` included).
+    """
+    sections = {'total': (baseline.get('total', {}), report.get('total', {}))}
+    for endpoint in sorted(set(baseline.get('endpoints', {})) | set(report.get('endpoints', {}))):
+        sections[endpoint] = (baseline.get('endpoints', {}).get(endpoint, {}),
+                              report.get('endpoints', {}).get(endpoint, {}))
+    return {
+        endpoint: {
+            metric: {
+                'baseline': before.get(metric),
+                'current': after.get(metric),
+                'change_pct': _change(before.get(metric), after.get(metric)),
+            }
+            for metric in COMPARED
+        }
+        for endpoint, (before, after) in sections.items()
+    }
+
+
+def regressions(comparison, max_increase_pct):
+    """Endpoints in both runs whose p95 grew by more than ``max_increase_pct`` percent."""
+    return [
+        endpoint for endpoint, metrics in comparison.items()
+        if metrics['p95_ms']['change_pct'] is not None and metrics['p95_ms']['change_pct'] > max_increase_pct
+    ]
@@ -0,0 +1,30 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import AccountMember
+
+
+class Command(BaseCommand):
+    help = (
+        "Put users in a family account so they share its profiles. Users without one (and visitors "
+        "who aren't signed in) use the default account."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('account')
+        parser.add_argument('--user', action='append', dest='users', default=[],
+                            help="Username to add to the account; may be repeated.")
+
+    def handle(self, *args, **options):
+        account = options['account'].strip()
+        if not account or len(account) > 100:
+            raise CommandError("The account must be 1 to 100 characters.")
+
+        User = get_user_model()
+        for username in options['users']:
+            try:
+                user = User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError(f"No user {username!r}")
+            AccountMember.objects.update_or_create(user=user, defaults={'account': account})
+            self.stdout.write(f"Added {username} to {account!r}")
@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from api.media_gc import collect_garbage
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete media files under MEDIA_GC_DIRECTORIES that no record or page refers to, in "
+        "rate-limited batches. Use --dry-run to only list them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="List orphaned files without deleting them.")
+        parser.add_argument('--batch-size', type=int, default=settings.MEDIA_GC_BATCH_SIZE,
+                            help="Files checked and deleted per batch.")
+        parser.add_argument('--rate', type=float, default=settings.MEDIA_GC_RATE,
+                            help="Maximum files deleted per second (0 for no limit).")
+        parser.add_argument('--min-age', type=int, default=settings.MEDIA_GC_MIN_AGE,
+                            help="Only consider files older than this many seconds.")
+
+    def handle(self, *args, **options):
+        try:
+            report = collect_garbage(
+                dry_run=options['dry_run'],
+                batch_size=options['batch_size'],
+                rate=options['rate'],
+                min_age=options['min_age'],
+            )
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+        for path in report['paths']:
+            self.stdout.write(path)
+        megabytes = report['bytes'] / (1024 * 1024)
+        if options['dry_run']:
+            summary = f"{report['orphans']} of {report['scanned']} files are orphaned ({megabytes:.1f} MB)"
+        else:
+            summary = f"Deleted {report['deleted']} of {report['scanned']} files ({megabytes:.1f} MB)"
+        self.stdout.write(self.style.SUCCESS(summary))
@@ -0,0 +1,75 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from api.fields import compress, compressed_columns, decompress, iter_stored_values
+from api.sharding import databases_for, use_shard
+
+
+class Command(BaseCommand):
+    help = "Report how much space the compressed text columns save and what decompression costs."
+
+    def handle(self, *args, **options):
+        codec = getattr(settings, 'COMPRESSED_TEXT_CODEC', 'zlib')
+        self.stdout.write(f"Codec for new values: {codec}")
+        self.stdout.write(
+            f"{'column':45} {'database':10} {'rows':>7} {'plain':>7} {'text KB':>10} {'stored KB':>10} {'ratio':>6} "
+            f"{'decomp ms':>10} {'comp ms':>8}"
+        )
+
+        total_text = total_stored = 0
+        for model, field_name in compressed_columns():
+            for using in databases_for(model):
+                # Columns of sharded models are read shard by shard.
+                with use_shard(using):
+                    text_bytes, stored_bytes = self.report_column(model, field_name, using)
+                total_text += text_bytes
+                total_stored += stored_bytes
+
+        saved = total_text - total_stored
+        self.stdout.write(
+            f"Total: {total_text / 1024:.1f} KB of text stored in {total_stored / 1024:.1f} KB "
+            f"({saved / 1024:.1f} KB saved)"
+        )
+        for using in connections:
+            if connections[using].vendor != 'sqlite':
+                continue
+            path = settings.DATABASES[using]['NAME']
+            if os.path.exists(path):
+                self.stdout.write(
+                    f"Database file [{using}]: {os.path.getsize(path) / 1024:.1f} KB "
+                    "(run VACUUM to return space freed by compression to the filesystem)"
+                )
+
+    def report_column(self, model, field_name, using):
+        rows = plain = text_bytes = stored_bytes = 0
+        decompress_seconds = compress_seconds = 0.0
+        for value in iter_stored_values(model, field_name):
+            if value is None:
+                continue
+            rows += 1
+            if isinstance(value, str):
+                # Not compressed yet (see migration 0011)
+                plain += 1
+                text = value
+                stored_bytes += len(value.encode('utf-8'))
+            else:
+                stored_bytes += len(value)
+                started = time.perf_counter()
+                text = decompress(value)
+                decompress_seconds += time.perf_counter() - started
+            text_bytes += len(text.encode('utf-8'))
+            started = time.perf_counter()
+            compress(text)
+            compress_seconds += time.perf_counter() - started
+
+        ratio = text_bytes / stored_bytes if stored_bytes else 0
+        self.stdout.write(
+            f"{model._meta.label + '.' + field_name:45} {using:10} {rows:>7} {plain:>7} {text_bytes / 1024:>10.1f} "
+            f"{stored_bytes / 1024:>10.1f} {ratio:>5.1f}x {decompress_seconds * 1000:>10.1f} "
+            f"{compress_seconds * 1000:>8.1f}"
+        )
+        return text_bytes, stored_bytes
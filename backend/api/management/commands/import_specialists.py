@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.specialists import enrich_specialties, import_specialists, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Load the specialist directory from a CSV or JSON file with name, specialty, address, phone, "
+        "website and latitude/longitude (or lat/lng) columns."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--replace', action='store_true',
+                            help="Delete the existing directory before importing.")
+        parser.add_argument('--enrich', action='store_true',
+                            help="Afterwards, describe every specialty with the LLM (cached as term definitions).")
+
+    def handle(self, *args, **options):
+        try:
+            rows = read_rows(options['path'])
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Could not read {options['path']}: {e}")
+
+        imported, errors = import_specialists(rows, replace=options['replace'])
+        for error in errors:
+            self.stderr.write(f"Skipped {error}")
+        self.stdout.write(self.style.SUCCESS(f"Imported {imported} specialists ({len(errors)} rows skipped)"))
+        if options['enrich']:
+            definitions, missing = enrich_specialties()
+            cached = sum(1 for definition in definitions.values() if definition['cached'])
+            self.stdout.write(f"Described {len(definitions)} specialties ({cached} already cached)")
+            if missing:
+                self.stderr.write(f"Could not describe: {', '.join(missing)}")
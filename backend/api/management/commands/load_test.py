@@ -0,0 +1,110 @@
+import asyncio
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.loadtest import DEFAULT_MIX, COMPARED, LoadTest, compare, parse_mix, regressions, summarize
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive a running server with a mix of record, analysis, term and task requests and report "
+        "p50/p95/p99 latency and throughput per endpoint. Run the server with AI_PROVIDER_URL pointing "
+        "at run_fake_providers so no paid API is called."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--concurrency', type=int, default=10, help="Virtual users running at once.")
+        parser.add_argument('--duration', type=float, default=30, help="Seconds to run for.")
+        parser.add_argument('--operations', type=int,
+                            help="Stop after this many operations (or at --duration, whichever comes first).")
+        parser.add_argument('--mix', default=','.join(f'{name}={weight}' for name, weight in DEFAULT_MIX.items()),
+                            help="Relative weights of the operations, as name=weight,... (default: %(default)s)")
+        parser.add_argument('--profiles', type=int, default=3, help="Profiles created for the run.")
+        parser.add_argument('--timeout', type=float, default=120, help="Seconds before a request times out.")
+        parser.add_argument('--seed', type=int, help="Seed for the operation mix, to repeat a run.")
+        parser.add_argument('--output', help="Write the JSON report to this file.")
+        parser.add_argument('--compare', metavar='BASELINE', help="Compare with the JSON report of an earlier run.")
+        parser.add_argument('--max-regression', type=float, metavar='PCT',
+                            help="With --compare, fail if any endpoint's p95 grew by more than PCT percent.")
+
+    def handle(self, *args, **options):
+        try:
+            mix = parse_mix(options['mix'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        if min(options['concurrency'], options['profiles']) < 1:
+            raise CommandError("--concurrency and --profiles must be at least 1.")
+        baseline = None
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as f:
+                baseline = json.load(f)
+
+        config = {
+            'base_url': options['base_url'],
+            'concurrency': options['concurrency'],
+            'duration': options['duration'],
+            'operations': options['operations'],
+            'mix': mix,
+            'profiles': options['profiles'],
+        }
+        test = LoadTest(
+            options['base_url'],
+            concurrency=options['concurrency'],
+            duration=options['duration'],
+            operations=options['operations'],
+            mix=mix,
+            profiles=options['profiles'],
+            timeout=options['timeout'],
+            seed=options['seed'],
+        )
+        self.stdout.write(f"Running {options['concurrency']} virtual users against {options['base_url']}...")
+        try:
+            timings = asyncio.run(test.run())
+        except Exception as e:
+            raise CommandError(f"Load test failed: {e}")
+        report = summarize(timings, test.elapsed, config)
+
+        self._print_report(report)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Report written to {options['output']}")
+
+        if baseline is not None:
+            comparison = compare(baseline, report)
+            self._print_comparison(comparison)
+            if options['max_regression'] is not None:
+                regressed = regressions(comparison, options['max_regression'])
+                if regressed:
+                    raise CommandError(f"p95 grew by more than {options['max_regression']}% for: "
+                                       + ', '.join(regressed))
+
+    def _print_report(self, report):
+        total = report['total']
+        self.stdout.write(
+            f"\n{total['requests']} requests in {report['elapsed_s']}s "
+            f"({total['throughput_rps']} req/s), {total['errors']} errors\n"
+        )
+        self.stdout.write(f"{'endpoint':44} {'count':>6} {'errors':>6} {'req/s':>7} "
+                          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for endpoint, stats in [*report['endpoints'].items(), ('total', total)]:
+            self.stdout.write(
+                f"{endpoint:44} {stats['requests']:>6} {stats['errors']:>6} {_fmt(stats['throughput_rps']):>7} "
+                f"{_fmt(stats['p50_ms']):>8} {_fmt(stats['p95_ms']):>8} {_fmt(stats['p99_ms']):>8}"
+            )
+
+    def _print_comparison(self, comparison):
+        self.stdout.write("\nChange from baseline (latency: lower is better, req/s: higher is better)")
+        self.stdout.write(f"{'endpoint':44} " + ' '.join(f'{metric:>16}' for metric in COMPARED))
+        for endpoint, metrics in comparison.items():
+            cells = []
+            for metric in COMPARED:
+                change = metrics[metric]['change_pct']
+                cells.append(f"{_fmt(metrics[metric]['current'])} ({'n/a' if change is None else f'{change:+}%'})")
+            self.stdout.write(f"{endpoint:44} " + ' '.join(f'{cell:>16}' for cell in cells))
+
+
+def _fmt(value):
+    return '-' if value is None else f'{value:g}'
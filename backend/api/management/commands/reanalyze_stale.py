@@ -0,0 +1,55 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from api.documents import analysis_fingerprint
+from api.models import MedicalRecord
+from api.reanalysis import reanalyze_stale, stale_records
+from api.sharding import databases_for, use_shard
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-analyze records whose analysis came from an older prompt or model, most recently "
+        "viewed first. Safe to interrupt and run again: finished records are not redone."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5,
+                            help="Records analyzed concurrently per batch.")
+        parser.add_argument('--per-minute', type=float, default=30,
+                            help="Maximum analyses started per minute (0 for no limit).")
+        parser.add_argument('--limit', type=int, help="Stop after this many records (per database).")
+        parser.add_argument('--include-unanalyzed', action='store_true',
+                            help="Also analyze records that have never been analyzed.")
+        parser.add_argument('--status', action='store_true',
+                            help="Only report how many records are current or stale.")
+
+    def handle(self, *args, **options):
+        fingerprint = analysis_fingerprint()
+        for using in databases_for(MedicalRecord):
+            # Records of sharded accounts are re-analyzed shard by shard.
+            with use_shard(using):
+                stale = stale_records(fingerprint, options['include_unanalyzed']).count()
+                current = MedicalRecord.objects.filter(analysis_fingerprint=fingerprint).count()
+                self.stdout.write(f"[{using}] Analysis fingerprint {fingerprint}: {current} current, {stale} stale")
+                if stale and not options['status']:
+                    asyncio.run(self.run(options))
+
+    async def run(self, options):
+        ok = failed = 0
+        async for progress in reanalyze_stale(
+            batch_size=options['batch_size'],
+            per_minute=options['per_minute'],
+            limit=options['limit'],
+            include_unanalyzed=options['include_unanalyzed'],
+        ):
+            record = progress['record']
+            prefix = f"[{progress['done']}/{progress['total']}] record {record.id}"
+            if progress['ok']:
+                ok += 1
+                self.stdout.write(f"{prefix} re-analyzed in {progress['seconds']:.1f}s")
+            else:
+                failed += 1
+                self.stderr.write(f"{prefix} failed: {progress['error']}")
+        self.stdout.write(self.style.SUCCESS(f"Done: {ok} re-analyzed, {failed} failed"))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.sharding import account_load, move_account, plan_rebalance, shard_aliases
+
+
+class Command(BaseCommand):
+    help = (
+        "Move accounts between shards so each holds about the same number of records, "
+        "or move one account with --account and --to."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--account', help="Move only this account.")
+        parser.add_argument('--to', help="Shard to move --account to, e.g. shard_2.")
+        parser.add_argument('--dry-run', action='store_true', help="Only print the planned moves.")
+
+    def handle(self, *args, **options):
+        aliases = shard_aliases()
+        if options['account'] or options['to']:
+            if not (options['account'] and options['to'] in aliases):
+                raise CommandError(f"--account and --to (one of {', '.join(aliases)}) go together.")
+            moves = [(options['account'], None, options['to'])]
+        else:
+            loads = {alias: account_load(alias) for alias in aliases}
+            for alias, accounts in loads.items():
+                self.stdout.write(f"{alias}: {len(accounts)} accounts, {sum(accounts.values())} records")
+            moves = plan_rebalance(loads)
+
+        if not moves:
+            self.stdout.write(self.style.SUCCESS("Shards are balanced"))
+            return
+        for account, source, target in moves:
+            if options['dry_run']:
+                self.stdout.write(f"Would move {account!r} from {source} to {target}")
+                continue
+            moved = move_account(account, target)
+            self.stdout.write(f"Moved {account!r} to {target} ({moved} rows)")
+        self.stdout.write(self.style.SUCCESS("Done"))
@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.fake_providers import PROVIDERS, FakeProviderServer, ProviderFixtures, parse_latency
+
+
+class Command(BaseCommand):
+    help = "Serve fake Vision/Gemini/Perplexity endpoints for local testing."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency', action='append', default=[],
+                            help="Delay before every response: seconds, uniform:LOW,HIGH, normal:MEAN,STDDEV, "
+                                 "lognormal:MEDIAN,SIGMA or recorded. Prefix with a provider "
+                                 "(e.g. gemini=lognormal:1.5,0.4) to set it for one provider; may be repeated.")
+        parser.add_argument('--jitter', type=float, default=0.0,
+                            help="Extra random delay of up to this many seconds.")
+        parser.add_argument('--fixtures', help="Replay the responses recorded in this JSON file.")
+        parser.add_argument('--record', metavar='PATH',
+                            help="Forward requests to the real providers (needs their API keys) and append "
+                                 "the responses and their latencies to PATH.")
+        parser.add_argument('--verbose', action='store_true', help="Log every request.")
+
+    def handle(self, *args, **options):
+        if options['fixtures'] and options['record']:
+            raise CommandError("Use either --fixtures or --record.")
+        latency = dict.fromkeys(PROVIDERS, '0')
+        for spec in options['latency']:
+            provider, sep, distribution = spec.rpartition('=')
+            if sep and provider not in PROVIDERS:
+                raise CommandError(f"Unknown provider {provider!r}; expected one of {', '.join(PROVIDERS)}")
+            try:
+                parse_latency(distribution)
+            except ValueError as e:
+                raise CommandError(str(e))
+            for name in [provider] if sep else PROVIDERS:
+                latency[name] = distribution
+
+        try:
+            server = FakeProviderServer(
+                host=options['host'],
+                port=options['port'],
+                latency=latency,
+                jitter=options['jitter'],
+                verbose=options['verbose'],
+                fixtures=ProviderFixtures.load(options['fixtures']) if options['fixtures'] else None,
+                record_to=options['record'],
+            )
+        except ValueError as e:
+            raise CommandError(f"Can't read the fixtures: {e}")
+        mode = f"recording to {options['record']}" if options['record'] else (
+            f"replaying {options['fixtures']}" if options['fixtures'] else "canned responses")
+        self.stdout.write(f"Fake providers listening on {server.url}, {mode} (set AI_PROVIDER_URL to use them)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,34 @@
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.periodic import run_forever, run_task
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the maintenance tasks in PERIODIC_TASKS once (for cron), or keep running them on "
+        "their intervals with --loop."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--task', action='append', dest='tasks',
+                            help="Dotted path of a task to run; may be repeated. Defaults to all of them.")
+        parser.add_argument('--loop', action='store_true',
+                            help="Keep running, each task on its interval.")
+
+    def handle(self, *args, **options):
+        tasks = settings.PERIODIC_TASKS
+        if options['tasks']:
+            unknown = set(options['tasks']) - set(tasks)
+            if unknown:
+                raise CommandError(f"Not in PERIODIC_TASKS: {', '.join(sorted(unknown))}")
+            tasks = {path: tasks[path] for path in options['tasks']}
+
+        if options['loop']:
+            asyncio.run(run_forever(tasks))
+            return
+        for path in tasks:
+            result = run_task(path)
+            self.stdout.write(f"{path}: {result}")
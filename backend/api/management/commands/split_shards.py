@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import AccountShard
+from api.sharding import account_load, move_account, shard_aliases
+
+
+class Command(BaseCommand):
+    help = (
+        "Create and migrate the SHARD_COUNT shard databases, then move every account's profiles, "
+        "records and tasks out of the default database into its shard."
+    )
+
+    def handle(self, *args, **options):
+        aliases = shard_aliases()
+        if not aliases:
+            raise CommandError("Set SHARD_COUNT to the number of shards first.")
+
+        settings.SHARD_DIR.mkdir(parents=True, exist_ok=True)
+        for alias in aliases:
+            call_command('migrate', database=alias, verbosity=0)
+            self.stdout.write(f"Migrated {alias}")
+
+        # New accounts go to the shard with the fewest records; accounts already
+        # mapped to a shard (seen since sharding was enabled) are merged into it.
+        totals = {alias: sum(account_load(alias).values()) for alias in aliases}
+        mapped = dict(AccountShard.objects.filter(shard__in=aliases).values_list('account', 'shard'))
+        legacy = account_load('default')
+        for account in sorted(legacy):
+            target = mapped.get(account) or min(aliases, key=totals.get)
+            moved = move_account(account, target, source='default')
+            totals[target] += legacy[account]
+            self.stdout.write(f"Moved account {account!r} to {target} ({moved} rows)")
+        self.stdout.write(self.style.SUCCESS("Done"))
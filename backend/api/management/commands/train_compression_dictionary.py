@@ -0,0 +1,48 @@
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.fields import compressed_columns, iter_stored_values
+from api.sharding import databases_for, use_shard
+
+
+class Command(BaseCommand):
+    help = (
+        "Train a zstd dictionary from the current compressed text columns. Point "
+        "COMPRESSED_TEXT_ZSTD_DICTIONARY at the output and set COMPRESSED_TEXT_CODEC = 'zstd' to use it. "
+        "Never delete a dictionary that values were written with."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help="Defaults to COMPRESSED_TEXT_ZSTD_DICTIONARY.")
+        parser.add_argument('--size', type=int, default=112640, help="Dictionary size in bytes.")
+        parser.add_argument('--max-samples', type=int, default=20000)
+
+    def handle(self, *args, **options):
+        try:
+            import zstandard
+        except ImportError:
+            raise CommandError("Training a dictionary requires the zstandard package.")
+
+        output = options['output'] or getattr(settings, 'COMPRESSED_TEXT_ZSTD_DICTIONARY', None)
+        if not output:
+            raise CommandError("Pass --output or set COMPRESSED_TEXT_ZSTD_DICTIONARY.")
+
+        samples = []
+        for model, field_name in compressed_columns():
+            for using in databases_for(model):
+                # Columns of sharded models are sampled shard by shard.
+                with use_shard(using):
+                    values = (str(value).encode('utf-8') for value in iter_stored_values(model, field_name) if value)
+                    samples.extend(islice(values, options['max_samples'] - len(samples)))
+        if len(samples) < 100:
+            raise CommandError(f"Only {len(samples)} samples found; need at least 100 to train a useful dictionary.")
+
+        dictionary = zstandard.train_dictionary(options['size'], samples)
+        with open(output, 'wb') as f:
+            f.write(dictionary.as_bytes())
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote dictionary {dictionary.dict_id()} ({len(dictionary.as_bytes())} bytes) "
+            f"trained on {len(samples)} values to {output}"
+        ))
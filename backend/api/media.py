@@ -0,0 +1,218 @@
+"""
+Serving of uploaded media (scans under MEDIA_ROOT).
+
+Replaces ``django.conf.urls.static.static``, which re-sends every file in full
+with no caching headers. This view:
+
+* only serves scans of the requesting account's records and pages (staff may
+  see every file), answering 404 for anyone else's,
+* answers ``If-None-Match`` / ``If-Modified-Since`` with 304,
+* serves single ``Range`` requests with 206, so the zoom view can fetch parts
+  of large scans and resume interrupted downloads,
+* marks content-hashed paths (see ``content_hashed_upload_to``) as immutable
+  so browsers never revalidate them,
+* under ASGI, streams the file through an async iterator, which the server
+  sends chunk by chunk (a sync iterator would be read into memory in full
+  first), and
+* with ``MEDIA_ACCEL_MODE`` set, only checks the request and hands the actual
+  byte copying to the front proxy via ``X-Accel-Redirect`` (nginx) or
+  ``X-Sendfile`` (Apache/lighttpd).
+"""
+import hashlib
+import mimetypes
+import os
+import re
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_etags
+from django.views.decorators.http import require_safe
+from django.views.static import was_modified_since
+
+# Names produced by content_hashed_upload_to: a sha256 hex digest, optionally
+# followed by the "_xxxxxxx" suffix storage adds when the name already exists.
+HASHED_NAME_RE = re.compile(r'^(?P<digest>[0-9a-f]{64})(?:_[A-Za-z0-9]{7})?(?:\.[A-Za-z0-9]+)?$')
+RANGE_RE = re.compile(r'^bytes=(?P<start>\d*)-(?P<end>\d*)$')
+IMMUTABLE_CACHE_CONTROL = 'private, max-age=31536000, immutable'  # Scans are per account: no shared caches
+CHUNK_SIZE = 64 * 1024
+
+
+def file_digest(file):
+    """Return the sha256 hex digest of a Django ``File``, reading it in chunks."""
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def content_hashed_upload_to(directory, field_file, filename):
+    """
+    Name an upload after the sha256 of its content, e.g.
+    ``medical_records/<digest>.jpg``. A file's URL then changes whenever its
+    bytes do, which is what makes the immutable cache headers safe.
+    """
+    return f"{directory}/{file_digest(field_file.file)}{Path(filename).suffix.lower()}"
+
+
+def _etag(path, stat):
+    match = HASHED_NAME_RE.match(Path(path).name)
+    if match:
+        return f'"{match.group("digest")}"'
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def _parse_range(header, size):
+    """
+    Return ``(start, end)`` (inclusive) for a single byte range, ``None`` if the
+    header should be ignored (missing, malformed or multi-range), or ``False``
+    if the range can't be satisfied.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match or (not match['start'] and not match['end']):
+        return None
+    if size == 0:
+        return False  # An empty file has no bytes to select
+    if match['start']:
+        start = int(match['start'])
+        end = min(int(match['end']), size - 1) if match['end'] else size - 1
+        if start >= size or start > end:
+            return False
+    else:
+        # Suffix range: the last N bytes
+        length = int(match['end'])
+        if length == 0:
+            return False
+        start, end = max(size - length, 0), size - 1
+    return start, end
+
+
+def _read_range(full_path, start, end):
+    with open(full_path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+async def _aread_range(full_path, start, end):
+    # Not thread-sensitive: file reads needn't queue behind the sync views' thread.
+    f = await sync_to_async(open, thread_sensitive=False)(full_path, 'rb')
+    try:
+        await sync_to_async(f.seek, thread_sensitive=False)(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await sync_to_async(f.read, thread_sensitive=False)(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        await sync_to_async(f.close, thread_sensitive=False)()
+
+
+async def _no_content():
+    return
+    yield
+
+
+def _body(request, full_path, start, end):
+    """The response body: an async iterator under ASGI, a sync one under WSGI."""
+    if isinstance(request, ASGIRequest):
+        return _aread_range(full_path, start, end) if request.method == 'GET' else _no_content()
+    return _read_range(full_path, start, end) if request.method == 'GET' else iter(())
+
+
+def _belongs_to_account(request, path):
+    """Whether ``path`` is the image of a record or page of the request's account."""
+    from .models import MedicalRecord, MedicalRecordPage
+    from .sharding import for_account
+
+    if request.user.is_staff:
+        return True
+    account = getattr(request, 'account', None)
+    if account is None:
+        return False
+    return (for_account(MedicalRecord, account).filter(image=path).exists()
+            or for_account(MedicalRecordPage, account).filter(image=path).exists())
+
+
+@require_safe
+def serve_media(request, path):
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404("Invalid media path")
+    if not os.path.isfile(full_path) or not _belongs_to_account(request, path):
+        raise Http404("Media file not found")
+
+    stat = os.stat(full_path)
+    etag = _etag(path, stat)
+    immutable = bool(HASHED_NAME_RE.match(Path(path).name))
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Accept-Ranges': 'bytes',
+        # Non-hashed (legacy) names can be overwritten, so make browsers revalidate them.
+        'Cache-Control': IMMUTABLE_CACHE_CONTROL if immutable else 'no-cache',
+    }
+
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match:
+        if etag in parse_etags(if_none_match) or if_none_match.strip() == '*':
+            return HttpResponseNotModified(headers=headers)
+    elif not was_modified_since(request.headers.get('If-Modified-Since'), stat.st_mtime):
+        return HttpResponseNotModified(headers=headers)
+
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+
+    accel_mode = getattr(settings, 'MEDIA_ACCEL_MODE', None)
+    if accel_mode == 'x-accel-redirect':
+        # nginx serves the bytes (including Range) from an internal location.
+        response = HttpResponse(content_type=content_type, headers=headers)
+        response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_PREFIX.rstrip('/') + '/' + path.lstrip('/')
+        return response
+    if accel_mode == 'x-sendfile':
+        response = HttpResponse(content_type=content_type, headers=headers)
+        response['X-Sendfile'] = full_path
+        return response
+
+    size = stat.st_size
+    byte_range = None
+    if_range = request.headers.get('If-Range')
+    # A stale If-Range means the client's partial copy is outdated: send the whole file.
+    if not if_range or if_range.strip() == etag:
+        byte_range = _parse_range(request.headers.get('Range'), size)
+
+    if byte_range is False:
+        response = HttpResponse(status=416, headers=headers)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    if byte_range is None:
+        start, end, status = 0, size - 1, 200
+    else:
+        (start, end), status = byte_range, 206
+
+    response = StreamingHttpResponse(
+        _body(request, full_path, start, end),
+        status=status,
+        content_type=content_type,
+        headers=headers,
+    )
+    response['Content-Length'] = str(end - start + 1 if size else 0)
+    if status == 206:
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    if encoding:
+        response['Content-Encoding'] = encoding
+    return response
@@ -0,0 +1,193 @@
+"""
+Garbage collection of media files no record refers to.
+
+Deleting a profile or record cascades in the database but leaves its scans
+in storage, and files can't simply be deleted along with their rows: content
+hashed names are shared (a record's image is also its first page's image).
+Instead the collector reconciles storage against the database:
+
+1. every file name stored in a FileField is written to a manifest,
+2. every file under ``MEDIA_GC_DIRECTORIES`` older than ``min_age`` is
+   written to a second manifest,
+3. both are sorted on disk (sorted runs of ``RUN_SIZE`` names, merged with
+   ``heapq.merge``) so memory use doesn't grow with the number of files, and
+4. a merge join of the two yields the stored files that aren't referenced.
+
+Orphans are deleted in batches at no more than ``rate`` files per second,
+re-checking each batch against the database first. ``min_age`` keeps files
+whose record is still being saved out of reach.
+"""
+import heapq
+import tempfile
+import time
+from datetime import timedelta
+from itertools import islice
+from pathlib import Path
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import models
+from django.utils import timezone
+
+from . import sharding
+
+RUN_SIZE = 100_000  # Names sorted in memory at once
+QUERY_CHUNK_SIZE = 2000
+
+
+def file_fields():
+    """Yield ``(model, field_name)`` for every FileField (and ImageField) in the project."""
+    for model in apps.get_models():
+        for field in model._meta.concrete_fields:
+            if isinstance(field, models.FileField):
+                yield model, field.name
+
+
+def referenced_names():
+    """Every stored file name, from every database that holds the model."""
+    for model, field_name in file_fields():
+        for using in sharding.databases_for(model):
+            yield from _referenced_names(model, field_name, using)
+
+
+def _referenced_names(model, field_name, using):
+    # A chunk at a time in primary-key order
+    last_pk = None
+    while True:
+        queryset = model.objects.using(using).order_by('pk').exclude(**{field_name: ''})
+        if last_pk is not None:
+            queryset = queryset.filter(pk__gt=last_pk)
+        rows = list(queryset.values_list('pk', field_name)[:QUERY_CHUNK_SIZE])
+        if not rows:
+            break
+        for _, name in rows:
+            yield name
+        last_pk = rows[-1][0]
+
+
+def stored_files(directories, min_age, storage=default_storage):
+    """Yield ``(name, size)`` for files under ``directories`` last modified before ``min_age`` ago."""
+    cutoff = timezone.now() - min_age
+    pending = list(directories)
+    while pending:
+        directory = pending.pop()
+        if not storage.exists(directory):
+            continue
+        subdirectories, files = storage.listdir(directory)
+        pending.extend(f'{directory}/{name}' for name in subdirectories)
+        for filename in files:
+            name = f'{directory}/{filename}'
+            if storage.get_modified_time(name) < cutoff:
+                yield name, storage.size(name)
+
+
+def write_sorted(lines, directory, prefix):
+    """
+    Sort ``lines`` on disk and return the path of the merged, de-duplicated
+    manifest. Lines must not contain newlines.
+    """
+    runs = []
+    iterator = iter(lines)
+    while True:
+        run = sorted(islice(iterator, RUN_SIZE))
+        if not run and runs:
+            break
+        path = Path(directory) / f'{prefix}-{len(runs)}.txt'
+        path.write_text(''.join(f'{line}\n' for line in run), encoding='utf-8')
+        runs.append(path)
+        if len(run) < RUN_SIZE:
+            break
+
+    manifest = Path(directory) / f'{prefix}.txt'
+    files = [open(path, encoding='utf-8') for path in runs]
+    try:
+        with open(manifest, 'w', encoding='utf-8') as out:
+            previous = None
+            for line in heapq.merge(*files):
+                if line != previous:
+                    out.write(line)
+                    previous = line
+    finally:
+        for f in files:
+            f.close()
+    for path in runs:
+        path.unlink()
+    return manifest
+
+
+def _read(manifest):
+    with open(manifest, encoding='utf-8') as f:
+        for line in f:
+            yield line.rstrip('\n')
+
+
+def find_orphans(stored_manifest, referenced_manifest):
+    """Merge-join the two sorted manifests; yield ``(name, size)`` of unreferenced files."""
+    referenced = _read(referenced_manifest)
+    current = next(referenced, None)
+    for line in _read(stored_manifest):
+        # A tab sorts before any character of a name, so "name\tsize" lines
+        # are in the same order as the names themselves.
+        name, _, size = line.rpartition('\t')
+        while current is not None and current < name:
+            current = next(referenced, None)
+        if current != name:
+            yield name, int(size)
+
+
+def _still_referenced(names):
+    found = set()
+    for model, field_name in file_fields():
+        for using in sharding.databases_for(model):
+            queryset = model.objects.using(using).filter(**{f'{field_name}__in': names})
+            found.update(queryset.values_list(field_name, flat=True))
+    return found
+
+
+def collect_garbage(dry_run=False, batch_size=None, rate=None, min_age=None, storage=default_storage):
+    """
+    Delete unreferenced media (or only report them with ``dry_run``) and
+    return ``{'scanned', 'orphans', 'bytes', 'deleted', 'paths'}``; ``paths``
+    lists the orphans only for a dry run. Refuses to run (ImproperlyConfigured)
+    while a shard in the shard map isn't configured.
+    """
+    sharding.check_shard_map()
+    batch_size = batch_size or settings.MEDIA_GC_BATCH_SIZE
+    rate = settings.MEDIA_GC_RATE if rate is None else rate
+    min_age = timedelta(seconds=settings.MEDIA_GC_MIN_AGE if min_age is None else min_age)
+    report = {'scanned': 0, 'orphans': 0, 'bytes': 0, 'deleted': 0, 'paths': []}
+
+    def stored_lines():
+        for name, size in stored_files(settings.MEDIA_GC_DIRECTORIES, min_age, storage):
+            if '\n' in name or '\t' in name:
+                continue  # Can't be represented in the manifest; never touched
+            report['scanned'] += 1
+            yield f'{name}\t{size}'
+
+    with tempfile.TemporaryDirectory(prefix='media-gc-') as directory:
+        referenced = write_sorted((name for name in referenced_names() if '\n' not in name), directory, 'referenced')
+        stored = write_sorted(stored_lines(), directory, 'stored')
+
+        interval = batch_size / rate if rate else 0
+        orphans = find_orphans(stored, referenced)
+        while True:
+            batch = list(islice(orphans, batch_size))
+            if not batch:
+                break
+            started = time.monotonic()
+            # Anything saved since the manifest was written is left alone.
+            keep = _still_referenced([name for name, _ in batch])
+            for name, size in batch:
+                if name in keep:
+                    continue
+                report['orphans'] += 1
+                report['bytes'] += size
+                if dry_run:
+                    report['paths'].append(name)
+                else:
+                    storage.delete(name)
+                    report['deleted'] += 1
+            if not dry_run:
+                time.sleep(max(0, interval - (time.monotonic() - started)))
+    return report
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_remove_medicalrecord_raw_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TermDefinition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=200, unique=True)),
+                ('definition', models.TextField()),
+                ('citations', models.JSONField(blank=True, default=list)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
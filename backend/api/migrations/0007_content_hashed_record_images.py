@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:26
+
+import api.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_termdefinition'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='medicalrecord',
+            name='image',
+            field=models.ImageField(upload_to=api.models.medical_record_upload_to),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:27
+
+import api.models
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_content_hashed_record_images'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentChunkAnalysis',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chunk_hash', models.CharField(max_length=64)),
+                ('analysis', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('record', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunk_analyses', to='api.medicalrecord')),
+            ],
+            options={
+                'unique_together': {('record', 'chunk_hash')},
+            },
+        ),
+        migrations.CreateModel(
+            name='MedicalRecordPage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField()),
+                ('image', models.ImageField(upload_to=api.models.medical_record_page_upload_to)),
+                ('content_hash', models.CharField(db_index=True, max_length=64)),
+                ('ocr_text', models.TextField(blank=True, null=True)),
+                ('ocr_hash', models.CharField(blank=True, max_length=64)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('record', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pages', to='api.medicalrecord')),
+            ],
+            options={
+                'ordering': ['index'],
+                'unique_together': {('record', 'index')},
+            },
+        ),
+    ]
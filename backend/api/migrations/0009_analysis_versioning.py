@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_medicalrecordpage_documentchunkanalysis'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medicalrecord',
+            name='analysis_fingerprint',
+            field=models.CharField(blank=True, db_index=True, max_length=16),
+        ),
+        migrations.AddField(
+            model_name='medicalrecord',
+            name='analyzed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='medicalrecord',
+            name='last_viewed_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
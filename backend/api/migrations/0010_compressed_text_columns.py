@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:30
+
+import api.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_analysis_versioning'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='documentchunkanalysis',
+            name='analysis',
+            field=api.fields.CompressedTextField(),
+        ),
+        migrations.AlterField(
+            model_name='medicalrecord',
+            name='analysis_actions',
+            field=api.fields.CompressedTextField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='medicalrecord',
+            name='analysis_recommendations',
+            field=api.fields.CompressedTextField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='medicalrecord',
+            name='analysis_summary',
+            field=api.fields.CompressedTextField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='medicalrecord',
+            name='description',
+            field=api.fields.CompressedTextField(),
+        ),
+        migrations.AlterField(
+            model_name='medicalrecordpage',
+            name='ocr_text',
+            field=api.fields.CompressedTextField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,63 @@
+"""
+Compress text written before 0010 made these columns compressed.
+
+SQLite keeps the old values as TEXT inside the new BLOB columns, and
+CompressedTextField reads them back as plain strings, so the app works before
+and during this migration. Rows are converted in primary-key order, CHUNK_SIZE
+at a time, each chunk in its own transaction; an interrupted run leaves a
+mix of compressed and plain rows and simply continues on the next migrate.
+"""
+from django.db import migrations, models, transaction
+from django.db.models import Value
+
+CHUNK_SIZE = 500
+
+COLUMNS = {
+    'medicalrecord': ['description', 'analysis_summary', 'analysis_actions', 'analysis_recommendations'],
+    'medicalrecordpage': ['ocr_text'],
+    'documentchunkanalysis': ['analysis'],
+}
+
+
+def convert(apps, using, compress_rows):
+    for model_name, fields in COLUMNS.items():
+        model = apps.get_model('api', model_name)
+        last_pk = 0
+        while True:
+            rows = list(
+                model.objects.using(using).filter(pk__gt=last_pk).order_by('pk').values_list('pk', *fields)[:CHUNK_SIZE]
+            )
+            if not rows:
+                break
+            with transaction.atomic(using=using):
+                for pk, *values in rows:
+                    changes = {}
+                    for field, value in zip(fields, values):
+                        # Legacy rows come back as str, compressed ones as CompressedText (bytes).
+                        if compress_rows and isinstance(value, str):
+                            changes[field] = value
+                        elif not compress_rows and isinstance(value, bytes):
+                            changes[field] = Value(str(value), output_field=models.TextField())
+                    if changes:
+                        model.objects.using(using).filter(pk=pk).update(**changes)
+            last_pk = rows[-1][0]
+
+
+def compress_existing(apps, schema_editor):
+    convert(apps, schema_editor.connection.alias, compress_rows=True)
+
+
+def decompress_existing(apps, schema_editor):
+    convert(apps, schema_editor.connection.alias, compress_rows=False)
+
+
+class Migration(migrations.Migration):
+    atomic = False  # Commit chunk by chunk
+
+    dependencies = [
+        ('api', '0010_compressed_text_columns'),
+    ]
+
+    operations = [
+        migrations.RunPython(compress_existing, decompress_existing),
+    ]
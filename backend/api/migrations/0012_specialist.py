@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_compress_existing_text'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Specialist',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200)),
+                ('specialty', models.CharField(max_length=100)),
+                ('address', models.CharField(blank=True, max_length=300)),
+                ('phone', models.CharField(blank=True, max_length=50)),
+                ('website', models.URLField(blank=True, max_length=300)),
+                ('latitude', models.FloatField()),
+                ('longitude', models.FloatField()),
+                ('geohash', models.CharField(max_length=12)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['specialty', 'geohash'], name='api_special_special_f60035_idx'), models.Index(fields=['geohash'], name='api_special_geohash_a4425b_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_uploadsession'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account', models.CharField(max_length=100, unique=True)),
+                ('shard', models.CharField(max_length=50)),
+                ('moving', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='account',
+            field=models.CharField(blank=True, db_index=True, max_length=100),
+        ),
+    ]
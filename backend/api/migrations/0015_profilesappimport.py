@@ -0,0 +1,24 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_account_shards'),
+    ]
+
+    operations = [
+        # Progress of 0016 copying the retired profiles app's rows; removed again by 0016.
+        migrations.CreateModel(
+            name='ProfilesAppImport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source_table', models.CharField(max_length=50)),
+                ('source_id', models.BigIntegerField()),
+                ('target_id', models.BigIntegerField()),
+            ],
+            options={
+                'unique_together': {('source_table', 'source_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,141 @@
+"""
+Move the rows of the retired ``profiles`` app into the api tables and drop its tables.
+
+``profiles`` duplicated api's Profile and MedicalRecord. Its rows are copied
+in primary-key order, CHUNK_SIZE at a time with bulk_create; each chunk and
+the ids it was given (ProfilesAppImport, from 0015) are committed together, so
+an interrupted run continues after the last copied row on the next migrate
+while the site keeps serving. Its records had no date or scan any more: they
+get the date they were created and no image. The copied profiles belong to
+the default account, like every profile from before accounts (see 0019).
+
+The app's own models are gone from the migration state, so the old tables are
+read through unmanaged stand-ins (``_legacy_models``): the ORM then converts
+their values, e.g. timestamps, the same way on every database backend.
+"""
+from django.apps.registry import Apps
+from django.db import migrations, models, transaction
+from django.db.migrations.recorder import MigrationRecorder
+
+CHUNK_SIZE = 500
+DEFAULT_ACCOUNT = 'default'  # api.sharding.DEFAULT_ACCOUNT when this was written
+
+PROFILE_TABLE = 'profiles_profile'
+RECORD_TABLE = 'profiles_medicalrecord'
+
+
+def _legacy_models():
+    """Unmanaged models over the profiles app's tables, in a registry of their own."""
+    registry = Apps()
+
+    def model(class_name, table, **fields):
+        meta = type('Meta', (), {'app_label': 'profiles', 'db_table': table, 'managed': False, 'apps': registry})
+        return type(class_name, (models.Model,), {'__module__': __name__, 'Meta': meta, **fields})
+
+    profile = model(
+        'Profile', PROFILE_TABLE,
+        name=models.CharField(max_length=100),
+        relationship=models.CharField(max_length=100),
+        created_at=models.DateTimeField(),
+        updated_at=models.DateTimeField(),
+    )
+    record = model(
+        'MedicalRecord', RECORD_TABLE,
+        profile_id=models.IntegerField(),  # No foreign key needed to read the column
+        title=models.CharField(max_length=200),
+        description=models.TextField(),
+        created_at=models.DateTimeField(),
+        updated_at=models.DateTimeField(),
+    )
+    return profile, record
+
+
+def _keep_timestamps(model):
+    # Historical models still set auto_now(_add) fields on save; keep the copied values.
+    for field in model._meta.concrete_fields:
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+            field.auto_now = field.auto_now_add = False
+
+
+def copy_table(apps, using, legacy_model, build):
+    """
+    Copy the rows of ``legacy_model`` chunk by chunk, ``build(row)`` making
+    the api object for a row. Returns ``{old id: new id}``.
+    """
+    ProfilesAppImport = apps.get_model('api', 'ProfilesAppImport')
+    table = legacy_model._meta.db_table
+    progress = ProfilesAppImport.objects.using(using).filter(source_table=table)
+    ids = dict(progress.values_list('source_id', 'target_id'))
+
+    last_id = max(ids, default=0)
+    while True:
+        rows = list(legacy_model.objects.using(using).filter(id__gt=last_id).order_by('id')[:CHUNK_SIZE])
+        if not rows:
+            break
+        objects = [build(row) for row in rows]
+        with transaction.atomic(using=using):
+            model = type(objects[0])
+            model.objects.using(using).bulk_create(objects)
+            checkpoints = [
+                ProfilesAppImport(source_table=table, source_id=row.id, target_id=obj.pk)
+                for row, obj in zip(rows, objects)
+            ]
+            ProfilesAppImport.objects.using(using).bulk_create(checkpoints)
+        ids.update((row.id, obj.pk) for row, obj in zip(rows, objects))
+        last_id = rows[-1].id
+    return ids
+
+
+def merge_profiles_app(apps, schema_editor):
+    connection = schema_editor.connection
+    if PROFILE_TABLE not in connection.introspection.table_names():
+        return  # Never installed here, or already merged
+
+    Profile = apps.get_model('api', 'Profile')
+    MedicalRecord = apps.get_model('api', 'MedicalRecord')
+    _keep_timestamps(Profile)
+    _keep_timestamps(MedicalRecord)
+    LegacyProfile, LegacyRecord = _legacy_models()
+
+    def build_profile(row):
+        return Profile(
+            name=row.name,
+            relationship=row.relationship,
+            account=DEFAULT_ACCOUNT,
+            created_at=row.created_at,
+            updated_at=row.updated_at,
+        )
+
+    def build_record(row):
+        return MedicalRecord(
+            profile_id=profile_ids[row.profile_id],
+            title=row.title,
+            description=row.description,
+            date=row.created_at.date(),
+            image='',
+            created_at=row.created_at,
+            updated_at=row.updated_at,
+        )
+
+    profile_ids = copy_table(apps, connection.alias, LegacyProfile, build_profile)
+    copy_table(apps, connection.alias, LegacyRecord, build_record)
+
+    # Only once everything is copied
+    with transaction.atomic(using=connection.alias):
+        schema_editor.execute(f'DROP TABLE {schema_editor.quote_name(RECORD_TABLE)}')
+        schema_editor.execute(f'DROP TABLE {schema_editor.quote_name(PROFILE_TABLE)}')
+        MigrationRecorder(connection).migration_qs.filter(app='profiles').delete()
+
+
+class Migration(migrations.Migration):
+    atomic = False  # Commit chunk by chunk
+
+    dependencies = [
+        ('api', '0015_profilesappimport'),
+    ]
+
+    operations = [
+        # Not reversible: the profiles app and its tables are gone.
+        migrations.RunPython(merge_profiles_app, migrations.RunPython.noop),
+        migrations.DeleteModel(name='ProfilesAppImport'),
+    ]
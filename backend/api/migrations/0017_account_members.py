@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:01
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_merge_profiles_app'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountMember',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account', models.CharField(db_index=True, max_length=100)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='account_member', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_account_members'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PeriodicTaskRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task', models.CharField(max_length=200, unique=True)),
+                ('next_run_at', models.DateTimeField()),
+                ('last_started_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
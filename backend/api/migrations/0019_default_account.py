@@ -0,0 +1,29 @@
+"""
+Give profiles without an account (created before 0014 added the column, or
+merged from the profiles app by 0016 before it set one) the default account,
+which requests that don't name an account use (api.sharding.DEFAULT_ACCOUNT).
+"""
+from django.db import migrations, models
+
+DEFAULT_ACCOUNT = 'default'  # api.sharding.DEFAULT_ACCOUNT when this was written
+
+
+def assign_default_account(apps, schema_editor):
+    Profile = apps.get_model('api', 'Profile')
+    Profile.objects.using(schema_editor.connection.alias).filter(account='').update(account=DEFAULT_ACCOUNT)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_periodic_task_runs'),
+    ]
+
+    operations = [
+        migrations.RunPython(assign_default_account, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='profile',
+            name='account',
+            field=models.CharField(db_index=True, default=DEFAULT_ACCOUNT, max_length=100),
+        ),
+    ]
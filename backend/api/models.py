@@ -1,8 +1,23 @@
+import uuid
+
+from django.conf import settings
 from django.db import models
 
+from . import geo
+from .fields import CompressedTextField
+from .media import content_hashed_upload_to
+from .sharding import DEFAULT_ACCOUNT
+
 # Create your models here.
 
+def medical_record_upload_to(instance, filename):
+    return content_hashed_upload_to('medical_records', instance.image, filename)
+
+def medical_record_page_upload_to(instance, filename):
+    return content_hashed_upload_to('medical_records/pages', instance.image, filename)
+
 class Profile(models.Model):
+    account = models.CharField(max_length=100, default=DEFAULT_ACCOUNT, db_index=True) # Family the profile belongs to, see api.sharding
     name = models.CharField(max_length=100)
     relationship = models.CharField(max_length=100)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -11,22 +26,120 @@ class Profile(models.Model):
     def __str__(self):
         return self.name
 
+class AccountShard(models.Model):
+    """Shard map: the database holding an account's profiles and records (see api.sharding)."""
+    account = models.CharField(max_length=100, unique=True)
+    shard = models.CharField(max_length=50) # A DATABASES alias, e.g. 'shard_0'
+    moving = models.BooleanField(default=False) # Being copied to another shard
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.account} -> {self.shard}"
+
+class AccountMember(models.Model):
+    """Puts a user in a family account, so family members see the same profiles (see api.sharding)."""
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, related_name='account_member', on_delete=models.CASCADE)
+    account = models.CharField(max_length=100, db_index=True)
+
+    def __str__(self):
+        return f"{self.user} -> {self.account}"
+
+class PeriodicTaskRun(models.Model):
+    """When a periodic task (see api.periodic) is next due; shared by every server process."""
+    task = models.CharField(max_length=200, unique=True) # Dotted path, as in PERIODIC_TASKS
+    next_run_at = models.DateTimeField()
+    last_started_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return self.task
+
 class MedicalRecord(models.Model):
     profile = models.ForeignKey(Profile, related_name='records', on_delete=models.CASCADE)
     title = models.CharField(max_length=200)
     date = models.DateField()
-    description = models.TextField()
-    image = models.ImageField(upload_to='medical_records/')
+    description = CompressedTextField()
+    image = models.ImageField(upload_to=medical_record_upload_to)
     image_data = models.TextField(blank=True, null=True)
-    analysis_summary = models.TextField(blank=True, null=True)
-    analysis_actions = models.TextField(blank=True, null=True)
-    analysis_recommendations = models.TextField(blank=True, null=True)
+    analysis_summary = CompressedTextField(blank=True, null=True)
+    analysis_actions = CompressedTextField(blank=True, null=True)
+    analysis_recommendations = CompressedTextField(blank=True, null=True)
+    # Prompt/model version that produced the analysis_* fields (see documents.analysis_fingerprint)
+    analysis_fingerprint = models.CharField(max_length=16, blank=True, db_index=True)
+    analyzed_at = models.DateTimeField(blank=True, null=True)
+    last_viewed_at = models.DateTimeField(blank=True, null=True, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     def __str__(self):
         return f"{self.title} - {self.profile.name}"
 
+class MedicalRecordPage(models.Model):
+    """One page of a multi-page record, e.g. a page of a rasterized discharge PDF."""
+    record = models.ForeignKey(MedicalRecord, related_name='pages', on_delete=models.CASCADE)
+    index = models.PositiveIntegerField() # 0-based position within the record
+    image = models.ImageField(upload_to=medical_record_page_upload_to)
+    content_hash = models.CharField(max_length=64, db_index=True) # sha256 of the page image
+    ocr_text = CompressedTextField(blank=True, null=True)
+    ocr_hash = models.CharField(max_length=64, blank=True) # content_hash the ocr_text was produced from
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['index']
+        unique_together = [('record', 'index')]
+
+    @property
+    def needs_ocr(self):
+        return self.ocr_text is None or self.ocr_hash != self.content_hash
+
+    def __str__(self):
+        return f"{self.record.title} - page {self.index + 1}"
+
+class DocumentChunkAnalysis(models.Model):
+    """
+    Partial analysis of one chunk of a record's page text, keyed by a hash of
+    the chunk. Adding a page only changes the last chunk, so the others are
+    reused instead of being sent to the model again.
+    """
+    record = models.ForeignKey(MedicalRecord, related_name='chunk_analyses', on_delete=models.CASCADE)
+    chunk_hash = models.CharField(max_length=64)
+    analysis = CompressedTextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = [('record', 'chunk_hash')]
+
+    def __str__(self):
+        return f"{self.record.title} - chunk {self.chunk_hash[:8]}"
+
+class UploadSession(models.Model):
+    """
+    A resumable upload of a record's scan (see api.uploads). Chunks are
+    appended to a temp file until ``offset`` reaches ``length``; the file then
+    becomes a MedicalRecord built from ``metadata``.
+    """
+    STATUS_CHOICES = [
+        ('uploading', 'Uploading'),
+        ('complete', 'Complete'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    profile = models.ForeignKey(Profile, related_name='upload_sessions', on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255, blank=True)
+    length = models.PositiveBigIntegerField() # Total size in bytes, announced by the client
+    offset = models.PositiveBigIntegerField(default=0) # Bytes received so far
+    metadata = models.JSONField(default=dict, blank=True) # title, date and description of the record
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='uploading')
+    record = models.OneToOneField(
+        MedicalRecord, related_name='upload_session', null=True, blank=True, on_delete=models.SET_NULL
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True) # Last chunk; sessions idle too long expire
+
+    def __str__(self):
+        return f"{self.filename or self.id} ({self.offset}/{self.length})"
+
 class Task(models.Model):
     STATUS_CHOICES = [
         ('todo', 'To Do'),
@@ -47,3 +160,40 @@ class Task(models.Model):
 
     def __str__(self):
         return f"{self.title} ({self.get_status_display()}) - {self.profile.name}"
+
+class TermDefinition(models.Model):
+    """Cached layman definition of a highlighted medical term, shared across records."""
+    term = models.CharField(max_length=200, unique=True) # Normalized: lowercased, single-spaced
+    definition = models.TextField()
+    citations = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.term
+
+class Specialist(models.Model):
+    """An entry of the local specialist directory, imported with `manage.py import_specialists`."""
+    name = models.CharField(max_length=200)
+    specialty = models.CharField(max_length=100) # Normalized, e.g. 'cardiologist'
+    address = models.CharField(max_length=300, blank=True)
+    phone = models.CharField(max_length=50, blank=True)
+    website = models.URLField(max_length=300, blank=True)
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    geohash = models.CharField(max_length=12) # See api.geo; kept in sync by save()
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['specialty', 'geohash']),
+            models.Index(fields=['geohash']),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.geohash = geo.encode(self.latitude, self.longitude)
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.name} ({self.specialty})"
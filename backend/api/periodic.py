@@ -0,0 +1,71 @@
+"""
+Periodic maintenance tasks, such as expiring abandoned upload sessions.
+
+``settings.PERIODIC_TASKS`` maps the dotted path of a function that takes no
+arguments to how often it runs, in seconds. Under ASGI, ``backend.asgi``
+starts ``run_forever`` when the server starts, in every server process.
+Each run is claimed in the database (``PeriodicTaskRun``) first, so only
+one of the processes runs it, and the first run comes one interval after
+the first server start rather than on every restart. Without that (WSGI, or
+PERIODIC_TASKS_IN_PROCESS off) run ``python manage.py run_periodic_tasks``
+from cron.
+"""
+import asyncio
+import logging
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import PeriodicTaskRun
+
+logger = logging.getLogger(__name__)
+
+TICK = 30  # Seconds between checks for due tasks
+
+
+def run_task(path):
+    """Run one task in the current thread and return its result."""
+    close_old_connections()
+    try:
+        return import_string(path)()
+    finally:
+        # Tasks run in executor threads; don't leave their connections open.
+        connections.close_all()
+
+
+def claim(path, interval):
+    """
+    Take the task's next run if it is due: True for exactly one of the
+    processes asking. A task seen for the first time is due one interval
+    from now.
+    """
+    now = timezone.now()
+    try:
+        PeriodicTaskRun.objects.get_or_create(task=path, defaults={'next_run_at': now + timedelta(seconds=interval)})
+        # Compare-and-set: only the first process to move next_run_at gets the run.
+        return PeriodicTaskRun.objects.filter(task=path, next_run_at__lte=now).update(
+            next_run_at=now + timedelta(seconds=interval), last_started_at=now,
+        ) == 1
+    finally:
+        connections.close_all()
+
+
+async def run_forever(tasks=None):
+    """Run each task whenever its interval has passed and this process claimed the run."""
+    tasks = settings.PERIODIC_TASKS if tasks is None else tasks
+    while True:
+        for path, interval in tasks.items():
+            try:
+                # Not thread-sensitive, so a long task doesn't hold up sync views.
+                if not await sync_to_async(claim, thread_sensitive=False)(path, interval):
+                    continue
+                result = await sync_to_async(run_task, thread_sensitive=False)(path)
+            except Exception:
+                logger.exception("Periodic task %s failed", path)
+            else:
+                logger.info("Periodic task %s finished: %s", path, result)
+        await asyncio.sleep(TICK)
@@ -0,0 +1,76 @@
+"""
+Prompts sent to the AI providers. Kept in sync with the ones the frontend
+used when it called the providers directly.
+"""
+
+ANALYSIS_PROMPT = (
+    "Analyze this medical record image and provide information in the following three categories:\n\n"
+    "1. Summary: Brief explanation of the results in simple, layman's terms.\n\n"
+    "2. What can I do?: Suggest lifestyle changes, diet modifications, or exercises the patient can personally implement.\n\n"
+    "3. Where to go?: Recommend specific specialist doctors (e.g., cardiologist, endocrinologist) the patient should consult based on any abnormal values.\n\n"
+    "Keep each section concise, about 1-2 sentences each.\n\n"
+    "For each term in each section, if the term is complex, surround the term with ||. For example, ||medical-term||.\n\n"
+    "At the end of summary, list all specialists included in the Where to go section FORMAT AS FOLLOWS: "
+    "_included-specialists: specialist1, specialist2,..."
+)
+
+INTERPRETATION_PROMPT = """
+I have detected the following values in a medical document, with their associated test names:
+
+{values}
+
+For each value, provide a brief medical interpretation explaining:
+1. What this test measures
+2. The normal range (if applicable)
+3. What this specific value indicates (normal, high, low, etc.)
+4. Any potential health implications
+
+Format your response as a JSON object where each key is the exact value and each value is the interpretation:
+
+{{
+  "value1": "interpretation for value1",
+  "value2": "interpretation for value2",
+  ...
+}}
+
+Keep each interpretation under 100 words and focus on medical significance only.
+"""
+
+DEFINITION_SYSTEM_PROMPT = (
+    'You are a helpful assistant that provides concise medical definitions. Explain in simple terms that a '
+    'high-schooler could understand. If possible, break down into bullet points. Use only single returns. '
+    'Make sure to keep sources. If you cannot find a definition, say "Definition not found." and do not '
+    'return any other text.'
+)
+
+EXPLANATION_SYSTEM_PROMPT = (
+    'You are a helpful medical assistant that explains medical terms in very simple language, using analogies '
+    'when possible. Explain in simple terms that a high-schooler could understand.'
+)
+
+EXPLANATION_USER_PROMPT = (
+    'Please explain "{text}" in the simplest possible terms, as if explaining to someone with no medical '
+    'knowledge. Keep it to a maximum of 3 sentences total.'
+)
+
+BATCH_DEFINITION_SYSTEM_PROMPT = (
+    'You are a helpful assistant that provides concise medical definitions. Explain each term in simple terms '
+    'that a high-schooler could understand. If possible, break down into bullet points. Use only single returns. '
+    'Respond with only a JSON object whose keys are the terms exactly as given and whose values are the '
+    'definitions. If you cannot find a definition for a term, use "Definition not found." as its value.'
+)
+
+BATCH_DEFINITION_USER_PROMPT = "Define each of these medical terms:\n{terms}"
+
+CHUNK_ANALYSIS_PROMPT = (
+    "The following text was read from pages {first_page}-{last_page} of a longer medical document.\n\n"
+    + ANALYSIS_PROMPT.replace("this medical record image", "this part of the medical record")
+    + "\n\nDocument text:\n{text}"
+)
+
+MERGE_ANALYSIS_PROMPT = (
+    "Below are analyses of consecutive parts of one {page_count}-page medical document. Combine them into a "
+    "single analysis of the whole document, in exactly the same format: the three numbered categories, "
+    "complex terms surrounded with ||, and one _included-specialists line at the end. Drop repetition and "
+    "keep each section concise, about 1-3 sentences each.\n\n{analyses}"
+)
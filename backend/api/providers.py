@@ -0,0 +1,152 @@
+"""
+Async access to the external AI providers (Google Vision, Gemini, Perplexity).
+
+All outbound calls go through one pooled ``httpx.AsyncClient`` per event loop,
+so connections are kept alive between requests instead of paying a TLS
+handshake per analysis. Each provider also gets its own semaphore and timeout
+(see ``AI_PROVIDERS`` in settings) so a slow provider can only tie up its own
+slots, never the whole pool.
+"""
+import asyncio
+import weakref
+
+import httpx
+from django.conf import settings
+
+
+class ProviderError(Exception):
+    """Raised when a provider call fails, times out or returns an error."""
+
+    def __init__(self, provider, message, status_code=502):
+        super().__init__(f"{provider}: {message}")
+        self.provider = provider
+        self.status_code = status_code
+
+
+# Clients and semaphores are bound to the event loop that created them.
+_clients = weakref.WeakKeyDictionary()
+_semaphores = weakref.WeakKeyDictionary()
+
+
+def provider_config(provider):
+    try:
+        return settings.AI_PROVIDERS[provider]
+    except KeyError:
+        raise ProviderError(provider, "provider is not configured", status_code=500)
+
+
+def get_client():
+    """Return the shared client for the running event loop, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=settings.AI_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.AI_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.AI_HTTP_KEEPALIVE_EXPIRY,
+            ),
+        )
+        _clients[loop] = client
+    return client
+
+
+def get_semaphore(provider):
+    loop = asyncio.get_running_loop()
+    semaphores = _semaphores.setdefault(loop, {})
+    if provider not in semaphores:
+        semaphores[provider] = asyncio.Semaphore(provider_config(provider)['concurrency'])
+    return semaphores[provider]
+
+
+async def aclose_clients():
+    """Close the client of the running loop (called on ASGI lifespan shutdown)."""
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+async def post_json(provider, path, payload, params=None, headers=None):
+    """POST ``payload`` to ``path`` on ``provider`` and return the decoded JSON body."""
+    conf = provider_config(provider)
+    async with get_semaphore(provider):
+        try:
+            response = await get_client().post(
+                conf['base_url'].rstrip('/') + path,
+                json=payload,
+                params=params,
+                headers=headers,
+                timeout=conf['timeout'],
+            )
+        except httpx.TimeoutException:
+            raise ProviderError(provider, "request timed out", status_code=504)
+        except httpx.HTTPError as e:
+            raise ProviderError(provider, str(e))
+
+    if response.status_code >= 400:
+        raise ProviderError(provider, f"HTTP {response.status_code}: {response.text[:200]}")
+    try:
+        return response.json()
+    except ValueError:
+        raise ProviderError(provider, "response was not valid JSON")
+
+
+async def annotate_image(image_base64):
+    """Run Vision TEXT_DETECTION on a base64 image and return its text annotations."""
+    conf = provider_config('vision')
+    data = await post_json(
+        'vision',
+        '/v1/images:annotate',
+        {
+            'requests': [{
+                'image': {'content': image_base64},
+                'features': [{'type': 'TEXT_DETECTION', 'maxResults': 100}],
+            }],
+        },
+        params={'key': conf['api_key']},
+    )
+    responses = data.get('responses') or [{}]
+    return responses[0].get('textAnnotations', [])
+
+
+async def generate_content(prompt, image_base64=None, model=None, temperature=0.4, max_output_tokens=300):
+    """Send a prompt (and optionally a JPEG image) to Gemini and return the response text."""
+    conf = provider_config('gemini')
+    model = model or conf['model']
+    parts = [{'text': prompt}]
+    if image_base64:
+        parts.append({'inline_data': {'mime_type': 'image/jpeg', 'data': image_base64}})
+
+    data = await post_json(
+        'gemini',
+        f'/v1beta/models/{model}:generateContent',
+        {
+            'contents': [{'parts': parts}],
+            'generation_config': {
+                'temperature': temperature,
+                'top_p': 0.95,
+                'max_output_tokens': max_output_tokens,
+            },
+        },
+        params={'key': conf['api_key']},
+    )
+    try:
+        return data['candidates'][0]['content']['parts'][0]['text']
+    except (KeyError, IndexError, TypeError):
+        raise ProviderError('gemini', "response did not contain any text")
+
+
+async def chat_completion(messages, model='sonar'):
+    """Run a Perplexity chat completion and return ``(content, citations)``."""
+    conf = provider_config('perplexity')
+    data = await post_json(
+        'perplexity',
+        '/chat/completions',
+        {'model': model, 'messages': messages},
+        headers={'Authorization': f"Bearer {conf['api_key']}"} if conf['api_key'] else None,
+    )
+    try:
+        content = data['choices'][0]['message']['content']
+    except (KeyError, IndexError, TypeError):
+        raise ProviderError('perplexity', "response did not contain a completion")
+    return content, data.get('citations', [])
@@ -0,0 +1,86 @@
+"""
+Incremental re-analysis of records whose analysis is out of date.
+
+A record is stale when its ``analysis_fingerprint`` doesn't match the
+current prompt/model fingerprint. ``reanalyze_stale`` works through them in
+small batches, most recently viewed first, at no more than a fixed number of
+analyses per minute. Progress lives in the records themselves (a finished
+record gets the new fingerprint), so an interrupted run picks up where it
+stopped.
+"""
+import asyncio
+import logging
+import time
+
+from django.db.models import F
+
+from . import documents, providers
+from .models import MedicalRecord
+
+logger = logging.getLogger(__name__)
+
+
+def stale_records(fingerprint=None, include_unanalyzed=False):
+    fingerprint = fingerprint or documents.analysis_fingerprint()
+    queryset = MedicalRecord.objects.exclude(analysis_fingerprint=fingerprint)
+    if not include_unanalyzed:
+        # Records nobody has analyzed yet aren't stale, just new.
+        queryset = queryset.exclude(analysis_summary__isnull=True).exclude(analysis_summary='')
+    return queryset.order_by(F('last_viewed_at').desc(nulls_last=True), '-updated_at')
+
+
+async def reanalyze_stale(batch_size=5, per_minute=30, limit=None, include_unanalyzed=False):
+    """
+    Re-analyze stale records and yield one progress dict per record:
+    ``{'record', 'ok', 'error', 'done', 'total', 'seconds'}``.
+    """
+    fingerprint = documents.analysis_fingerprint()
+    queryset = stale_records(fingerprint, include_unanalyzed)
+    total = await queryset.acount()
+    if limit is not None:
+        total = min(total, limit)
+
+    interval = 60.0 / per_minute if per_minute else 0
+    failed = set()  # Not retried again in this run
+    done = 0
+    next_start = time.monotonic()
+
+    async def run(record, start_at):
+        await asyncio.sleep(max(0, start_at - time.monotonic()))
+        started = time.monotonic()
+        try:
+            await documents.analyze_record(record)
+            return record, None, time.monotonic() - started
+        except (documents.DocumentError, providers.ProviderError) as e:
+            return record, str(e), time.monotonic() - started
+        except Exception as e:
+            # e.g. the scan is missing from storage (OSError): record it and move on
+            logger.exception("Re-analysis of record %s failed", record.id)
+            return record, f"{type(e).__name__}: {e}", time.monotonic() - started
+
+    while done < total:
+        size = min(batch_size, total - done)
+        batch = [record async for record in queryset.exclude(id__in=failed)[:size]]
+        if not batch:
+            break
+
+        # Space out start times so the run never exceeds per_minute analyses.
+        tasks = []
+        for record in batch:
+            next_start = max(next_start, time.monotonic())
+            tasks.append(run(record, next_start))
+            next_start += interval
+
+        for coroutine in asyncio.as_completed(tasks):
+            record, error, seconds = await coroutine
+            done += 1
+            if error:
+                failed.add(record.id)
+            yield {
+                'record': record,
+                'ok': error is None,
+                'error': error,
+                'done': done,
+                'total': total,
+                'seconds': seconds,
+            }
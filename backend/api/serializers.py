@@ -1,13 +1,13 @@
 from rest_framework import serializers
-from .models import Profile, MedicalRecord, Task
+from .models import Profile, MedicalRecord, MedicalRecordPage, Specialist, Task
 
 class MedicalRecordSerializer(serializers.ModelSerializer):
     class Meta:
         model = MedicalRecord
         fields = ['id', 'title', 'date', 'description', 'image', 'image_data', 
                  'analysis_summary', 'analysis_actions', 'analysis_recommendations', 
-                 'created_at', 'updated_at']
-        read_only_fields = ['id', 'created_at', 'updated_at']
+                 'analysis_fingerprint', 'analyzed_at', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'analysis_fingerprint', 'analyzed_at', 'created_at', 'updated_at']
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
@@ -15,6 +15,36 @@ class MedicalRecordSerializer(serializers.ModelSerializer):
             representation['image'] = instance.image.url
         return representation
 
+class MedicalRecordPageSerializer(serializers.ModelSerializer):
+    has_ocr = serializers.SerializerMethodField()
+
+    class Meta:
+        model = MedicalRecordPage
+        fields = ['id', 'index', 'image', 'content_hash', 'has_ocr', 'created_at', 'updated_at']
+        read_only_fields = fields
+
+    def get_has_ocr(self, instance):
+        return not instance.needs_ocr
+
+    def to_representation(self, instance):
+        representation = super().to_representation(instance)
+        if instance.image:
+            representation['image'] = instance.image.url
+        return representation
+
+class SpecialistSerializer(serializers.ModelSerializer):
+    distance_km = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Specialist
+        fields = ['id', 'name', 'specialty', 'address', 'phone', 'website', 'latitude', 'longitude', 'distance_km']
+        read_only_fields = fields
+
+    def get_distance_km(self, instance):
+        # Only set when the list was searched by location
+        distance = getattr(instance, 'distance_km', None)
+        return round(distance, 2) if distance is not None else None
+
 class ProfileSerializer(serializers.ModelSerializer):
     records = MedicalRecordSerializer(many=True, read_only=True)
     
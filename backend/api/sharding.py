@@ -0,0 +1,354 @@
+"""
+Per-account SQLite shards.
+
+SQLite lets one connection write at a time, so with every family in one
+``db.sqlite3`` a big import for one family blocks everyone else's writes.
+With ``SHARD_COUNT`` > 0 each account's profiles, records, pages, chunk
+analyses, tasks and uploads live in one of the ``shard_N`` databases instead,
+each its own SQLite file with its own writer. Everything else (the shard map,
+term definitions, the specialist directory, auth and admin) stays on
+``default``.
+
+* ``AccountShardMiddleware`` finds the request's account (``account_for_request``:
+  the signed-in user's family account, else ``DEFAULT_ACCOUNT``), looks it up
+  in the shard map (``AccountShard``, on ``default``) and assigns new accounts to
+  the shard with the fewest accounts.
+* Views only see the account's own rows: every sharded queryset goes through
+  ``for_account``, since several accounts share a shard.
+* ``ShardRouter`` sends queries for the sharded models to the current
+  request's shard, or to the database an instance was loaded from.
+* ``move_account`` copies an account's rows to another shard and switches
+  the map; ``split_shards`` and ``rebalance_shards`` are built on it.
+
+Primary keys are only unique within a database, and an account that is moved
+gets new ids for its rows.
+"""
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, connections, models, transaction
+from django.http import JsonResponse
+from django.urls import reverse
+
+# Account of requests that don't name one, and of the rows from before accounts existed
+# (migration 0019 and the profiles merged by 0016)
+DEFAULT_ACCOUNT = 'default'
+COPY_CHUNK_SIZE = 500
+
+# Models stored per account, parents first, with the lookup from each to its account.
+SHARDED_MODELS = {
+    'api.profile': 'account',
+    'api.medicalrecord': 'profile__account',
+    'api.medicalrecordpage': 'record__profile__account',
+    'api.documentchunkanalysis': 'record__profile__account',
+    'api.task': 'profile__account',
+    'api.uploadsession': 'profile__account',
+}
+
+_current_shard = ContextVar('current_shard', default=None)
+
+
+class AccountMoving(Exception):
+    """The account is being copied to another shard."""
+
+
+def shard_aliases():
+    return [alias for alias in settings.DATABASES if alias.startswith('shard_')]
+
+
+def unconfigured_shards():
+    """Shards the shard map assigns accounts to that aren't in DATABASES, e.g. a missing shard file."""
+    from .models import AccountShard
+
+    named = AccountShard.objects.exclude(shard='default').values_list('shard', flat=True).distinct()
+    return sorted(set(named) - set(shard_aliases()))
+
+
+def check_shard_map():
+    """
+    Raise ImproperlyConfigured if accounts are mapped to shards this process
+    doesn't have: their rows would look missing (or, to the media collector,
+    their scans orphaned).
+    """
+    missing = unconfigured_shards()
+    if missing:
+        raise ImproperlyConfigured(
+            f"The shard map assigns accounts to {', '.join(missing)}, which aren't configured. "
+            f"Restore the shard files to {settings.SHARD_DIR} or set SHARD_COUNT."
+        )
+
+
+def is_sharded(model):
+    return model._meta.label_lower in SHARDED_MODELS
+
+
+def databases_for(model):
+    """Every database that can hold rows of ``model``."""
+    return ['default', *shard_aliases()] if is_sharded(model) else ['default']
+
+
+def for_account(model, account):
+    """The rows of sharded ``model`` that belong to ``account``."""
+    return model.objects.filter(**{SHARDED_MODELS[model._meta.label_lower]: account})
+
+
+def account_for_request(request):
+    """
+    The family account of a request: the signed-in user's ``AccountMember``
+    account, or ``DEFAULT_ACCOUNT`` for everyone else. Only reads the session.
+    """
+    from .models import AccountMember
+
+    if request.user.is_authenticated:
+        member = AccountMember.objects.filter(user=request.user).first()
+        if member:
+            return member.account
+    return DEFAULT_ACCOUNT
+
+
+def current_db():
+    return _current_shard.get() or 'default'
+
+
+@contextmanager
+def use_shard(alias):
+    """Route sharded models to ``alias`` inside the block, e.g. in management commands."""
+    token = _current_shard.set(alias)
+    try:
+        yield
+    finally:
+        _current_shard.reset(token)
+
+
+def atomic(func=None):
+    """
+    ``transaction.atomic`` on the current account's database, which is only
+    known once the request is running. Use as ``@atomic`` or ``with atomic():``.
+    """
+    if callable(func):
+        @functools.wraps(func)
+        def inner(*args, **kwargs):
+            with transaction.atomic(using=current_db()):
+                return func(*args, **kwargs)
+        return inner
+    return transaction.atomic(using=current_db())
+
+
+def shard_for_account(account):
+    """
+    Return the database of ``account``, adding it to the shard with the fewest
+    accounts the first time it's seen. Without shards new accounts stay on
+    ``default``.
+    """
+    from .models import AccountShard
+
+    aliases = shard_aliases()
+    entry = AccountShard.objects.filter(account=account).first()
+    if entry is None:
+        if not aliases:
+            return 'default'
+        loads = dict.fromkeys(aliases, 0)
+        for row in AccountShard.objects.values('shard').annotate(accounts=models.Count('id')):
+            if row['shard'] in loads:
+                loads[row['shard']] = row['accounts']
+        try:
+            entry = AccountShard.objects.create(account=account, shard=min(aliases, key=loads.get))
+        except IntegrityError:
+            # Another request added it first
+            entry = AccountShard.objects.get(account=account)
+    if entry.moving:
+        raise AccountMoving(account)
+    if entry.shard != 'default' and entry.shard not in aliases:
+        check_shard_map()
+    return entry.shard
+
+
+class ShardRouter:
+    def _db(self, model, **hints):
+        if not is_sharded(model):
+            return None
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        return _current_shard.get()
+
+    db_for_read = _db
+    db_for_write = _db
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if is_sharded(type(obj1)) or is_sharded(type(obj2)):
+            return obj1._state.db == obj2._state.db
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == 'default':
+            return None
+        if app_label != 'api':
+            return False
+        # RunPython operations don't name a model; the api ones only touch sharded models.
+        return model_name is None or f'{app_label}.{model_name}' in SHARDED_MODELS
+
+
+class AccountShardMiddleware:
+    """
+    Set ``request.account`` and select its shard (the admin reads every shard,
+    see api.admin). Goes after the session and authentication middleware.
+    Async-capable, so the async views run on the event loop; the lookups
+    then run in a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        try:
+            alias = self.select_shard(request)
+        except AccountMoving:
+            return self.moving_response()
+        with use_shard(alias):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        try:
+            alias = await sync_to_async(self.select_shard)(request)
+        except AccountMoving:
+            return self.moving_response()
+        with use_shard(alias):
+            return await self.get_response(request)
+
+    def select_shard(self, request):
+        request.account = None
+        if request.path.startswith(reverse('admin:index')):
+            return None
+        request.account = account_for_request(request)
+        return shard_for_account(request.account)
+
+    def moving_response(self):
+        response = JsonResponse({'error': "This account is being moved; try again shortly."}, status=503)
+        response['Retry-After'] = '30'
+        return response
+
+
+def account_load(alias):
+    """``{account: number of records}`` for the accounts stored in ``alias``."""
+    from .models import MedicalRecord, Profile
+
+    load = dict.fromkeys(Profile.objects.using(alias).values_list('account', flat=True).distinct(), 0)
+    rows = MedicalRecord.objects.using(alias).values('profile__account').annotate(records=models.Count('id'))
+    for row in rows:
+        load[row['profile__account']] = row['records']
+    return load
+
+
+def copy_account(account, source, target):
+    """
+    Copy the account's rows from ``source`` to ``target`` in one transaction
+    and return the number of rows copied. Rows are copied as stored (raw SQL,
+    so compressed columns and timestamps are untouched); integer primary keys
+    are reassigned by ``target`` and foreign keys remapped to match.
+    """
+    copied = 0
+    new_ids = {}  # model -> {old pk: new pk}, for models whose keys are reassigned
+    with transaction.atomic(using=target):
+        for label, account_lookup in SHARDED_MODELS.items():
+            model = apps.get_model(label)
+            meta = model._meta
+            pk = meta.pk
+            reassign = isinstance(pk, models.AutoField)
+            fields = [field for field in meta.concrete_fields if not (reassign and field is pk)]
+            columns = [field.column for field in fields]
+            foreign_keys = {
+                index: field.related_model
+                for index, field in enumerate(fields)
+                if field.is_relation and is_sharded(field.related_model)
+            }
+            quote = connections[target].ops.quote_name
+            insert = 'INSERT INTO %s (%s) VALUES (%s)' % (
+                quote(meta.db_table), ', '.join(map(quote, columns)), ', '.join(['%s'] * len(columns))
+            )
+            select = 'SELECT %s, %s FROM %s WHERE %s IN (%%s)' % (
+                quote(pk.column), ', '.join(map(quote, columns)), quote(meta.db_table), quote(pk.column)
+            )
+
+            ids = list(model.objects.using(source).filter(**{account_lookup: account})
+                       .order_by('pk').values_list('pk', flat=True))
+            if reassign:
+                mapping = new_ids[model] = {}
+            with connections[source].cursor() as reader, connections[target].cursor() as writer:
+                for start in range(0, len(ids), COPY_CHUNK_SIZE):
+                    chunk = ids[start:start + COPY_CHUNK_SIZE]
+                    params = [pk.get_db_prep_value(value, connections[source]) for value in chunk]
+                    reader.execute(select % ', '.join(['%s'] * len(chunk)), params)
+                    for old_pk, *values in reader.fetchall():
+                        for index, related_model in foreign_keys.items():
+                            if values[index] is not None and related_model in new_ids:
+                                values[index] = new_ids[related_model][values[index]]
+                        writer.execute(insert, values)
+                        if reassign:
+                            mapping[old_pk] = writer.lastrowid
+                        copied += 1
+    return copied
+
+
+def plan_rebalance(loads):
+    """
+    Given ``{alias: {account: records}}``, return ``(account, source, target)``
+    moves that even out the number of records per shard: repeatedly move the
+    account from the fullest shard that brings it closest to the emptiest.
+    """
+    loads = {alias: dict(accounts) for alias, accounts in loads.items()}
+    moves = []
+    while len(loads) > 1:
+        totals = {alias: sum(accounts.values()) for alias, accounts in loads.items()}
+        fullest = max(totals, key=totals.get)
+        emptiest = min(totals, key=totals.get)
+        gap = totals[fullest] - totals[emptiest]
+        # Moving an account of size s leaves a gap of |gap - 2s|; only 0 < s < gap helps.
+        candidates = [(abs(gap - 2 * size), account)
+                      for account, size in loads[fullest].items() if 0 < size < gap]
+        if not candidates:
+            break
+        _, account = min(candidates)
+        loads[emptiest][account] = loads[fullest].pop(account)
+        moves.append((account, fullest, emptiest))
+    return moves
+
+
+def move_account(account, target, source=None):
+    """
+    Move an account to ``target``: copy its rows, point the shard map at the
+    copy and delete the originals. Requests for the account get 503 while
+    it's being copied, but one already running when the move starts can
+    still write to the old shard, so move accounts while they're idle.
+    Returns the number of rows moved.
+
+    ``source`` defaults to the account's shard in the map; ``split_shards``
+    passes ``'default'`` to also merge rows left from before sharding.
+    """
+    from .models import AccountShard, Profile
+
+    entry, _ = AccountShard.objects.get_or_create(account=account, defaults={'shard': 'default'})
+    source = source or entry.shard
+    if source == target:
+        return 0
+    AccountShard.objects.filter(pk=entry.pk).update(moving=True)
+    try:
+        copied = copy_account(account, source, target)
+    except Exception:
+        AccountShard.objects.filter(pk=entry.pk).update(moving=False)
+        raise
+    AccountShard.objects.filter(pk=entry.pk).update(shard=target, moving=False)
+    # Deleting the profiles cascades to the account's other rows in source.
+    Profile.objects.using(source).filter(account=account).delete()
+    return copied
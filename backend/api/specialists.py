@@ -0,0 +1,140 @@
+"""
+Specialist directory: import and nearest-k search.
+
+Replaces asking the LLM for "the top 5 specialists near Hoboken, NJ" on every
+lookup. The directory is loaded from CSV or JSON and searched by geohash (see
+``api.geo``); the LLM is only needed to describe what a specialty does, and
+that answer is cached with the other term definitions. Describing every
+specialty of the directory up front (``enrich_specialties``) is optional.
+"""
+import csv
+import json
+
+from asgiref.sync import async_to_sync
+from django.db import transaction
+
+from . import geo, terms
+from .models import Specialist
+
+IMPORT_BATCH_SIZE = 1000
+
+
+def normalize_specialty(specialty):
+    specialty = ' '.join(specialty.split()).lower()
+    # The summaries mention both "cardiologist" and "cardiologists".
+    if specialty.endswith('ists'):
+        specialty = specialty[:-1]
+    return specialty
+
+
+def nearest_specialists(latitude, longitude, k, specialty=None):
+    """
+    Return the ``k`` specialists nearest to the point, closest first, each with
+    a ``distance_km`` attribute.
+    """
+    queryset = Specialist.objects.all()
+    if specialty:
+        queryset = queryset.filter(specialty=normalize_specialty(specialty))
+
+    center = geo.encode(latitude, longitude)
+    ranked = None
+    for precision in sorted(geo.CELL_SIZE_KM, reverse=True):
+        cell = center[:precision]
+        # One range per cell, combined with UNION ALL: an OR of ranges would make
+        # SQLite fall back to scanning the whole specialty.
+        cells = [
+            queryset.filter(geohash__gte=low, geohash__lt=high).values_list('pk', 'latitude', 'longitude')
+            for low, high in map(geo.prefix_range, geo.neighbours(cell))
+        ]
+        candidates = _by_distance(cells[0].union(*cells[1:], all=True), latitude, longitude)
+        # Anything outside the searched cells is farther than covered_radius_km,
+        # so the k nearest candidates are final once the k-th is within it.
+        if len(candidates) >= k and candidates[k - 1][0] <= geo.covered_radius_km(latitude, longitude, cell):
+            ranked = candidates[:k]
+            break
+    if ranked is None:
+        # Sparse directory (or a point near the poles): fall back to every match.
+        ranked = _by_distance(queryset.values_list('pk', 'latitude', 'longitude'), latitude, longitude)[:k]
+
+    # Only the k winners are loaded as full model instances.
+    specialists = Specialist.objects.in_bulk([pk for _, pk in ranked])
+    results = []
+    for distance, pk in ranked:
+        specialist = specialists[pk]
+        specialist.distance_km = distance
+        results.append(specialist)
+    return results
+
+
+def _by_distance(rows, latitude, longitude):
+    """Turn ``(pk, latitude, longitude)`` rows into ``(distance_km, pk)`` pairs, nearest first."""
+    return sorted((geo.haversine_km(latitude, longitude, lat, lng), pk) for pk, lat, lng in rows)
+
+
+def read_rows(path):
+    """Read directory rows from a .json (list of objects) or .csv file."""
+    if str(path).lower().endswith('.json'):
+        with open(path) as f:
+            rows = json.load(f)
+        if not isinstance(rows, list):
+            raise ValueError("JSON directory must be a list of objects.")
+        return rows
+    with open(path, newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def specialist_from_row(row):
+    """Build an unsaved Specialist; accepts lat/lng or latitude/longitude columns."""
+    latitude = float(row.get('latitude', row.get('lat')))
+    longitude = float(row.get('longitude', row.get('lng')))
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError(f"coordinates out of range: {latitude}, {longitude}")
+    name = (row.get('name') or '').strip()
+    specialty = normalize_specialty(row.get('specialty') or '')
+    if not name or not specialty:
+        raise ValueError("name and specialty are required")
+    return Specialist(
+        name=name,
+        specialty=specialty,
+        address=(row.get('address') or '').strip(),
+        phone=(row.get('phone') or '').strip(),
+        website=(row.get('website') or '').strip(),
+        latitude=latitude,
+        longitude=longitude,
+        # bulk_create skips save(), so set the geohash here.
+        geohash=geo.encode(latitude, longitude),
+    )
+
+
+@transaction.atomic
+def import_specialists(rows, replace=False):
+    """Bulk-insert directory rows. Returns ``(imported, errors)``."""
+    if replace:
+        Specialist.objects.all().delete()
+    batch, imported, errors = [], 0, []
+    for number, row in enumerate(rows, start=1):
+        try:
+            batch.append(specialist_from_row(row))
+        except (TypeError, ValueError) as e:
+            errors.append(f"row {number}: {e}")
+            continue
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            Specialist.objects.bulk_create(batch)
+            imported += len(batch)
+            batch = []
+    if batch:
+        Specialist.objects.bulk_create(batch)
+        imported += len(batch)
+    return imported, errors
+
+
+def enrich_specialties():
+    """
+    Optional enrichment step: ask the LLM what each specialty in the directory
+    does, in batches, and cache the answers as term definitions. A
+    specialist's term page then answers from the cache; searches never call
+    the LLM. Specialties already described are not asked again. Returns
+    ``(definitions, missing)`` as ``terms.resolve_definitions`` does.
+    """
+    specialties = Specialist.objects.order_by('specialty').values_list('specialty', flat=True).distinct()
+    return async_to_sync(terms.resolve_definitions)(list(specialties))
@@ -0,0 +1,133 @@
+"""
+Batched lookup of medical term definitions.
+
+A blood panel highlights 20-40 terms. Rather than one Perplexity round trip
+(and one copy of the system prompt) per term, cached definitions are answered
+straight from ``TermDefinition`` and the misses are packed into as few
+upstream prompts as the token budget allows. The model answers each batch
+with a JSON object that is split back into one definition per term.
+"""
+import asyncio
+import json
+import re
+
+from django.conf import settings
+
+from . import prompts, providers
+from .models import TermDefinition
+
+# What the prompts tell the model to answer for a term it can't define
+NOT_FOUND = 'Definition not found.'
+
+
+def normalize_term(term):
+    return ' '.join(term.split()).lower()
+
+
+def is_definition(text):
+    """False for empty answers and the model's "Definition not found." (so they aren't cached)."""
+    text = text.strip() if isinstance(text, str) else ''
+    return bool(text) and text.rstrip('.').lower() != NOT_FOUND.rstrip('.').lower()
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English text; close enough for budgeting.
+    return len(text) // 4 + 1
+
+
+def pack_batches(terms, token_budget, tokens_per_definition):
+    """
+    Greedily split ``terms`` into batches whose estimated prompt plus answer
+    size stays under ``token_budget``. A term that alone exceeds the budget
+    still gets a batch of its own.
+    """
+    overhead = estimate_tokens(prompts.BATCH_DEFINITION_SYSTEM_PROMPT + prompts.BATCH_DEFINITION_USER_PROMPT)
+    batches, batch, used = [], [], overhead
+    for term in terms:
+        cost = estimate_tokens(term) + tokens_per_definition
+        if batch and used + cost > token_budget:
+            batches.append(batch)
+            batch, used = [], overhead
+        batch.append(term)
+        used += cost
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def parse_batch_response(content, terms):
+    """
+    Map each requested term to its definition; terms the model skipped or
+    couldn't define are left out.
+    """
+    match = re.search(r'\{[\s\S]*\}', content)
+    if not match:
+        return {}
+    try:
+        data = json.loads(match.group(0))
+    except ValueError:
+        return {}
+    if not isinstance(data, dict):
+        return {}
+
+    by_normalized = {normalize_term(key): value.strip() for key, value in data.items() if is_definition(value)}
+    return {term: by_normalized[term] for term in terms if term in by_normalized}
+
+
+async def define_batch(terms):
+    messages = [
+        {'role': 'system', 'content': prompts.BATCH_DEFINITION_SYSTEM_PROMPT},
+        {'role': 'user', 'content': prompts.BATCH_DEFINITION_USER_PROMPT.format(terms=json.dumps(terms))},
+    ]
+    content, citations = await providers.chat_completion(messages, model='sonar')
+    return parse_batch_response(content, terms), citations
+
+
+async def resolve_definitions(terms):
+    """
+    Return ``(definitions, missing)`` where ``definitions`` maps each normalized
+    term to ``{'definition', 'citations', 'cached'}`` and ``missing`` lists the
+    terms no batch could answer.
+    """
+    wanted = list(dict.fromkeys(normalize_term(t) for t in terms if normalize_term(t)))
+    definitions = {}
+    async for cached in TermDefinition.objects.filter(term__in=wanted):
+        if not is_definition(cached.definition):
+            continue  # Stored before not-found answers were dropped; ask again
+        definitions[cached.term] = {
+            'definition': cached.definition,
+            'citations': cached.citations,
+            'cached': True,
+        }
+
+    misses = [term for term in wanted if term not in definitions]
+    if not misses:
+        return definitions, []
+
+    batches = pack_batches(
+        misses,
+        settings.TERM_DEFINITION_BATCH_TOKENS,
+        settings.TERM_DEFINITION_TOKENS_PER_TERM,
+    )
+    # Batches run concurrently; the provider semaphore caps how many are in flight.
+    results = await asyncio.gather(*(define_batch(batch) for batch in batches), return_exceptions=True)
+
+    fetched = []
+    for result in results:
+        if isinstance(result, providers.ProviderError):
+            continue
+        if isinstance(result, BaseException):
+            raise result
+        answers, citations = result
+        for term, definition in answers.items():
+            definitions[term] = {'definition': definition, 'citations': citations, 'cached': False}
+            fetched.append(TermDefinition(term=term, definition=definition, citations=citations))
+
+    if fetched:
+        await TermDefinition.objects.abulk_create(
+            fetched,
+            update_conflicts=True,
+            unique_fields=['term'],
+            update_fields=['definition', 'citations', 'updated_at'],
+        )
+    return definitions, [term for term in misses if term not in definitions]
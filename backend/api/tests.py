@@ -1,3 +1,1304 @@
-from django.test import TestCase
+import base64
+import copy
+import hashlib
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from importlib import import_module
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.apps import apps as django_apps
+from django.db import OperationalError, connection, connections
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models.query import QuerySet
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.admin.utils import quote
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+import httpx
+from PIL import Image
+
+from . import geo, prompts
+from .fake_providers import (
+    FAKE_DEFINITION, FAKE_INTERPRETATION, FAKE_SUMMARY, FakeProviderServer, ProviderFixtures, request_kind,
+)
+from .admin import ShardedResults
+from .checks import shard_map_check
+from .fields import CompressedText
+from .loadtest import Timings, compare, parse_mix, percentile, regressions, summarize
+from .media import _parse_range
+from .media_gc import collect_garbage, find_orphans, write_sorted
+from .periodic import claim
+from .documents import add_pages, analysis_fingerprint, analyze_record, chunk_pages
+from .reanalysis import reanalyze_stale, stale_records
+from .specialists import import_specialists, nearest_specialists
+from .models import (
+    AccountMember, AccountShard, DocumentChunkAnalysis, MedicalRecord, MedicalRecordPage, PeriodicTaskRun, Profile,
+    Specialist, Task, TermDefinition, UploadSession,
+)
+from .sharding import DEFAULT_ACCOUNT, move_account, plan_rebalance
+from .terms import estimate_tokens, parse_batch_response
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 # Create your tests here.
+
+
+def image_bytes(colour=(200, 30, 30), format='PNG'):
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8), colour).save(buffer, format=format)
+    return buffer.getvalue()
+
+
+def image_upload(name='scan.png', colour=(200, 30, 30)):
+    return SimpleUploadedFile(name, image_bytes(colour), content_type='image/png')
+
+
+class TempMediaMixin:
+    """Store uploads in a temporary MEDIA_ROOT for the test class."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls._media_root = tempfile.mkdtemp(prefix='caremigo-media-')
+        cls._media_override = override_settings(MEDIA_ROOT=cls._media_root)
+        cls._media_override.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls._media_override.disable()
+        shutil.rmtree(cls._media_root, ignore_errors=True)
+
+
+def provider_settings(server, timeout=10):
+    """``AI_PROVIDERS`` with every provider pointed at the fake ``server``."""
+    providers = copy.deepcopy(settings.AI_PROVIDERS)
+    for conf in providers.values():
+        conf.update(base_url=server.url, timeout=timeout)
+    return providers
+
+
+def family_client(testcase, username, account, shard=None):
+    """A test client signed in as a new user of ``account`` (placed on ``shard``)."""
+    user = get_user_model().objects.create_user(username, password='secret')
+    AccountMember.objects.create(user=user, account=account)
+    if shard:
+        AccountShard.objects.create(account=account, shard=shard)
+    client = testcase.client_class()
+    client.force_login(user)
+    return client
+
+
+class AccountIsolationTests(TempMediaMixin, TestCase):
+    """Two families on the same shard never see or change each other's rows."""
+    databases = '__all__'
+
+    def setUp(self):
+        self.fam1 = family_client(self, 'parent1', 'fam1', shard='shard_0')
+        self.fam3 = family_client(self, 'parent3', 'fam3', shard='shard_0')
+        response = self.fam3.post('/api/profiles/', {'name': 'Grandma', 'relationship': 'Mother'},
+                                  content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.profile_id = response.json()['id']
+        response = self.fam3.post(f'/api/profiles/{self.profile_id}/tasks/', {'title': 'secret task'},
+                                  content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.task_id = response.json()['id']
+        response = self.fam3.post(f'/api/profiles/{self.profile_id}/records/', {
+            'title': 'Blood test', 'date': '2025-01-15', 'description': 'private', 'image': image_upload(),
+        })
+        self.assertEqual(response.status_code, 201)
+        self.record_id = response.json()['id']
+
+    def test_rows_share_the_shard(self):
+        self.assertTrue(Task.objects.using('shard_0').filter(id=self.task_id).exists())
+        self.assertFalse(Task.objects.using('default').exists())
+
+    def test_lists_only_show_own_rows(self):
+        for url in ['/api/profiles/', '/api/tasks/', '/api/records/',
+                    f'/api/profiles/{self.profile_id}/records/', f'/api/profiles/{self.profile_id}/tasks/']:
+            with self.subTest(url=url):
+                self.assertEqual(self.fam1.get(url).json(), [])
+        self.assertEqual(len(self.fam3.get('/api/tasks/').json()), 1)
+
+    def test_other_accounts_objects_are_not_found(self):
+        json = {'content_type': 'application/json'}
+        requests = [
+            self.fam1.get(f'/api/profiles/{self.profile_id}/'),
+            self.fam1.get(f'/api/tasks/{self.task_id}/'),
+            self.fam1.patch(f'/api/tasks/{self.task_id}/', {'status': 'done', 'order': 0}, **json),
+            self.fam1.delete(f'/api/tasks/{self.task_id}/'),
+            self.fam1.get(f'/api/records/{self.record_id}/'),
+            self.fam1.patch(f'/api/records/{self.record_id}/', {'title': 'mine'}, **json),
+            self.fam1.delete(f'/api/records/{self.record_id}/'),
+            self.fam1.get(f'/api/records/{self.record_id}/pages/'),
+            self.fam1.post(f'/api/records/{self.record_id}/pages/', {'file': image_upload()}),
+            self.fam1.post(f'/api/records/{self.record_id}/analyze/'),
+            self.fam1.post(f'/api/profiles/{self.profile_id}/records/', {
+                'title': 'x', 'date': '2025-01-15', 'description': 'x', 'image': image_upload(),
+            }),
+            self.fam1.post(f'/api/profiles/{self.profile_id}/tasks/', {'title': 'injected'}, **json),
+            self.fam1.post(f'/api/profiles/{self.profile_id}/uploads/', HTTP_UPLOAD_LENGTH='10'),
+        ]
+        for response in requests:
+            with self.subTest(request=response.request['PATH_INFO'], method=response.request['REQUEST_METHOD']):
+                self.assertIn(response.status_code, (400, 404))
+        task = Task.objects.using('shard_0').get(id=self.task_id)
+        self.assertEqual((task.title, task.status), ('secret task', 'todo'))
+        self.assertEqual(MedicalRecord.objects.using('shard_0').get(id=self.record_id).title, 'Blood test')
+        self.assertEqual(Task.objects.using('shard_0').count(), 1)
+
+    def test_requests_without_an_account_use_the_default_one(self):
+        legacy = Profile.objects.using('shard_1').create(name='Legacy', relationship='Self')
+        AccountShard.objects.create(account=DEFAULT_ACCOUNT, shard='shard_1')
+        user = get_user_model().objects.create_user('no-family', password='secret')
+        member_less = self.client_class()
+        member_less.force_login(user)
+        for client in (self.client, member_less):
+            with self.subTest(signed_in=client is member_less):
+                self.assertEqual([p['id'] for p in client.get('/api/profiles/').json()], [legacy.id])
+        # Anonymous requests don't create sessions
+        self.assertFalse(self.client.cookies.get(settings.SESSION_COOKIE_NAME))
+
+    def test_family_members_share_an_account(self):
+        partner = family_client(self, 'partner3', 'fam3')
+        self.assertEqual([p['id'] for p in partner.get('/api/profiles/').json()], [self.profile_id])
+
+
+class ShardMoveTests(TestCase):
+    databases = '__all__'
+
+    def make_account(self, alias, account, records=1):
+        profile = Profile.objects.using(alias).create(account=account, name=account, relationship='Self')
+        for index in range(records):
+            record = MedicalRecord.objects.using(alias).create(
+                profile=profile, title=f'{account} record {index}', date='2025-01-15',
+                description=f'{account} description {index}', image=f'medical_records/{account}-{index}.png',
+            )
+            MedicalRecordPage.objects.using(alias).create(
+                record=record, index=0, image=record.image.name, content_hash=f'{account}{index}',
+            )
+            DocumentChunkAnalysis.objects.using(alias).create(record=record, chunk_hash=f'h{index}', analysis='ok')
+        Task.objects.using(alias).create(profile=profile, title=f'{account} task')
+        return profile
+
+    def test_move_account_remaps_ids(self):
+        # 'other' already holds the target's first ids, so the moved rows get new ones.
+        self.make_account('shard_1', 'other', records=3)
+        old = self.make_account('shard_0', 'family', records=2)
+        AccountShard.objects.create(account='family', shard='shard_0')
+        old_record_ids = set(MedicalRecord.objects.using('shard_0').values_list('id', flat=True))
+
+        moved = move_account('family', 'shard_1')
+
+        self.assertEqual(moved, 1 + 2 * 3 + 1)  # profile, records with a page and an analysis each, task
+        self.assertFalse(Profile.objects.using('shard_0').exists())
+        self.assertFalse(MedicalRecord.objects.using('shard_0').exists())
+        self.assertEqual(AccountShard.objects.get(account='family').shard, 'shard_1')
+
+        profile = Profile.objects.using('shard_1').get(account='family')
+        self.assertNotEqual(profile.id, old.id)
+        records = MedicalRecord.objects.using('shard_1').filter(profile=profile).order_by('title')
+        self.assertEqual([r.description for r in records], ['family description 0', 'family description 1'])
+        self.assertTrue(old_record_ids.isdisjoint(r.id for r in records))
+        for record in records:
+            self.assertEqual(record.pages.get().image.name, record.image.name)
+            self.assertEqual(record.chunk_analyses.get().analysis, 'ok')
+        self.assertEqual(Task.objects.using('shard_1').get(profile=profile).title, 'family task')
+        # The account already on the target is untouched
+        other = Profile.objects.using('shard_1').get(account='other')
+        self.assertEqual(MedicalRecordPage.objects.using('shard_1').filter(record__profile=other).count(), 3)
+
+    def test_split_shards_moves_default_rows(self):
+        self.make_account('default', 'legacy')
+        Profile.objects.using('default').create(name='Unassigned', relationship='Self')
+        with tempfile.TemporaryDirectory() as shard_dir, override_settings(SHARD_DIR=Path(shard_dir)):
+            call_command('split_shards', stdout=io.StringIO())
+        self.assertFalse(Profile.objects.using('default').exists())
+        for account in ('legacy', DEFAULT_ACCOUNT):
+            shard = AccountShard.objects.get(account=account).shard
+            self.assertTrue(Profile.objects.using(shard).filter(account=account).exists())
+        shard = AccountShard.objects.get(account='legacy').shard
+        record = MedicalRecord.objects.using(shard).get(profile__account='legacy')
+        self.assertEqual(record.pages.get().content_hash, 'legacy0')
+
+    def test_legacy_profiles_get_the_default_account(self):
+        migration = import_module('api.migrations.0019_default_account')
+        for alias in ('default', 'shard_0'):
+            Profile.objects.using(alias).create(account='', name='Legacy', relationship='Self')
+            migration.assign_default_account(django_apps, SimpleNamespace(connection=connections[alias]))
+            self.assertEqual(Profile.objects.using(alias).get().account, DEFAULT_ACCOUNT)
+
+    def test_rebalance_shards(self):
+        for account in ('a', 'b', 'c'):
+            self.make_account('shard_0', account, records=2)
+            AccountShard.objects.create(account=account, shard='shard_0')
+        call_command('rebalance_shards', stdout=io.StringIO())
+        counts = [MedicalRecord.objects.using(alias).count() for alias in ('shard_0', 'shard_1')]
+        self.assertEqual(sorted(counts), [2, 4])
+        for entry in AccountShard.objects.all():
+            self.assertEqual(Profile.objects.using(entry.shard).filter(account=entry.account).count(), 1)
+
+    def test_accounts_on_unconfigured_shards_are_refused(self):
+        self.assertEqual(shard_map_check(None), [])
+        AccountShard.objects.create(account=DEFAULT_ACCOUNT, shard='shard_7')  # e.g. its file went missing
+        self.assertEqual([error.id for error in shard_map_check(None)], ['api.E001'])
+        with self.assertRaisesMessage(ImproperlyConfigured, 'shard_7'):
+            self.client.get('/api/profiles/')
+        # Its scans would all look orphaned
+        with self.assertRaisesMessage(ImproperlyConfigured, 'shard_7'):
+            collect_garbage(dry_run=True)
+
+    def test_plan_rebalance(self):
+        moves = plan_rebalance({'shard_0': {'a': 5, 'b': 3, 'c': 2}, 'shard_1': {}})
+        self.assertEqual(moves, [('a', 'shard_0', 'shard_1')])
+        self.assertEqual(plan_rebalance({'shard_0': {'a': 1}, 'shard_1': {'b': 1}}), [])
+
+
+class ProfilesAppMergeTests(TransactionTestCase):
+    """Migration 0016 copies the retired profiles app's rows and can resume after an interruption."""
+
+    def setUp(self):
+        call_command('migrate', 'api', '0015_profilesappimport', verbosity=0)
+        self.addCleanup(call_command, 'migrate', 'api', verbosity=0)
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE TABLE profiles_profile (id integer PRIMARY KEY, name varchar(100) NOT NULL, '
+                           'relationship varchar(100) NOT NULL, created_at datetime NOT NULL, '
+                           'updated_at datetime NOT NULL)')
+            cursor.execute('CREATE TABLE profiles_medicalrecord (id integer PRIMARY KEY, profile_id integer NOT NULL, '
+                           'title varchar(200) NOT NULL, description text NOT NULL, created_at datetime NOT NULL, '
+                           'updated_at datetime NOT NULL)')
+            for id, name in ((1, 'Ann'), (2, 'Bob'), (5, 'Cat')):
+                cursor.execute('INSERT INTO profiles_profile VALUES (%s, %s, %s, %s, %s)',
+                               [id, name, 'Self', '2024-03-01 10:00:00', '2024-03-02 10:00:00'])
+            for id, profile_id in ((1, 1), (2, 2), (3, 5), (4, 5), (7, 1)):
+                cursor.execute('INSERT INTO profiles_medicalrecord VALUES (%s, %s, %s, %s, %s, %s)',
+                               [id, profile_id, f'Record {id}', 'x', f'2024-04-0{id} 09:00:00', '2024-05-01 09:00:00'])
+        self.addCleanup(self.drop_legacy_tables)
+        MigrationRecorder(connection).record_applied('profiles', '0001_initial')
+
+    def drop_legacy_tables(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TABLE IF EXISTS profiles_medicalrecord')
+            cursor.execute('DROP TABLE IF EXISTS profiles_profile')
+
+    def test_an_interrupted_merge_resumes(self):
+        migration = import_module('api.migrations.0016_merge_profiles_app')
+        bulk_create = QuerySet.bulk_create
+        calls = []
+
+        def failing_bulk_create(queryset, objs, *args, **kwargs):
+            # Chunks of two: profiles take calls 1-4 (rows, then checkpoints), records start at 5
+            calls.append(queryset.model._meta.model_name)
+            if len(calls) == 7:
+                raise OperationalError('disk I/O error')
+            return bulk_create(queryset, objs, *args, **kwargs)
+
+        with patch.object(migration, 'CHUNK_SIZE', 2):
+            with patch.object(QuerySet, 'bulk_create', failing_bulk_create), \
+                    self.assertRaises(OperationalError):
+                call_command('migrate', 'api', '0016_merge_profiles_app', verbosity=0)
+            # Every profile and the first chunk of records were committed with their checkpoints
+            self.assertEqual(Profile.objects.count(), 3)
+            self.assertEqual(MedicalRecord.objects.count(), 2)
+            self.assertIn('profiles_profile', connection.introspection.table_names())
+
+            call_command('migrate', 'api', '0016_merge_profiles_app', verbosity=0)
+
+        profiles = {profile.name: profile for profile in Profile.objects.all()}
+        self.assertEqual(sorted(profiles), ['Ann', 'Bob', 'Cat'])
+        self.assertEqual({profile.account for profile in profiles.values()}, {DEFAULT_ACCOUNT})
+        self.assertEqual(profiles['Ann'].created_at.isoformat(), '2024-03-01T10:00:00+00:00')
+        records = {record.title: record for record in MedicalRecord.objects.select_related('profile')}
+        self.assertEqual({title: record.profile.name for title, record in records.items()}, {
+            'Record 1': 'Ann', 'Record 2': 'Bob', 'Record 3': 'Cat', 'Record 4': 'Cat', 'Record 7': 'Ann',
+        })
+        self.assertEqual(str(records['Record 3'].date), '2024-04-03')
+
+        tables = connection.introspection.table_names()
+        self.assertNotIn('profiles_profile', tables)
+        self.assertNotIn('profiles_medicalrecord', tables)
+        self.assertNotIn('api_profilesappimport', tables)
+        self.assertFalse(MigrationRecorder(connection).migration_qs.filter(app='profiles').exists())
+
+
+class ShardedAdminTests(TestCase):
+    """The admin lists sharded models across every database."""
+    databases = '__all__'
+
+    def setUp(self):
+        self.admin = self.client_class()
+        self.admin.force_login(get_user_model().objects.create_superuser('admin', password='secret'))
+        self.profiles = {}
+        for alias, account, name, records in [('default', DEFAULT_ACCOUNT, 'Ann', 0), ('shard_0', 'fam1', 'Bob', 2),
+                                              ('shard_1', 'fam2', 'Cat', 1), ('shard_0', 'fam3', 'Dan', 0)]:
+            profile = Profile.objects.using(alias).create(account=account, name=name, relationship='Self')
+            for index in range(records):
+                MedicalRecord.objects.using(alias).create(profile=profile, title=f'{name} {index}', date='2025-01-15',
+                                                          description='x', image=f'medical_records/{name}{index}.png')
+            if alias != 'default':
+                AccountShard.objects.create(account=account, shard=alias)
+            self.profiles[name] = profile
+
+    def test_changelist_merges_the_shards(self):
+        by_name = self.admin.get('/admin/api/profile/').context['cl'].list_display.index('name')
+        response = self.admin.get(f'/admin/api/profile/?o={by_name}')
+        self.assertEqual(response.status_code, 200)
+        changelist = response.context['cl']
+        self.assertEqual([p.name for p in changelist.result_list], ['Ann', 'Bob', 'Cat', 'Dan'])
+        self.assertEqual(changelist.result_count, 4)
+        self.assertEqual(changelist.full_result_count, 4)
+
+        response = self.admin.get('/admin/api/profile/?account__exact=fam1')
+        self.assertEqual([p.name for p in response.context['cl'].result_list], ['Bob'])
+        # Ids repeat across shards; each row links to its own database
+        self.assertEqual(self.profiles['Bob'].pk, self.profiles['Cat'].pk)
+        self.assertNotEqual(changelist.url_for_result(self.profiles['Bob']),
+                            changelist.url_for_result(self.profiles['Cat']))
+
+        response = self.admin.get('/admin/api/medicalrecord/')
+        self.assertEqual(sorted(r.title for r in response.context['cl'].result_list), ['Bob 0', 'Bob 1', 'Cat 0'])
+
+    def test_change_view_edits_the_rows_shard(self):
+        url = reverse('admin:api_profile_change', args=[quote(f"shard_1:{self.profiles['Cat'].pk}")])
+        response = self.admin.get(url)
+        self.assertContains(response, 'value="Cat"')
+        response = self.admin.post(url, {'account': 'fam2', 'name': 'Catherine', 'relationship': 'Self'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Profile.objects.using('shard_1').get().name, 'Catherine')
+        self.assertEqual(Profile.objects.using('shard_0').get(pk=self.profiles['Bob'].pk).name, 'Bob')
+
+    def test_sharded_results_pages_in_order(self):
+        results = ShardedResults(Profile.objects.order_by('-name', 'pk'))
+        self.assertEqual(results.count(), 4)
+        self.assertEqual([p.name for p in results[1:3]], ['Cat', 'Bob'])
+        self.assertEqual([p._state.db for p in results], ['shard_0', 'shard_1', 'shard_0', 'default'])
+
+    def test_account_counts_take_one_query_per_shard(self):
+        with CaptureQueriesContext(connections['shard_0']) as shard_0:
+            response = self.admin.get('/admin/api/accountshard/')
+        counts = {entry.account: (entry.profile_count, entry.record_count) for entry in response.context['cl'].result_list}
+        self.assertEqual(counts, {'fam1': (1, 2), 'fam2': (1, 1), 'fam3': (1, 0)})
+        self.assertEqual(len(shard_0.captured_queries), 1)
+
+
+class ProviderViewTests(TestCase):
+    """The async AI views against the fake providers."""
+    databases = '__all__'
+
+    def post(self, url, data):
+        return self.client.post(url, data, content_type='application/json')
+
+    def test_analyze(self):
+        with FakeProviderServer() as server, override_settings(AI_PROVIDERS=provider_settings(server)):
+            response = self.post('/api/ai/analyze/', {'image': 'data:image/png;base64,aGVsbG8='})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'summary': FAKE_SUMMARY})
+
+    def test_define(self):
+        with FakeProviderServer() as server, override_settings(AI_PROVIDERS=provider_settings(server)):
+            response = self.post('/api/ai/define/', {'term': 'hemoglobin'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            'content': FAKE_DEFINITION, 'citations': ['https://example.org/fake-source'],
+        })
+
+    async def test_async_requests_stay_async(self):
+        # Any sync-only middleware would be adapted (logged with DEBUG on), sending the view
+        # through a thread again.
+        with FakeProviderServer() as server, \
+                override_settings(AI_PROVIDERS=provider_settings(server), DEBUG=True), \
+                self.assertNoLogs('django.request', level='DEBUG'):
+            response = await self.async_client.post('/api/ai/define/', {'term': 'hemoglobin'},
+                                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_provider_error_is_a_bad_gateway(self):
+        fixtures = ProviderFixtures({
+            'gemini:image': [{'status': 500, 'body': {'error': 'internal'}, 'latency': 0}],
+            'perplexity:chat': [{'status': 429, 'body': {'error': 'rate limited'}, 'latency': 0}],
+        })
+        with FakeProviderServer(fixtures=fixtures) as server, \
+                override_settings(AI_PROVIDERS=provider_settings(server)):
+            analyze = self.post('/api/ai/analyze/', {'image': 'aGVsbG8='})
+            define = self.post('/api/ai/define/', {'term': 'hemoglobin'})
+        self.assertEqual(analyze.status_code, 502)
+        self.assertIn('HTTP 500', analyze.json()['error'])
+        self.assertEqual(define.status_code, 502)
+        self.assertIn('HTTP 429', define.json()['error'])
+
+    def test_timeout_is_a_gateway_timeout(self):
+        with FakeProviderServer(latency=0.5) as server, \
+                override_settings(AI_PROVIDERS=provider_settings(server, timeout=0.1)):
+            analyze = self.post('/api/ai/analyze/', {'image': 'aGVsbG8='})
+            define = self.post('/api/ai/define/', {'term': 'hemoglobin'})
+        for response in (analyze, define):
+            self.assertEqual(response.status_code, 504)
+            self.assertIn('timed out', response.json()['error'])
+
+    def test_missing_input(self):
+        self.assertEqual(self.post('/api/ai/analyze/', {}).status_code, 400)
+        self.assertEqual(self.post('/api/ai/define/', {'term': ' '}).status_code, 400)
+
+
+class FakeProviderTests(TestCase):
+    def post(self, server, path, payload):
+        with httpx.Client(base_url=server.url) as client:
+            response = client.post(path, json=payload)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def chat(self, server, content):
+        data = self.post(server, '/chat/completions', {'messages': [{'role': 'user', 'content': content}]})
+        return data['choices'][0]['message']['content']
+
+    def test_request_kind(self):
+        text = {'contents': [{'parts': [{'text': 'Summarize this.'}]}]}
+        image = {'contents': [{'parts': [{'text': 'Summarize this.'}, {'inline_data': {'data': 'aGVsbG8='}}]}]}
+        interpret = {'contents': [{'parts': [{'text': prompts.INTERPRETATION_PROMPT.format(values='Glucose: 98')}]}]}
+        self.assertEqual(request_kind('vision', {}), 'vision')
+        self.assertEqual(request_kind('gemini', text), 'gemini:text')
+        self.assertEqual(request_kind('gemini', image), 'gemini:image')
+        self.assertEqual(request_kind('gemini', interpret), 'gemini:interpret')
+        self.assertEqual(request_kind('perplexity', {'messages': [{'content': 'What is TSH?'}]}), 'perplexity:chat')
+        self.assertEqual(request_kind('perplexity', {'messages': [{'content': 'Define:\n["tsh"]'}]}),
+                         'perplexity:batch')
+
+    def test_fixtures_are_replayed_to_requests_of_their_kind(self):
+        def answer(content):
+            return [{'status': 200, 'latency': 0, 'body': {'choices': [{'message': {'content': content}}]}}]
+
+        fixtures = ProviderFixtures({
+            'perplexity:chat': answer('Thyroid-stimulating hormone.'),
+            'perplexity:batch': answer(json.dumps({'Glucose': 'Sugar in the blood.', 'tsh': 'A hormone.'})),
+        })
+        with FakeProviderServer(fixtures=fixtures) as server:
+            self.assertEqual(self.chat(server, 'What is TSH?'), 'Thyroid-stimulating hormone.')
+            self.assertEqual(json.loads(self.chat(server, 'Define:\n["glucose", "tsh"]')),
+                             {'Glucose': 'Sugar in the blood.', 'tsh': 'A hormone.'})
+            # Recorded for other terms: the canned answer keyed by the requested ones
+            self.assertEqual(json.loads(self.chat(server, 'Define:\n["albumin"]')), {'albumin': FAKE_DEFINITION})
+
+    def test_canned_interpretations_are_keyed_by_value(self):
+        prompt = prompts.INTERPRETATION_PROMPT.format(values='Glucose: 98\nHemoglobin: 11.2')
+        with FakeProviderServer() as server:
+            data = self.post(server, '/v1beta/models/gemini-2.0-flash:generateContent',
+                             {'contents': [{'parts': [{'text': prompt}]}]})
+        self.assertEqual(json.loads(data['candidates'][0]['content']['parts'][0]['text']),
+                         {'98': FAKE_INTERPRETATION, '11.2': FAKE_INTERPRETATION})
+
+    def test_fixtures_keyed_by_provider_are_rejected(self):
+        with self.assertRaisesMessage(ValueError, 'recorded again'):
+            ProviderFixtures({'perplexity': []})
+
+
+class LoadTestReportTests(TestCase):
+    def report(self, endpoints):
+        """A report with one successful request per latency (in seconds) per endpoint, over one second."""
+        timings = Timings()
+        for endpoint, latencies in endpoints.items():
+            for seconds in latencies:
+                timings.add(endpoint, 200, seconds)
+        return summarize(timings, 1.0)
+
+    def test_parse_mix(self):
+        self.assertEqual(parse_mix('list_records=3, define_terms=1.5,'), {'list_records': 3, 'define_terms': 1.5})
+        for spec in ('list_records=1,bogus=2', 'list_records=-1,create_task=2', 'list_records=0', ''):
+            with self.assertRaises(ValueError):
+                parse_mix(spec)
+
+    def test_percentile(self):
+        self.assertIsNone(percentile([], 50))
+        self.assertEqual(percentile([7], 99), 7)
+        values = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
+        self.assertEqual(percentile(values, 0), 1)
+        self.assertEqual(percentile(values, 50), 5.5)
+        self.assertAlmostEqual(percentile(values, 95), 9.55)
+        self.assertEqual(percentile(values, 100), 10)
+
+    def test_summarize(self):
+        timings = Timings()
+        for seconds in (0.1, 0.2, 0.3):
+            timings.add('GET /a/', 200, seconds)
+        timings.add('GET /a/', 500, 0.05)
+        timings.add('GET /b/', 'ReadTimeout', 120)
+        report = summarize(timings, 2.0, {'concurrency': 2})
+        self.assertEqual(report['config'], {'concurrency': 2})
+        self.assertEqual(report['endpoints']['GET /a/'], {
+            'requests': 4, 'errors': 1, 'statuses': {'200': 3, '500': 1}, 'throughput_rps': 2.0,
+            'mean_ms': 200.0, 'p50_ms': 200.0, 'p95_ms': 290.0, 'p99_ms': 298.0, 'max_ms': 300.0,
+        })
+        self.assertEqual(report['endpoints']['GET /b/']['p95_ms'], None)
+        self.assertEqual(report['total']['requests'], 5)
+        self.assertEqual(report['total']['errors'], 2)
+
+    def test_compare_and_regressions(self):
+        baseline = self.report({'GET /a/': [0.1] * 10, 'GET /b/': [0.2] * 10, 'GET /old/': [0.1]})
+        report = self.report({'GET /a/': [0.1] * 9 + [0.3], 'GET /b/': [0.1] * 10, 'GET /new/': [0.5]})
+        comparison = compare(baseline, report)
+        self.assertEqual(list(comparison), ['total', 'GET /a/', 'GET /b/', 'GET /new/', 'GET /old/'])
+        self.assertEqual(comparison['GET /b/']['p50_ms'], {'baseline': 200.0, 'current': 100.0, 'change_pct': -50.0})
+        self.assertEqual(comparison['GET /a/']['throughput_rps'], {'baseline': 10.0, 'current': 10.0,
+                                                                    'change_pct': 0.0})
+        # Endpoints missing from one run have nothing to compare
+        self.assertEqual(comparison['GET /new/']['p95_ms'], {'baseline': None, 'current': 500.0, 'change_pct': None})
+        self.assertEqual(comparison['GET /old/']['p95_ms']['change_pct'], None)
+
+        self.assertEqual(comparison['GET /a/']['p95_ms']['change_pct'], 110.0)
+        self.assertEqual(comparison['total']['p95_ms']['change_pct'], 50.0)
+        self.assertEqual(regressions(comparison, 40), ['total', 'GET /a/'])
+        self.assertEqual(regressions(comparison, 50), ['GET /a/'])
+        self.assertEqual(regressions(comparison, 110), [])
+
+
+class TermDefinitionTests(TestCase):
+    def chat_fixture(self, answers):
+        return ProviderFixtures({'perplexity:batch': [{
+            'status': 200, 'latency': 0,
+            'body': {'choices': [{'message': {'content': json.dumps(answers)}}], 'citations': ['https://a.org']},
+        }]})
+
+    def define(self, terms, fixtures=None):
+        with FakeProviderServer(fixtures=fixtures) as server, \
+                override_settings(AI_PROVIDERS=provider_settings(server)):
+            response = self.client.post('/api/terms/definitions/', {'terms': terms}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_parse_batch_response_drops_unanswered_terms(self):
+        content = 'Here you go: ' + json.dumps({
+            'Glucose': 'Sugar in the blood.', 'tsh': 'Definition not found.', 'hba1c': ' ', 'ferritin': 3,
+        })
+        self.assertEqual(parse_batch_response(content, ['glucose', 'tsh', 'hba1c', 'ferritin', 'albumin']),
+                         {'glucose': 'Sugar in the blood.'})
+        self.assertEqual(parse_batch_response('Definition not found.', ['glucose']), {})
+
+    def test_not_found_answers_are_missing_and_not_cached(self):
+        fixtures = self.chat_fixture({'glucose': 'Sugar in the blood.', 'zzyzx': 'Definition not found.'})
+        data = self.define(['Glucose', 'zzyzx'], fixtures)
+        self.assertEqual(data['definitions'], {
+            'Glucose': {'definition': 'Sugar in the blood.', 'citations': ['https://a.org'], 'cached': False},
+        })
+        self.assertEqual(data['missing'], ['zzyzx'])
+        self.assertEqual(list(TermDefinition.objects.values_list('term', flat=True)), ['glucose'])
+
+        data = self.define(['glucose'])  # Answered from the cache
+        self.assertTrue(data['definitions']['glucose']['cached'])
+
+    def test_cached_not_found_answers_are_fetched_again(self):
+        TermDefinition.objects.create(term='glucose', definition='Definition not found.')
+        data = self.define(['glucose'], self.chat_fixture({'glucose': 'Sugar in the blood.'}))
+        self.assertEqual(data['definitions']['glucose']['definition'], 'Sugar in the blood.')
+        self.assertEqual(TermDefinition.objects.get().definition, 'Sugar in the blood.')
+
+
+class MediaTests(TempMediaMixin, TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.owner = family_client(self, 'owner', 'fam1', shard='shard_0')
+        self.stranger = family_client(self, 'stranger', 'fam2', shard='shard_0')
+        response = self.owner.post('/api/profiles/', {'name': 'Me', 'relationship': 'Self'},
+                                   content_type='application/json')
+        self.profile_id = response.json()['id']
+        response = self.owner.post(f'/api/profiles/{self.profile_id}/records/', {
+            'title': 'Blood test', 'date': '2025-01-15', 'description': 'x', 'image': image_upload(),
+        })
+        self.assertEqual(response.status_code, 201)
+        self.url = response.json()['image']
+        self.content = image_bytes()
+
+    def get(self, client=None, **headers):
+        response = (client or self.owner).get(self.url, headers=headers)
+        response.body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response
+
+    def test_full_file(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.body, self.content)
+        self.assertEqual(response['Content-Length'], str(len(self.content)))
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertTrue(response['Cache-Control'].startswith('private'))
+
+    def test_other_accounts_get_404(self):
+        self.assertEqual(self.get(self.stranger).status_code, 404)
+        self.assertEqual(self.get(self.client_class()).status_code, 404)
+
+    def test_etag(self):
+        etag = self.get()['ETag']
+        self.assertEqual(self.get(If_None_Match=etag).status_code, 304)
+        self.assertEqual(self.get(If_None_Match='"other"').status_code, 200)
+
+    def test_ranges(self):
+        size = len(self.content)
+        response = self.get(Range='bytes=0-3')
+        self.assertEqual((response.status_code, response.body), (206, self.content[:4]))
+        self.assertEqual(response['Content-Range'], f'bytes 0-3/{size}')
+        response = self.get(Range='bytes=-5')
+        self.assertEqual((response.status_code, response.body), (206, self.content[-5:]))
+        self.assertEqual(response['Content-Range'], f'bytes {size - 5}-{size - 1}/{size}')
+        response = self.get(Range=f'bytes={size}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{size}')
+        # Stale If-Range: the whole file
+        response = self.get(Range='bytes=0-3', If_Range='"stale"')
+        self.assertEqual((response.status_code, response.body), (200, self.content))
+        # Malformed and multi-range headers are ignored
+        self.assertEqual(self.get(Range='bytes=0-1,4-5').status_code, 200)
+
+    def test_asgi_streams_asynchronously(self):
+        client = self.async_client_class()
+        client.cookies = self.owner.cookies
+
+        async def get(**headers):
+            response = await client.get(self.url, headers=headers)
+            response.body = b''.join([chunk async for chunk in response.streaming_content])
+            return response
+
+        # Django would read a sync iterator into memory before sending any of it
+        response = async_to_sync(get)()
+        self.assertTrue(response.is_async)
+        self.assertEqual((response.status_code, response.body), (200, self.content))
+        response = async_to_sync(get)(Range='bytes=2-5')
+        self.assertEqual((response.status_code, response.body), (206, self.content[2:6]))
+        self.assertFalse(self.get().is_async)
+
+    def test_empty_file(self):
+        self.assertIs(_parse_range('bytes=-5', 0), False)
+        self.assertIs(_parse_range('bytes=0-', 0), False)
+        Path(settings.MEDIA_ROOT, 'medical_records').mkdir(exist_ok=True)
+        Path(settings.MEDIA_ROOT, 'medical_records', 'empty.png').write_bytes(b'')
+        MedicalRecord.objects.using('shard_0').create(
+            profile_id=self.profile_id, title='Empty', date='2025-01-15', description='x',
+            image='medical_records/empty.png',
+        )
+        self.url = f'{settings.MEDIA_URL}medical_records/empty.png'
+        response = self.get(Range='bytes=-5')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */0')
+        response = self.get()
+        self.assertEqual((response.status_code, response.body, response['Content-Length']), (200, b'', '0'))
+
+
+class MediaGarbageCollectionTests(TempMediaMixin, TestCase):
+    """collect_garbage removes exactly the old files no database row refers to."""
+    databases = '__all__'
+
+    def setUp(self):
+        self.root = Path(settings.MEDIA_ROOT)
+        shutil.rmtree(self.root, ignore_errors=True)
+        old = time.time() - 2 * 60 * 60
+        # medical_records/ is collected, other/ isn't (MEDIA_GC_DIRECTORIES)
+        for name in ('medical_records/default.png', 'medical_records/shard.png', 'medical_records/page.png',
+                     'medical_records/orphan.png', 'medical_records/2024/orphan.png', 'medical_records/orphan.png.bak',
+                     'medical_records/recent.png', 'other/orphan.png'):
+            path = self.root / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(name.encode())
+            if name != 'medical_records/recent.png':
+                os.utime(path, (old, old))
+
+        profile = Profile.objects.create(name='Me', relationship='Self')
+        MedicalRecord.objects.create(profile=profile, title='Default', date='2025-01-15', description='x',
+                                     image='medical_records/default.png')
+        # The other files are only referenced from shard_1, one of them twice (a record and its first page)
+        shard_profile = Profile.objects.using('shard_1').create(name='Sharded', relationship='Self', account='fam1')
+        record = MedicalRecord.objects.using('shard_1').create(
+            profile=shard_profile, title='Sharded', date='2025-01-15', description='x', image='medical_records/shard.png')
+        MedicalRecordPage.objects.using('shard_1').create(record=record, index=0, image='medical_records/shard.png')
+        MedicalRecordPage.objects.using('shard_1').create(record=record, index=1, image='medical_records/page.png')
+
+        self.orphans = ['medical_records/2024/orphan.png', 'medical_records/orphan.png',
+                        'medical_records/orphan.png.bak']
+
+    def remaining(self):
+        return sorted(str(path.relative_to(self.root)) for path in self.root.rglob('*') if path.is_file())
+
+    def test_dry_run_only_reports(self):
+        before = self.remaining()
+        report = collect_garbage(dry_run=True, rate=0)
+        self.assertEqual(sorted(report['paths']), self.orphans)
+        self.assertEqual((report['scanned'], report['orphans'], report['deleted']), (6, 3, 0))
+        self.assertEqual(report['bytes'], sum(len(name) for name in self.orphans))
+        self.assertEqual(self.remaining(), before)
+
+    def test_deletes_old_unreferenced_files(self):
+        report = collect_garbage(rate=0)
+        self.assertEqual((report['orphans'], report['deleted'], report['paths']), (3, 3, []))
+        self.assertEqual(self.remaining(), [
+            'medical_records/default.png', 'medical_records/page.png', 'medical_records/recent.png',
+            'medical_records/shard.png', 'other/orphan.png',
+        ])
+
+    def test_grace_period(self):
+        # Files newer than min_age may belong to a record that is still being saved
+        self.assertNotIn('medical_records/recent.png', collect_garbage(dry_run=True, rate=0)['paths'])
+        self.assertEqual(sorted(collect_garbage(dry_run=True, rate=0, min_age=0)['paths']),
+                         sorted([*self.orphans, 'medical_records/recent.png']))
+
+    def test_sorted_runs_are_merged(self):
+        # Runs of two names each, so both manifests are merged from several runs
+        with patch('api.media_gc.RUN_SIZE', 2):
+            report = collect_garbage(dry_run=True, rate=0)
+        self.assertEqual(sorted(report['paths']), self.orphans)
+
+        with tempfile.TemporaryDirectory() as directory:
+            with patch('api.media_gc.RUN_SIZE', 2):
+                referenced = write_sorted(['b', 'a', 'b', 'd', 'a'], directory, 'referenced')
+                stored = write_sorted(['d\t4', 'a\t1', 'c\t3', 'a.png\t5', 'e\t6'], directory, 'stored')
+            self.assertEqual(Path(referenced).read_text(), 'a\nb\nd\n')
+            self.assertEqual(list(find_orphans(stored, referenced)), [('a.png', 5), ('c', 3), ('e', 6)])
+
+    def test_files_referenced_since_the_manifest_are_kept(self):
+        # Each batch is checked against the database again before deleting it
+        with patch('api.media_gc.referenced_names', return_value=iter(())):
+            report = collect_garbage(rate=0, batch_size=2)
+        self.assertEqual(report['deleted'], 3)
+        self.assertIn('medical_records/shard.png', self.remaining())
+        self.assertIn('medical_records/page.png', self.remaining())
+
+
+def pdf_upload(*colours, name='scan.pdf'):
+    buffer = io.BytesIO()
+    images = [Image.new('RGB', (40, 40), colour) for colour in colours]
+    images[0].save(buffer, format='PDF', save_all=True, append_images=images[1:])
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='application/pdf')
+
+
+class DocumentPageTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        AccountShard.objects.create(account=DEFAULT_ACCOUNT, shard='default')  # Requests read this database
+        self.profile = Profile.objects.create(name='Me', relationship='Self')
+        self.record = MedicalRecord.objects.create(profile=self.profile, title='Scan', date='2025-01-15',
+                                                   description='x', image=image_upload())
+
+    def test_chunk_pages(self):
+        pages = [SimpleNamespace(index=index, ocr_text=text) for index, text in enumerate([
+            'a' * 40, '', 'b' * 40, '\n'.join(['c' * 40] * 5), 'd' * 40,
+        ])]
+        chunks = chunk_pages(pages, token_budget=30)
+        # Pages are numbered from 1; the empty page 2 is skipped; the oversized page 4 is split on lines
+        self.assertEqual([(first, last) for first, last, _ in chunks], [(1, 3), (4, 4), (4, 4), (4, 5)])
+        self.assertEqual(chunks[0][2], f"--- Page 1 ---\n{'a' * 40}\n\n--- Page 3 ---\n{'b' * 40}")
+        self.assertTrue(all(estimate_tokens(text) <= 30 + 1 for _, _, text in chunks))
+        self.assertEqual(''.join(text for _, _, text in chunks).count('c' * 40), 5)
+        self.assertEqual([(first, last) for first, last, _ in chunk_pages(pages, token_budget=10_000)], [(1, 5)])
+
+    def test_pdf_pages_are_expanded(self):
+        response = self.client.post(f'/api/records/{self.record.id}/pages/',
+                                    {'file': pdf_upload((0, 0, 255), (0, 255, 0), (255, 255, 255))})
+        self.assertEqual(response.status_code, 201)
+        # The record's own image becomes page 0, then one page per PDF page
+        pages = list(self.record.pages.order_by('index'))
+        self.assertEqual([page.index for page in pages], [0, 1, 2, 3])
+        self.assertEqual(pages[0].image.name, self.record.image.name)
+        self.assertEqual(len({page.content_hash for page in pages}), 4)
+        with Image.open(pages[2].image) as image:
+            red, green, blue = image.getpixel((5, 5))
+            self.assertTrue(green > 240 and red < 10 and blue < 10)  # The second PDF page
+
+    def test_resumable_pdf_upload_becomes_one_record(self):
+        upload = pdf_upload((0, 0, 255), (0, 255, 0))
+        with tempfile.TemporaryDirectory() as directory, override_settings(UPLOAD_TEMP_DIR=Path(directory)):
+            url = self.client.post(f'/api/profiles/{self.profile.id}/uploads/', headers={
+                'Tus-Resumable': '1.0.0', 'Upload-Length': str(upload.size),
+                'Upload-Metadata': tus_metadata(filename='scan.pdf', title='PDF', date='2025-01-15', description='x'),
+            })['Location']
+            response = self.client.generic('PATCH', url, upload.read(), content_type='application/offset+octet-stream',
+                                           headers={'Tus-Resumable': '1.0.0', 'Upload-Offset': '0'})
+        record = MedicalRecord.objects.get(id=response['Upload-Record-Id'])
+        self.assertEqual(record.pages.count(), 2)
+        self.assertEqual(record.pages.get(index=0).image.name, record.image.name)
+
+    def test_added_pages_reuse_earlier_chunk_analyses(self):
+        add_pages(self.record, pdf_upload((0, 0, 255)))
+        # One page per chunk
+        with FakeProviderServer() as server, \
+                override_settings(AI_PROVIDERS=provider_settings(server), DOCUMENT_CHUNK_TOKENS=15):
+            first = async_to_sync(analyze_record)(self.record)
+            add_pages(self.record, image_upload(colour=(0, 255, 0)))
+            second = async_to_sync(analyze_record)(self.record)
+            again = async_to_sync(analyze_record)(self.record)
+
+        self.assertEqual((first['pages'], first['ocr_pages'], first['chunks'], first['reused_chunks']), (2, 2, 2, 0))
+        # Only the new page is OCR'd and analyzed
+        self.assertEqual((second['pages'], second['ocr_pages'], second['chunks'], second['reused_chunks']), (3, 1, 3, 2))
+        self.assertEqual((again['ocr_pages'], again['reused_chunks']), (0, 3))
+        self.assertEqual(self.record.chunk_analyses.count(), 3)
+
+
+class ReanalysisTests(TempMediaMixin, TestCase):
+    def make_record(self, profile, title, with_file=True):
+        record = MedicalRecord(profile=profile, title=title, date='2025-01-15', description='x',
+                               analysis_summary='old summary', analysis_fingerprint='outdated')
+        if with_file:
+            record.image = image_upload(f'{title}.png')
+        else:
+            record.image = f'medical_records/{title}-missing.png'
+        record.save()
+        return record
+
+    async def collect(self):
+        return [progress async for progress in reanalyze_stale(per_minute=0)]
+
+    async def test_a_failing_record_does_not_stop_the_run(self):
+        profile = await Profile.objects.acreate(name='Me', relationship='Self')
+        missing = await sync_to_async(self.make_record)(profile, 'missing', with_file=False)
+        present = await sync_to_async(self.make_record)(profile, 'present')
+
+        with FakeProviderServer() as server, override_settings(AI_PROVIDERS=provider_settings(server)), \
+                self.assertLogs('api.reanalysis', 'ERROR') as logs:
+            results = await self.collect()
+
+        by_record = {progress['record'].id: progress for progress in results}
+        self.assertEqual(len(results), 2)
+        self.assertFalse(by_record[missing.id]['ok'])
+        self.assertIn('FileNotFoundError', by_record[missing.id]['error'])
+        self.assertIn(f'record {missing.id}', logs.output[0])
+        self.assertTrue(by_record[present.id]['ok'])
+        await present.arefresh_from_db()
+        self.assertIn('hemoglobin', present.analysis_summary)
+        self.assertNotEqual(present.analysis_fingerprint, 'outdated')
+
+
+    def test_stale_records_are_most_recently_viewed_first(self):
+        AccountShard.objects.create(account=DEFAULT_ACCOUNT, shard='default')  # Requests read this database
+        profile = Profile.objects.create(name='Me', relationship='Self')
+        never, old, recent = (self.make_record(profile, title, with_file=False) for title in ('never', 'old', 'recent'))
+        self.make_record(profile, 'unanalyzed', with_file=False)
+        MedicalRecord.objects.filter(title='unanalyzed').update(analysis_summary='')
+        current = self.make_record(profile, 'current', with_file=False)
+        MedicalRecord.objects.filter(id=current.id).update(analysis_fingerprint=analysis_fingerprint())
+
+        # Viewing a record through the API marks it
+        self.assertEqual(self.client.get(f'/api/records/{old.id}/').status_code, 200)
+        MedicalRecord.objects.filter(id=old.id).update(last_viewed_at=timezone.now() - timedelta(days=1))
+        self.assertEqual(self.client.get(f'/api/records/{recent.id}/').status_code, 200)
+
+        self.assertEqual([record.title for record in stale_records()], ['recent', 'old', 'never'])
+        # Never-viewed records come last, most recently changed first
+        self.assertEqual([record.title for record in stale_records(include_unanalyzed=True)],
+                         ['recent', 'old', 'unanalyzed', 'never'])
+
+    async def test_analyses_start_no_faster_than_per_minute(self):
+        profile = await Profile.objects.acreate(name='Me', relationship='Self')
+        for index in range(5):
+            await sync_to_async(self.make_record)(profile, f'record {index}', with_file=False)
+        starts = []
+
+        async def analyze_record(record):
+            starts.append(time.monotonic())
+            record.analysis_fingerprint = analysis_fingerprint()
+            await record.asave(update_fields=['analysis_fingerprint'])
+
+        with patch('api.documents.analyze_record', analyze_record):
+            # 600 a minute: one start every 0.1s, across batches too
+            results = [progress async for progress in reanalyze_stale(batch_size=2, per_minute=600, limit=4)]
+
+        self.assertEqual([progress['done'] for progress in results], [1, 2, 3, 4])
+        self.assertTrue(all(progress['ok'] for progress in results))
+        self.assertEqual(len(starts), 4)
+        gaps = [later - earlier for earlier, later in zip(starts, starts[1:])]
+        self.assertTrue(all(gap >= 0.09 for gap in gaps), gaps)
+        # One stale record is left for the next run
+        self.assertEqual(await stale_records().acount(), 1)
+
+    def test_fingerprint_covers_every_stored_prompt(self):
+        fingerprint = analysis_fingerprint()
+        for name in ('ANALYSIS_PROMPT', 'CHUNK_ANALYSIS_PROMPT', 'MERGE_ANALYSIS_PROMPT'):
+            with patch.object(prompts, name, getattr(prompts, name) + ' Be brief.'):
+                self.assertNotEqual(analysis_fingerprint(), fingerprint, name)
+
+    def test_analyses_saved_by_the_app_are_current(self):
+        AccountShard.objects.create(account=DEFAULT_ACCOUNT, shard='default')  # Requests read this database
+        profile = Profile.objects.create(name='Me', relationship='Self')
+        record = self.make_record(profile, 'saved', with_file=False)
+        response = self.client.patch(f'/api/records/{record.id}/', encode_multipart(BOUNDARY, {'title': 'Renamed'}),
+                                     content_type=MULTIPART_CONTENT)
+        self.assertEqual(response.status_code, 200)
+        record.refresh_from_db()
+        self.assertEqual(record.analysis_fingerprint, 'outdated')
+
+        response = self.client.patch(f'/api/records/{record.id}/',
+                                     encode_multipart(BOUNDARY, {'analysis_summary': 'From /api/ai/analyze/'}),
+                                     content_type=MULTIPART_CONTENT)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['analysis_fingerprint'], analysis_fingerprint())
+        self.assertNotIn(record, stale_records())
+
+
+def sample_text(index):
+    return (f"1. Summary: Your glucose of {90 + index % 40} mg/dL is {'normal' if index % 3 else 'high'}. "
+            f"2. What can I do?: Walk {index % 7 + 2} times a week. 3. Where to go?: ||endocrinologist|| #{index}")
+
+
+class CompressedTextFieldTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.profile = Profile.objects.create(name='Me', relationship='Self')
+
+    def create(self, **fields):
+        fields = {'description': 'plain description', **fields}
+        return MedicalRecord.objects.create(profile=self.profile, title='Blood test', date='2025-01-15',
+                                            image='medical_records/x.png', **fields)
+
+    def stored(self, record, column):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT {column} FROM api_medicalrecord WHERE id = %s', [record.id])
+            return cursor.fetchone()[0]
+
+    def test_zlib_round_trip(self):
+        record = self.create(analysis_summary=sample_text(1))
+        self.assertEqual(bytes(self.stored(record, 'analysis_summary'))[:1], b'Z')
+        loaded = MedicalRecord.objects.get(id=record.id)
+        # Still compressed until read
+        self.assertIsInstance(loaded.__dict__['analysis_summary'], CompressedText)
+        self.assertEqual(loaded.analysis_summary, sample_text(1))
+        self.assertEqual(loaded.description, 'plain description')
+
+    def test_none_and_empty(self):
+        record = self.create(description='', analysis_summary=None)
+        self.assertIsNone(self.stored(record, 'analysis_summary'))
+        loaded = MedicalRecord.objects.get(id=record.id)
+        self.assertIsNone(loaded.analysis_summary)
+        self.assertEqual(loaded.description, '')
+        self.assertTrue(MedicalRecord.objects.filter(description='').exists())
+
+    def test_legacy_plain_text(self):
+        record = self.create()
+        with connection.cursor() as cursor:
+            cursor.execute('UPDATE api_medicalrecord SET analysis_actions = %s WHERE id = %s',
+                           ['Written before compression', record.id])
+        loaded = MedicalRecord.objects.get(id=record.id)
+        self.assertEqual(loaded.analysis_actions, 'Written before compression')
+        loaded.save()  # Rewritten compressed
+        self.assertEqual(bytes(self.stored(record, 'analysis_actions'))[:1], b'Z')
+        self.assertEqual(MedicalRecord.objects.get(id=record.id).analysis_actions, 'Written before compression')
+
+    @skipUnless(zstandard, "zstandard isn't installed")
+    def test_zstd_without_dictionary(self):
+        zlib_record = self.create(analysis_summary='zlib text')
+        with override_settings(COMPRESSED_TEXT_CODEC='zstd', COMPRESSED_TEXT_ZSTD_DICTIONARY=None):
+            record = self.create(analysis_summary=sample_text(2))
+            self.assertEqual(bytes(self.stored(record, 'analysis_summary'))[:5], b'S\x00\x00\x00\x00')
+            self.assertEqual(MedicalRecord.objects.get(id=record.id).analysis_summary, sample_text(2))
+            # Both codecs are read side by side
+            self.assertEqual(MedicalRecord.objects.get(id=zlib_record.id).analysis_summary, 'zlib text')
+        self.assertEqual(MedicalRecord.objects.get(id=record.id).analysis_summary, sample_text(2))
+
+    @skipUnless(zstandard, "zstandard isn't installed")
+    def test_zstd_with_trained_dictionary(self):
+        for index in range(150):
+            self.create(description=sample_text(index), analysis_summary=sample_text(index + 1000))
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp, 'records.dict')
+            # --max-samples stops at the limit even across columns and chunks
+            out = io.StringIO()
+            call_command('train_compression_dictionary', output=str(path), size=4096, max_samples=120, stdout=out)
+            self.assertIn('trained on 120 values', out.getvalue())
+
+            with override_settings(COMPRESSED_TEXT_CODEC='zstd', COMPRESSED_TEXT_ZSTD_DICTIONARY=str(path)):
+                record = self.create(analysis_summary=sample_text(500))
+                header = bytes(self.stored(record, 'analysis_summary'))[:5]
+                self.assertEqual(header[:1], b'S')
+                self.assertNotEqual(header[1:], b'\x00\x00\x00\x00')
+                self.assertEqual(MedicalRecord.objects.get(id=record.id).analysis_summary, sample_text(500))
+
+            # Without the dictionary the value can't be read
+            with override_settings(COMPRESSED_TEXT_CODEC='zstd', COMPRESSED_TEXT_ZSTD_DICTIONARY=None), \
+                    self.assertRaises(ImproperlyConfigured):
+                MedicalRecord.objects.get(id=record.id).analysis_summary
+
+
+    @skipUnless(zstandard, "zstandard isn't installed")
+    def test_commands_read_every_shard(self):
+        for index in range(60):
+            self.create(description=sample_text(index), analysis_summary=sample_text(index + 1000))
+        profile = Profile.objects.using('shard_1').create(name='Sharded', relationship='Self', account='fam1')
+        for index in range(60):
+            MedicalRecord.objects.using('shard_1').create(
+                profile=profile, title='Scan', date='2025-01-15', image='medical_records/y.png',
+                description=sample_text(index + 2000), analysis_summary=sample_text(index + 3000))
+
+        out = io.StringIO()
+        call_command('compression_report', stdout=out)
+        rows = {tuple(line.split()[:3]) for line in out.getvalue().splitlines()}
+        self.assertIn(('api.MedicalRecord.description', 'default', '60'), rows)
+        self.assertIn(('api.MedicalRecord.description', 'shard_1', '60'), rows)
+        self.assertIn(('api.MedicalRecord.description', 'shard_0', '0'), rows)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            out = io.StringIO()
+            call_command('train_compression_dictionary', output=str(Path(tmp, 'records.dict')), size=4096, stdout=out)
+            self.assertIn('trained on 240 values', out.getvalue())
+            # --max-samples still counts across databases
+            call_command('train_compression_dictionary', output=str(Path(tmp, 'records.dict')), size=4096,
+                         max_samples=150, stdout=out)
+            self.assertIn('trained on 150 values', out.getvalue())
+
+
+class SpecialistSearchTests(TestCase):
+    def add(self, *points, specialty='cardiologist'):
+        rows = [{'name': f'{specialty} {lat},{lng}', 'specialty': specialty, 'lat': lat, 'lng': lng}
+                for lat, lng in points]
+        imported, errors = import_specialists(rows)
+        self.assertEqual((imported, errors), (len(rows), []))
+
+    def assertNearest(self, lat, lng, k, specialty='cardiologist'):
+        """The search returns exactly what ranking every specialist by distance returns."""
+        expected = sorted(
+            (geo.haversine_km(lat, lng, s.latitude, s.longitude), s.pk)
+            for s in Specialist.objects.filter(specialty=specialty)
+        )[:k]
+        found = nearest_specialists(lat, lng, k, specialty=specialty)
+        self.assertEqual([s.pk for s in found], [pk for _, pk in expected])
+        for specialist, (distance, _) in zip(found, expected):
+            self.assertAlmostEqual(specialist.distance_km, distance)
+        return found
+
+    def test_matches_brute_force(self):
+        rng = random.Random(4)
+        self.add(*[(rng.uniform(40.5, 41), rng.uniform(-74.3, -73.7)) for _ in range(300)])
+        self.add(*[(rng.uniform(-90, 90), rng.uniform(-180, 180)) for _ in range(200)])
+        self.add((40.74, -74.03), specialty='dermatologist')
+        for lat, lng in [(40.744, -74.032), (40.5, -74.3), (0, 0), (-33.9, 151.2), (64.1, -21.9)]:
+            for k in (1, 5, 20):
+                with self.subTest(lat=lat, lng=lng, k=k):
+                    self.assertNearest(lat, lng, k)
+        self.assertEqual([s.specialty for s in nearest_specialists(40.74, -74.03, 5, 'Dermatologists')],
+                         ['dermatologist'])
+
+    def test_across_the_antimeridian(self):
+        # Fiji: the nearest specialists are on the other side of 180 degrees
+        self.add((-17.8, -179.99), (-17.8, -179.9), (-17.8, 179.5), (-17.8, 178.0))
+        found = self.assertNearest(-17.8, 179.99, 2)
+        self.assertEqual([s.longitude for s in found], [-179.99, -179.9])
+        self.assertNearest(-17.8, -179.999, 3)
+
+    def test_high_latitudes(self):
+        # Near the pole, meridians converge: points at other longitudes are close
+        self.add((89.999, 90), (89.999, -90), (89.99, 0.5), (89.9, 0), (85, 0), (78.2, 15.6))
+        found = self.assertNearest(89.999, 0, 3)
+        self.assertEqual(len(found), 3)
+        self.assertNearest(89.9999, 45, 6)
+        # A degree of longitude away is 20 cm here, outside cells that reach 300 m due south
+        self.add((89.9999, 1), (89.9972, 0))
+        self.assertEqual(self.assertNearest(89.9999, 0, 1)[0].longitude, 1)
+        self.assertNearest(78.22, 15.65, 2)  # Svalbard
+        self.assertNearest(-89.99, 0, 2)
+
+    def test_covered_radius_shrinks_towards_the_poles(self):
+        equator = geo.covered_radius_km(0.01, 0.01, geo.encode(0.01, 0.01, 5))
+        polar = geo.covered_radius_km(89.999, 0.01, geo.encode(89.999, 0.01, 5))
+        self.assertGreater(equator, 4)
+        self.assertLess(polar, 0.01)
+
+    def test_api(self):
+        self.add((40.744, -74.032), (40.75, -74.0), (41.5, -74.0))
+        response = self.client.get('/api/specialists/', {'specialty': 'cardiologist', 'lat': 40.74, 'lng': -74.03,
+                                                         'k': 2})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([s['latitude'] for s in data], [40.744, 40.75])
+        self.assertLess(data[0]['distance_km'], data[1]['distance_km'])
+        self.assertEqual(self.client.get('/api/specialists/', {'lat': 40.74}).status_code, 400)
+        self.assertEqual(self.client.get('/api/specialists/', {'k': 0}).status_code, 400)
+
+    def test_import_can_describe_the_specialties(self):
+        rows = [{'name': 'Dr A', 'specialty': 'Cardiologists', 'lat': 40.7, 'lng': -74.0},
+                {'name': 'Dr B', 'specialty': 'cardiologist', 'lat': 40.8, 'lng': -74.1},
+                {'name': 'Dr C', 'specialty': 'zzyzxologist', 'lat': 40.9, 'lng': -74.2}]
+        fixtures = ProviderFixtures({'perplexity:batch': [{
+            'status': 200, 'latency': 0,
+            'body': {'choices': [{'message': {'content': json.dumps({
+                'cardiologist': 'A heart doctor.', 'zzyzxologist': 'Definition not found.',
+            })}}]},
+        }]})
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory, 'directory.json')
+            path.write_text(json.dumps(rows))
+            with FakeProviderServer(fixtures=fixtures) as server, \
+                    override_settings(AI_PROVIDERS=provider_settings(server)):
+                call_command('import_specialists', str(path), stdout=io.StringIO())
+                self.assertFalse(TermDefinition.objects.exists())  # Only on request
+
+                out, err = io.StringIO(), io.StringIO()
+                call_command('import_specialists', str(path), replace=True, enrich=True, stdout=out, stderr=err)
+                self.assertIn('Described 1 specialties (0 already cached)', out.getvalue())
+                self.assertIn('Could not describe: zzyzxologist', err.getvalue())
+                self.assertEqual(TermDefinition.objects.get().definition, 'A heart doctor.')
+
+                out = io.StringIO()
+                call_command('import_specialists', str(path), replace=True, enrich=True, stdout=out, stderr=err)
+                self.assertIn('Described 1 specialties (1 already cached)', out.getvalue())
+
+            # The specialty's term page is answered from the cache
+            response = self.client.post('/api/terms/definitions/', {'terms': ['cardiologist']},
+                                        content_type='application/json')
+            self.assertTrue(response.json()['definitions']['cardiologist']['cached'])
+
+
+
+def tus_metadata(**fields):
+    return ','.join(f'{key} {base64.b64encode(value.encode()).decode()}' for key, value in fields.items())
+
+
+class ResumableUploadTests(TempMediaMixin, TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.upload_dir = tempfile.mkdtemp(prefix='caremigo-uploads-')
+        self.addCleanup(shutil.rmtree, self.upload_dir, ignore_errors=True)
+        override = override_settings(UPLOAD_TEMP_DIR=Path(self.upload_dir))
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.family = family_client(self, 'parent', 'fam1', shard='shard_0')
+        response = self.family.post('/api/profiles/', {'name': 'Me', 'relationship': 'Self'},
+                                    content_type='application/json')
+        self.profile_id = response.json()['id']
+        self.content = image_bytes()
+
+    def create(self, length=None, **metadata):
+        metadata = {'filename': 'scan.png', 'title': 'Blood test', 'date': '2025-01-15',
+                    'description': 'x', **metadata}
+        return self.family.post(
+            f'/api/profiles/{self.profile_id}/uploads/',
+            headers={'Tus-Resumable': '1.0.0', 'Upload-Length': str(length or len(self.content)),
+                     'Upload-Metadata': tus_metadata(**metadata)},
+        )
+
+    def patch(self, url, data, offset, checksum=None):
+        headers = {'Tus-Resumable': '1.0.0', 'Upload-Offset': str(offset)}
+        if checksum:
+            headers['Upload-Checksum'] = checksum
+        return self.family.generic('PATCH', url, data, content_type='application/offset+octet-stream',
+                                   headers=headers)
+
+    def sha256(self, data):
+        return 'sha256 ' + base64.b64encode(hashlib.sha256(data).digest()).decode()
+
+    def test_create(self):
+        response = self.create()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response['Upload-Offset'], response['Upload-Length']), ('0', str(len(self.content))))
+        self.assertIn('Upload-Expires', response)
+        session = UploadSession.objects.using('shard_0').get()
+        self.assertTrue(response['Location'].endswith(f'/api/uploads/{session.id}/'))
+        self.assertEqual(session.metadata, {'title': 'Blood test', 'date': '2025-01-15', 'description': 'x'})
+        self.assertTrue(Path(self.upload_dir, f'{session.id}.part').exists())
+
+        # Record fields are checked before any bytes are sent
+        response = self.create(date='not a date')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('date', response.json())
+
+    def test_resume_after_a_partial_upload(self):
+        url = self.create()['Location']
+        first, rest = self.content[:20], self.content[20:]
+        response = self.patch(url, first, 0, checksum=self.sha256(first))
+        self.assertEqual((response.status_code, response['Upload-Offset']), (204, '20'))
+
+        response = self.family.head(url)
+        self.assertEqual((response.status_code, response['Upload-Offset']), (200, '20'))
+
+        # A stale offset (e.g. a retried first chunk) is refused
+        response = self.patch(url, first, 0)
+        self.assertEqual(response.status_code, 409)
+
+        response = self.patch(url, rest, 20, checksum=self.sha256(rest))
+        self.assertEqual(response.status_code, 204)
+        record = MedicalRecord.objects.using('shard_0').get(id=response['Upload-Record-Id'])
+        self.assertEqual(record.title, 'Blood test')
+        with record.image.open('rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertEqual(self.family.get(url).json()['status'], 'complete')
+        self.assertEqual(list(Path(self.upload_dir).iterdir()), [])
+
+    def test_analysis_is_added_to_the_uploaded_record(self):
+        # How the app saves a new record: upload the file, then PATCH the analysis onto its record
+        url = self.create()['Location']
+        record_id = self.patch(url, self.content, 0)['Upload-Record-Id']
+        # A client that lost the last answer finds the record with HEAD
+        self.assertEqual(self.family.head(url)['Upload-Record-Id'], record_id)
+
+        response = self.family.patch(f'/api/profiles/{self.profile_id}/records/{record_id}/',
+                                     encode_multipart(BOUNDARY, {'analysis_summary': 'Looks normal'}),
+                                     content_type=MULTIPART_CONTENT)
+        self.assertEqual(response.status_code, 200)
+        record = MedicalRecord.objects.using('shard_0').get(id=record_id)
+        self.assertEqual((record.analysis_summary, record.image_data), ('Looks normal', None))
+
+    def test_checksum_mismatch(self):
+        url = self.create()['Location']
+        response = self.patch(url, self.content[:20], 0, checksum=self.sha256(b'something else'))
+        self.assertEqual(response.status_code, 460)
+        self.assertEqual(self.family.head(url)['Upload-Offset'], '0')
+        self.assertEqual(Path(self.upload_dir, f'{url.rstrip("/").rsplit("/", 1)[1]}.part').stat().st_size, 0)
+
+    def test_invalid_image_is_discarded(self):
+        junk = b'not an image at all'
+        url = self.create(length=len(junk))['Location']
+        response = self.patch(url, junk, 0)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.json())
+        self.assertFalse(UploadSession.objects.using('shard_0').exists())
+        self.assertFalse(MedicalRecord.objects.using('shard_0').exists())
+        self.assertEqual(self.family.head(url).status_code, 404)
+
+    def test_expired_sessions_are_removed_by_the_periodic_task(self):
+        stale_url = self.create()['Location']
+        fresh_url = self.create()['Location']
+        stale_id = stale_url.rstrip('/').rsplit('/', 1)[1]
+        UploadSession.objects.using('shard_0').filter(id=stale_id).update(
+            updated_at=timezone.now() - timedelta(seconds=settings.UPLOAD_SESSION_EXPIRY + 60))
+
+        out = io.StringIO()
+        call_command('run_periodic_tasks', '--task', 'api.uploads.expire_sessions', stdout=out)
+
+        self.assertIn('api.uploads.expire_sessions: 1', out.getvalue())
+        self.assertEqual(self.family.head(stale_url).status_code, 404)
+        self.assertFalse(Path(self.upload_dir, f'{stale_id}.part').exists())
+        self.assertEqual(self.family.head(fresh_url).status_code, 200)
+
+
+class PeriodicTaskTests(TestCase):
+    def test_first_run_waits_one_interval(self):
+        started = timezone.now()
+        self.assertFalse(claim('api.uploads.expire_sessions', 900))
+        run = PeriodicTaskRun.objects.get(task='api.uploads.expire_sessions')
+        self.assertGreaterEqual(run.next_run_at, started + timedelta(seconds=900))
+        self.assertIsNone(run.last_started_at)
+        # Restarting a process doesn't make it due either
+        self.assertFalse(claim('api.uploads.expire_sessions', 900))
+
+    def test_one_process_claims_each_run(self):
+        PeriodicTaskRun.objects.create(task='api.media_gc.collect_garbage',
+                                       next_run_at=timezone.now() - timedelta(seconds=1))
+        # Several workers checking the same due run
+        self.assertEqual([claim('api.media_gc.collect_garbage', 3600) for _ in range(3)], [True, False, False])
+        run = PeriodicTaskRun.objects.get()
+        self.assertIsNotNone(run.last_started_at)
+        self.assertAlmostEqual((run.next_run_at - run.last_started_at).total_seconds(), 3600)
@@ -0,0 +1,140 @@
+"""
+Endpoints of the resumable upload protocol (see ``api.uploads``).
+
+Plain Django views rather than DRF: the PATCH body is the raw file chunk and
+is read from the request stream, not parsed up front. (Under ASGI, Django
+has already spooled the body by then; see ``api.uploads``.)
+"""
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.urls import reverse
+from django.utils.http import http_date
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+
+from . import uploads
+from .models import Profile, UploadSession
+from .sharding import for_account
+
+OFFSET_CONTENT_TYPE = 'application/offset+octet-stream'
+
+
+def _tus_headers(response, session=None):
+    response['Tus-Resumable'] = uploads.TUS_VERSION
+    if session is not None:
+        response['Upload-Offset'] = str(session.offset)
+        response['Upload-Length'] = str(session.length)
+        if session.status == 'uploading':
+            response['Upload-Expires'] = http_date(uploads.expires_at(session).timestamp())
+        if session.record_id is not None:
+            response['Upload-Record-Id'] = str(session.record_id)
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+def _error(detail, status=400):
+    body = detail if isinstance(detail, dict) else {'error': detail}
+    reason = 'Checksum Mismatch' if status == uploads.CHECKSUM_MISMATCH else None
+    return _tus_headers(JsonResponse(body, status=status, reason=reason))
+
+
+def _options():
+    response = HttpResponse(status=204)
+    response['Tus-Version'] = uploads.TUS_VERSION
+    response['Tus-Extension'] = uploads.TUS_EXTENSIONS
+    response['Tus-Max-Size'] = str(settings.UPLOAD_MAX_SIZE)
+    response['Tus-Checksum-Algorithm'] = uploads.CHECKSUM_ALGORITHM
+    return _tus_headers(response)
+
+
+def _int_header(request, name):
+    try:
+        value = int(request.headers[name])
+    except (KeyError, ValueError):
+        raise uploads.UploadError(f"A valid {name} header is required.")
+    if value < 0:
+        raise uploads.UploadError(f"{name} can't be negative.")
+    return value
+
+
+def _check_version(request):
+    version = request.headers.get('Tus-Resumable')
+    if version is not None and version != uploads.TUS_VERSION:
+        raise uploads.UploadError(f"Unsupported Tus-Resumable version {version}.", status_code=412)
+
+
+@csrf_exempt
+@require_http_methods(['POST', 'OPTIONS'])
+def create_upload(request, profile_id):
+    """
+    Start an upload for a new record of the profile. Headers: ``Upload-Length``
+    and ``Upload-Metadata`` with ``filename``, ``title``, ``date`` and
+    ``description``. Answers 201 with the upload URL in ``Location``.
+    """
+    if request.method == 'OPTIONS':
+        return _options()
+    try:
+        profile = for_account(Profile, request.account).get(id=profile_id)
+    except Profile.DoesNotExist:
+        return _error("Profile not found", status=404)
+
+    try:
+        _check_version(request)
+        session = uploads.create_session(
+            profile,
+            _int_header(request, 'Upload-Length'),
+            uploads.parse_metadata(request.headers.get('Upload-Metadata', '')),
+        )
+    except uploads.UploadError as e:
+        return _error(e.detail, status=e.status_code)
+
+    response = HttpResponse(status=201)
+    response['Location'] = request.build_absolute_uri(reverse('upload-detail', args=[session.id]))
+    return _tus_headers(response, session)
+
+
+@csrf_exempt
+@require_http_methods(['HEAD', 'GET', 'PATCH', 'DELETE', 'OPTIONS'])
+def upload_detail(request, upload_id):
+    """
+    HEAD: current offset, to resume from. GET: the same as JSON, plus the
+    record once the upload is complete. PATCH: append a chunk at
+    ``Upload-Offset``. DELETE: abandon the upload.
+    """
+    if request.method == 'OPTIONS':
+        return _options()
+    try:
+        session = for_account(UploadSession, request.account).get(id=upload_id)
+    except UploadSession.DoesNotExist:
+        return _error("Upload not found", status=404)
+
+    if request.method == 'HEAD':
+        return _tus_headers(HttpResponse(status=200), session)
+
+    if request.method == 'GET':
+        return _tus_headers(JsonResponse({
+            'id': str(session.id),
+            'filename': session.filename,
+            'offset': session.offset,
+            'length': session.length,
+            'status': session.status,
+            'record': session.record_id,
+        }), session)
+
+    if request.method == 'DELETE':
+        if session.status != 'uploading':
+            return _error("Upload is already complete.", status=409)
+        uploads.discard(session)
+        return _tus_headers(HttpResponse(status=204))
+
+    if request.content_type != OFFSET_CONTENT_TYPE:
+        return _error(f"PATCH requests must have Content-Type: {OFFSET_CONTENT_TYPE}", status=415)
+    try:
+        _check_version(request)
+        offset = _int_header(request, 'Upload-Offset')
+        checksum = request.headers.get('Upload-Checksum')
+        checksum = uploads.parse_checksum(checksum) if checksum else None
+        session = uploads.append_chunk(session, request, offset, checksum)
+    except uploads.UploadError as e:
+        return _error(e.detail, status=e.status_code)
+    return _tus_headers(HttpResponse(status=204), session)
@@ -0,0 +1,262 @@
+"""
+Resumable record uploads, following the tus 1.0 protocol (https://tus.io).
+
+The client creates a session with the file's total size and the record's
+title, date and description, then PATCHes the file in chunks. Each chunk is
+appended to a temp file under ``UPLOAD_TEMP_DIR`` in 64 KB pieces and may
+carry a sha256 ``Upload-Checksum``. Under WSGI the pieces are read from the
+socket as they arrive, so a chunk is never held in memory. Django's ASGI
+handler instead reads the whole request body before the view runs, into a
+spooled temp file (in memory up to ``FILE_UPLOAD_MAX_MEMORY_SIZE``). Keep
+chunks small when serving with ASGI, since a dropped connection then loses
+the whole chunk. After a
+dropped connection the client asks for the current offset (HEAD) and carries
+on from there instead of starting over. When the last byte arrives the file
+becomes a MedicalRecord in one transaction. Sessions idle for
+``UPLOAD_SESSION_EXPIRY`` are removed by ``expire_sessions`` (see
+``api.periodic``).
+"""
+import base64
+import binascii
+import hashlib
+import os
+from contextlib import contextmanager
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+
+from . import documents, sharding
+from .models import UploadSession
+from .serializers import MedicalRecordSerializer
+
+try:
+    import fcntl
+except ImportError:  # Windows: concurrent PATCHes to one upload aren't guarded
+    fcntl = None
+
+TUS_VERSION = '1.0.0'
+TUS_EXTENSIONS = 'creation,checksum,termination,expiration'
+CHECKSUM_ALGORITHM = 'sha256'
+CHECKSUM_MISMATCH = 460  # tus-specific status code
+CHUNK_SIZE = 64 * 1024
+RECORD_FIELDS = ('title', 'date', 'description')
+
+
+class UploadError(Exception):
+    """``detail`` is a message or, for invalid record fields, a serializer errors dict."""
+
+    def __init__(self, detail, status_code=400):
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+
+
+class SessionFile(File):
+    """
+    The finished upload. Exposing the temp path lets image validation read it
+    from disk and lets FileSystemStorage move it into MEDIA_ROOT instead of
+    copying it.
+    """
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def parse_metadata(header):
+    """Decode an ``Upload-Metadata`` header: comma-separated ``key base64value`` pairs."""
+    metadata = {}
+    for pair in header.split(','):
+        key, _, value = pair.strip().partition(' ')
+        if not key:
+            continue
+        try:
+            metadata[key] = base64.b64decode(value, validate=True).decode('utf-8')
+        except (binascii.Error, UnicodeDecodeError):
+            raise UploadError(f"Invalid Upload-Metadata value for '{key}'.")
+    return metadata
+
+
+def parse_checksum(header):
+    """Return the digest from an ``Upload-Checksum: sha256 <base64 digest>`` header."""
+    algorithm, _, value = header.strip().partition(' ')
+    if algorithm != CHECKSUM_ALGORITHM:
+        raise UploadError(f"Unsupported checksum algorithm '{algorithm}'; use {CHECKSUM_ALGORITHM}.")
+    try:
+        return base64.b64decode(value, validate=True)
+    except binascii.Error:
+        raise UploadError("Invalid Upload-Checksum value.")
+
+
+def temp_path(session):
+    return Path(settings.UPLOAD_TEMP_DIR) / f'{session.id}.part'
+
+
+def expires_at(session):
+    return session.updated_at + timedelta(seconds=settings.UPLOAD_SESSION_EXPIRY)
+
+
+def create_session(profile, length, metadata):
+    """Validate the record fields up front, before any bytes are sent, and open a session."""
+    if length < 1:
+        raise UploadError("Upload-Length must be a positive number of bytes.")
+    if length > settings.UPLOAD_MAX_SIZE:
+        raise UploadError(f"Uploads can be at most {settings.UPLOAD_MAX_SIZE} bytes.", status_code=413)
+
+    fields = {key: metadata[key] for key in RECORD_FIELDS if key in metadata}
+    serializer = MedicalRecordSerializer(data=fields)
+    serializer.is_valid()
+    errors = {field: messages for field, messages in serializer.errors.items() if field != 'image'}
+    if errors:
+        raise UploadError(errors)
+
+    Path(settings.UPLOAD_TEMP_DIR).mkdir(parents=True, exist_ok=True)
+    session = UploadSession.objects.create(
+        profile=profile,
+        filename=Path(metadata.get('filename', '')).name[:255],
+        length=length,
+        metadata=fields,
+    )
+    temp_path(session).touch()
+    return session
+
+
+@contextmanager
+def _locked(session):
+    """Open the session's temp file, failing with 423 if another request is writing to it."""
+    try:
+        f = open(temp_path(session), 'r+b')
+    except FileNotFoundError:
+        raise UploadError("Upload not found.", status_code=404)
+    with f:
+        if fcntl is not None:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise UploadError("Another request is writing to this upload.", status_code=423)
+        yield f
+
+
+def append_chunk(session, stream, offset, checksum=None):
+    """
+    Append ``stream`` (the request body) to the upload at ``offset`` and
+    finalize the upload once it's complete. Returns the updated session.
+    """
+    if session.status != 'uploading':
+        raise UploadError("Upload is already complete.", status_code=409)
+    with _locked(session) as f:
+        session.refresh_from_db()
+        if session.status != 'uploading':
+            raise UploadError("Upload is already complete.", status_code=409)
+        if offset != session.offset:
+            raise UploadError(f"Upload-Offset is {offset} but the upload is at {session.offset}.", status_code=409)
+
+        # Drop anything past the last acknowledged offset, e.g. from a crashed request.
+        f.seek(offset)
+        f.truncate()
+        digest = hashlib.sha256()
+        received = 0
+        try:
+            for data in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                received += len(data)
+                if offset + received > session.length:
+                    raise UploadError("Chunk goes past Upload-Length.", status_code=413)
+                f.write(data)
+                digest.update(data)
+        except UploadError:
+            f.truncate(offset)
+            raise
+        except Exception:
+            # The connection dropped mid-chunk. Keep what arrived, unless there's a
+            # checksum it can no longer be verified against.
+            if checksum is not None:
+                f.truncate(offset)
+            else:
+                _commit(f, session, offset + received)
+            raise
+
+        if checksum is not None and digest.digest() != checksum:
+            f.truncate(offset)
+            raise UploadError("Upload-Checksum does not match the chunk.", status_code=CHECKSUM_MISMATCH)
+        _commit(f, session, offset + received)
+
+        if session.offset == session.length:
+            finalize(session)
+    return session
+
+
+def _commit(f, session, offset):
+    # Bytes are on disk before the offset acknowledging them is saved.
+    f.flush()
+    os.fsync(f.fileno())
+    session.offset = offset
+    session.save(update_fields=['offset', 'updated_at'])
+
+
+def finalize(session):
+    """
+    Turn a complete upload into a MedicalRecord; PDFs get one page per PDF page.
+    An upload that isn't a valid scan is discarded along with its session.
+    """
+    path = temp_path(session)
+    pages = None
+    try:
+        with open(path, 'rb') as f:
+            upload = SessionFile(f, name=session.filename or 'upload')
+            # Rendered before the transaction, which only covers the inserts
+            pages = documents.rasterize_pdf(upload) if documents.is_pdf(upload) else None
+            with transaction.atomic(using=session._state.db):
+                serializer = MedicalRecordSerializer(data={**session.metadata, 'image': pages[0] if pages else upload})
+                if not serializer.is_valid():
+                    raise UploadError(serializer.errors)
+                record = serializer.save(profile=session.profile)
+                if pages and len(pages) > 1:
+                    documents.ensure_pages(record)
+                    documents.append_page_files(record, pages[1:])
+
+                session.status = 'complete'
+                session.record = record
+                session.save(update_fields=['status', 'record', 'updated_at'])
+                transaction.on_commit(lambda: path.unlink(missing_ok=True), using=session._state.db)
+    except (UploadError, documents.DocumentError) as e:
+        discard(session)
+        if isinstance(e, UploadError):
+            raise
+        raise UploadError(str(e))
+    finally:
+        if pages:
+            documents.close_files(pages)
+    return record
+
+
+def discard(session):
+    temp_path(session).unlink(missing_ok=True)
+    session.delete()
+
+
+def expire_sessions():
+    """
+    Delete upload sessions idle for longer than UPLOAD_SESSION_EXPIRY, with
+    their temp files, and temp files no session refers to. Returns the number
+    of sessions removed.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.UPLOAD_SESSION_EXPIRY)
+    removed = 0
+    live = set()
+    for using in sharding.databases_for(UploadSession):
+        expired = UploadSession.objects.using(using).filter(updated_at__lt=cutoff)
+        for session in expired.iterator():
+            temp_path(session).unlink(missing_ok=True)
+        removed += expired.delete()[0]
+        live.update(str(pk) for pk in UploadSession.objects.using(using).values_list('id', flat=True))
+
+    directory = Path(settings.UPLOAD_TEMP_DIR)
+    if directory.is_dir():
+        # Left behind if a process died before it could remove them.
+        for path in directory.glob('*.part'):
+            if path.stem not in live and path.stat().st_mtime < cutoff.timestamp():
+                path.unlink(missing_ok=True)
+    return removed
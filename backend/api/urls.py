@@ -1,6 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import ProfileViewSet, MedicalRecordViewSet, TaskViewSet
+from .views import ProfileViewSet, MedicalRecordViewSet, MedicalRecordPageViewSet, SpecialistViewSet, TaskViewSet
+from . import ai_views, upload_views
 
 router = DefaultRouter()
 router.register(r'profiles', ProfileViewSet, basename='profile')
@@ -8,7 +9,17 @@ router.register(r'profiles/(?P<profile_id>\d+)/records', MedicalRecordViewSet, b
 router.register(r'profiles/(?P<profile_id>\d+)/tasks', TaskViewSet, basename='profile-tasks')
 router.register(r'tasks', TaskViewSet, basename='task')
 router.register(r'records', MedicalRecordViewSet, basename='record')
+router.register(r'records/(?P<record_id>\d+)/pages', MedicalRecordPageViewSet, basename='record-pages')
+router.register(r'specialists', SpecialistViewSet, basename='specialist')
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('ai/ocr/', ai_views.ocr, name='ai-ocr'),
+    path('ai/analyze/', ai_views.analyze, name='ai-analyze'),
+    path('ai/interpret/', ai_views.interpret, name='ai-interpret'),
+    path('ai/define/', ai_views.define, name='ai-define'),
+    path('records/<int:record_id>/analyze/', ai_views.analyze_record, name='record-analyze'),
+    path('terms/definitions/', ai_views.term_definitions, name='term-definitions'),
+    path('profiles/<int:profile_id>/uploads/', upload_views.create_upload, name='upload-create'),
+    path('uploads/<uuid:upload_id>/', upload_views.upload_detail, name='upload-detail'),
 ] 
\ No newline at end of file
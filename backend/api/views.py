@@ -2,35 +2,59 @@ from django.shortcuts import render
 from rest_framework import viewsets, status
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.response import Response
-from .models import Profile, MedicalRecord, Task
-from .serializers import ProfileSerializer, MedicalRecordSerializer, TaskSerializer
-from django.db import models, transaction
+from .models import Profile, MedicalRecord, MedicalRecordPage, Specialist, Task
+from .serializers import (
+    ProfileSerializer, MedicalRecordSerializer, MedicalRecordPageSerializer, SpecialistSerializer, TaskSerializer,
+)
+from .documents import DocumentError, add_pages, analysis_fingerprint
+from .sharding import atomic, for_account
+from .specialists import nearest_specialists, normalize_specialty
+from django.db import models
 from django.db.models import F
+from django.utils import timezone
 from rest_framework import serializers
 
 # Create your views here.
 
+ANALYSIS_FIELDS = ('analysis_summary', 'analysis_actions', 'analysis_recommendations')
+
+def analysis_stamp(validated_data):
+    """
+    The fingerprint fields to save with an analysis written by the app. It
+    comes from /api/ai/analyze/, so it is current until the prompts or model change.
+    """
+    if not any(validated_data.get(field) for field in ANALYSIS_FIELDS):
+        return {}
+    return {'analysis_fingerprint': analysis_fingerprint(), 'analyzed_at': timezone.now()}
+
 class ProfileViewSet(viewsets.ModelViewSet):
-    queryset = Profile.objects.all()
     serializer_class = ProfileSerializer
 
+    def get_queryset(self):
+        # Several accounts share a shard; only ever show the request's own.
+        return for_account(Profile, self.request.account)
+
+    def perform_create(self, serializer):
+        serializer.save(account=self.request.account)
+
 class MedicalRecordViewSet(viewsets.ModelViewSet):
     serializer_class = MedicalRecordSerializer
     parser_classes = (MultiPartParser, FormParser)
 
     def get_queryset(self):
         try:
+            records = for_account(MedicalRecord, self.request.account)
             # Direct access to a specific record
             if self.action in ['retrieve', 'update', 'partial_update', 'destroy']:
-                return MedicalRecord.objects.all()
+                return records
                 
             # Otherwise, filter by profile if profile_id is in the URL
             profile_id = self.kwargs.get('profile_id')
             if profile_id:
-                return MedicalRecord.objects.filter(profile_id=profile_id)
+                return records.filter(profile_id=profile_id)
                 
-            # Default case - return all records if not accessing via profile
-            return MedicalRecord.objects.all()
+            # Default case - return all of the account's records if not accessing via profile
+            return records
         except Exception as e:
             print(f"Error in get_queryset: {str(e)}")
             return MedicalRecord.objects.none()
@@ -39,7 +63,7 @@ class MedicalRecordViewSet(viewsets.ModelViewSet):
         print(f"Creating record for profile_id: {profile_id}")
         print(f"Request data: {request.data}")
         try:
-            profile = Profile.objects.get(id=profile_id)
+            profile = for_account(Profile, request.account).get(id=profile_id)
             print(f"Found profile: {profile.name}")
         except Profile.DoesNotExist:
             print(f"Profile with id {profile_id} not found")
@@ -51,7 +75,7 @@ class MedicalRecordViewSet(viewsets.ModelViewSet):
         try:
             serializer = self.get_serializer(data=request.data)
             if serializer.is_valid():
-                serializer.save(profile=profile)
+                serializer.save(profile=profile, **analysis_stamp(serializer.validated_data))
                 print("Record created successfully")
                 return Response(serializer.data, status=status.HTTP_201_CREATED)
             print(f"Serializer errors: {serializer.errors}")
@@ -63,12 +87,19 @@ class MedicalRecordViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    def retrieve(self, request, *args, **kwargs):
+        response = super().retrieve(request, *args, **kwargs)
+        # Recently viewed records are re-analyzed first after a prompt/model change.
+        # update() rather than save() so viewing doesn't bump updated_at.
+        for_account(MedicalRecord, request.account).filter(pk=kwargs.get('pk')).update(last_viewed_at=timezone.now())
+        return response
+
     def update(self, request, *args, **kwargs):
+        instance = self.get_object() # 404 for other accounts' records
         try:
-            instance = self.get_object()
             serializer = self.get_serializer(instance, data=request.data, partial=True)
             if serializer.is_valid():
-                serializer.save()
+                serializer.save(**analysis_stamp(serializer.validated_data))
                 return Response(serializer.data)
             print(f"Serializer errors: {serializer.errors}")
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -79,17 +110,89 @@ class MedicalRecordViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+class MedicalRecordPageViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Pages of a multi-page record. POST a `file` (an image or a PDF) to append
+    its pages; PDFs are rasterized server-side, one page per PDF page.
+    """
+    serializer_class = MedicalRecordPageSerializer
+    parser_classes = (MultiPartParser, FormParser)
+
+    def get_queryset(self):
+        return for_account(MedicalRecordPage, self.request.account).filter(record_id=self.kwargs.get('record_id'))
+
+    def list(self, request, *args, **kwargs):
+        if not for_account(MedicalRecord, request.account).filter(id=kwargs.get('record_id')).exists():
+            return Response({"error": "Record not found"}, status=status.HTTP_404_NOT_FOUND)
+        return super().list(request, *args, **kwargs)
+
+    def create(self, request, record_id=None):
+        try:
+            record = for_account(MedicalRecord, request.account).get(id=record_id)
+        except MedicalRecord.DoesNotExist:
+            return Response({"error": "Record not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        uploaded_file = request.FILES.get('file')
+        if uploaded_file is None:
+            return Response({"file": ["No file was submitted."]}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            pages = add_pages(record, uploaded_file)
+        except DocumentError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = self.get_serializer(pages, many=True)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+class SpecialistViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    The local specialist directory. `GET /api/specialists/?specialty=&lat=&lng=&k=`
+    returns the k nearest specialists (default 5), closest first. Without
+    lat/lng it lists the specialty alphabetically. What a specialty treats is
+    not part of the directory; ask /api/terms/definitions/ for that.
+    """
+    serializer_class = SpecialistSerializer
+    queryset = Specialist.objects.order_by('name')
+
+    def list(self, request, *args, **kwargs):
+        specialty = request.query_params.get('specialty', '').strip()
+        lat = request.query_params.get('lat')
+        lng = request.query_params.get('lng')
+        try:
+            k = int(request.query_params.get('k', 5))
+            if not 1 <= k <= 100:
+                raise ValueError
+        except ValueError:
+            return Response({"k": ["k must be an integer between 1 and 100."]}, status=status.HTTP_400_BAD_REQUEST)
+
+        if lat is None and lng is None:
+            queryset = self.get_queryset()
+            if specialty:
+                queryset = queryset.filter(specialty=normalize_specialty(specialty))
+            return Response(self.get_serializer(queryset[:k], many=True).data)
+
+        try:
+            lat, lng = float(lat), float(lng)
+            if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+                raise ValueError
+        except (TypeError, ValueError):
+            return Response(
+                {"error": "lat and lng must both be given as valid coordinates."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        specialists = nearest_specialists(lat, lng, k, specialty=specialty or None)
+        return Response(self.get_serializer(specialists, many=True).data)
+
 class TaskViewSet(viewsets.ModelViewSet):
     serializer_class = TaskSerializer
 
     def get_queryset(self):
-        queryset = Task.objects.all() # Start with all tasks
+        queryset = for_account(Task, self.request.account) # Start with all of the account's tasks
         
         # Check if accessing via nested profile route
         profile_id = self.kwargs.get('profile_id')
         if profile_id:
             try:
-                profile = Profile.objects.get(id=profile_id)
+                profile = for_account(Profile, self.request.account).get(id=profile_id)
                 # Filter by profile if accessed via /profiles/../tasks/
                 return queryset.filter(profile=profile).order_by('order')
             except Profile.DoesNotExist:
@@ -123,7 +226,7 @@ class TaskViewSet(viewsets.ModelViewSet):
             raise serializers.ValidationError(error_msg, code='invalid')
 
         try:
-            profile = Profile.objects.get(id=profile_id)
+            profile = for_account(Profile, self.request.account).get(id=profile_id)
             print(f"Found profile: {profile.name}")
 
             # Get the title and status from validated data
@@ -183,7 +286,7 @@ class TaskViewSet(viewsets.ModelViewSet):
             # Use a generic server error for unexpected issues
             raise serializers.ValidationError(error_msg, code='error')
 
-    @transaction.atomic
+    @atomic
     def partial_update(self, request, *args, **kwargs):
         """
         Handle PATCH requests, specifically managing order changes during drag-and-drop.
@@ -2,15 +2,44 @@
 ASGI config for backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Run it with an ASGI server (e.g. ``uvicorn backend.asgi:application``) so the
+async AI views in ``api.ai_views`` don't hold a worker thread while waiting on
+the providers.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 """
 
+import asyncio
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from api import periodic, providers  # noqa: E402  (needs the app registry loaded above)
+
+
+async def application(scope, receive, send):
+    # Django doesn't handle lifespan events, so answer them here: start the
+    # periodic maintenance tasks, and close the pooled provider client cleanly
+    # on shutdown.
+    if scope['type'] == 'lifespan':
+        maintenance = None
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                if settings.PERIODIC_TASKS_IN_PROCESS:
+                    maintenance = asyncio.create_task(periodic.run_forever())
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if maintenance is not None:
+                    maintenance.cancel()
+                await providers.aclose_clients()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    else:
+        await django_application(scope, receive, send)
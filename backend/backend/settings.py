@@ -10,14 +10,24 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from corsheaders.defaults import default_headers, default_methods
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Media is served by api.media.serve_media. Set MEDIA_ACCEL_MODE to
+# 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache/lighttpd) to let the front
+# proxy send the bytes; with nginx, MEDIA_ACCEL_PREFIX must be an `internal`
+# location aliased to MEDIA_ROOT.
+MEDIA_ACCEL_MODE = os.environ.get('MEDIA_ACCEL_MODE') or None
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.1/howto/deployment/checklist/
 
@@ -42,7 +52,6 @@ INSTALLED_APPS = [
     'rest_framework',
     'corsheaders',
     'api',
-    'profiles',
 ]
 
 MIDDLEWARE = [
@@ -52,6 +61,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'api.sharding.AccountShardMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -75,6 +85,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'backend.wsgi.application'
+ASGI_APPLICATION = 'backend.asgi.application'
 
 
 # Database
@@ -87,6 +98,25 @@ DATABASES = {
     }
 }
 
+# Per-account shards (api.sharding): each account's profiles and records live
+# in one of the SHARD_DIR/shard_N.sqlite3 files, so families don't wait on each
+# other's writes. Every shard file there is configured, so the web server, cron
+# and management commands all see the same shards. To add shards, set
+# SHARD_COUNT to the new total and run `python manage.py split_shards` once.
+# The test suite runs with two in-memory shards (backend.test_runner).
+SHARD_DIR = BASE_DIR / 'shards'
+SHARD_COUNT = int(os.environ.get('SHARD_COUNT', '0'))
+_shard_indexes = set(range(SHARD_COUNT))
+_shard_indexes.update(int(path.stem[6:]) for path in SHARD_DIR.glob('shard_*.sqlite3') if path.stem[6:].isdigit())
+for index in sorted(_shard_indexes):
+    DATABASES[f'shard_{index}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': SHARD_DIR / f'shard_{index}.sqlite3',
+    }
+DATABASE_ROUTERS = ['api.sharding.ShardRouter']
+
+TEST_RUNNER = 'backend.test_runner.ShardedTestRunner'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -133,3 +163,98 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:5173",  # Vite's default port
 ]
+
+# The session cookie carries the family account (api.sharding)
+CORS_ALLOW_CREDENTIALS = True
+CSRF_TRUSTED_ORIGINS = CORS_ALLOWED_ORIGINS
+
+# Resumable uploads (api.uploads) use tus headers and HEAD requests
+CORS_ALLOW_METHODS = (*default_methods, 'HEAD')
+CORS_ALLOW_HEADERS = (
+    *default_headers,
+    'tus-resumable',
+    'upload-length',
+    'upload-metadata',
+    'upload-offset',
+    'upload-checksum',
+)
+CORS_EXPOSE_HEADERS = [
+    'location',
+    'tus-resumable',
+    'upload-offset',
+    'upload-length',
+    'upload-expires',
+    'upload-record-id',
+]
+
+
+# Outbound AI providers, used by the async views in api.ai_views.
+# Set AI_PROVIDER_URL to point every provider at one host, e.g. the local fake
+# server started with `python manage.py run_fake_providers`.
+AI_PROVIDER_URL = os.environ.get('AI_PROVIDER_URL')
+
+AI_PROVIDERS = {
+    'vision': {
+        'base_url': AI_PROVIDER_URL or 'https://vision.googleapis.com',
+        'api_key': os.environ.get('GOOGLE_API_KEY', ''),
+        'concurrency': 16,  # Max in-flight requests to this provider
+        'timeout': 30,  # Seconds
+    },
+    'gemini': {
+        'base_url': AI_PROVIDER_URL or 'https://generativelanguage.googleapis.com',
+        'api_key': os.environ.get('GOOGLE_API_KEY', ''),
+        'model': 'gemini-2.0-flash',
+        'concurrency': 8,
+        'timeout': 60,
+    },
+    'perplexity': {
+        'base_url': AI_PROVIDER_URL or 'https://api.perplexity.ai',
+        'api_key': os.environ.get('PERPLEXITY_API_KEY', ''),
+        'concurrency': 8,
+        'timeout': 60,
+    },
+}
+
+# Connection pool shared by all providers (one pool per event loop)
+AI_HTTP_MAX_CONNECTIONS = 64
+AI_HTTP_MAX_KEEPALIVE_CONNECTIONS = 32
+AI_HTTP_KEEPALIVE_EXPIRY = 60  # Seconds an idle connection is kept open
+
+# Batched term definitions (POST /api/terms/definitions/)
+TERM_DEFINITION_MAX_TERMS = 200
+TERM_DEFINITION_BATCH_TOKENS = 2000  # Estimated prompt + answer tokens per upstream request
+TERM_DEFINITION_TOKENS_PER_TERM = 120  # Expected answer size for one definition
+
+# Multi-page documents (api.documents). PDF uploads need the pypdfium2 package.
+DOCUMENT_MAX_PAGES = 60
+DOCUMENT_CHUNK_TOKENS = 6000  # Estimated tokens of page text per analysis prompt
+
+# Compressed text columns (api.fields.CompressedTextField). 'zstd' needs the
+# zstandard package and, for best results, a dictionary trained with
+# `python manage.py train_compression_dictionary`.
+COMPRESSED_TEXT_CODEC = os.environ.get('COMPRESSED_TEXT_CODEC', 'zlib')
+COMPRESSED_TEXT_ZSTD_DICTIONARY = os.environ.get('COMPRESSED_TEXT_ZSTD_DICTIONARY') or None
+
+# Resumable uploads (api.uploads). Partial files live in UPLOAD_TEMP_DIR until
+# the upload completes; sessions idle for UPLOAD_SESSION_EXPIRY are removed.
+UPLOAD_TEMP_DIR = BASE_DIR / 'upload_sessions'
+UPLOAD_MAX_SIZE = 200 * 1024 * 1024  # Bytes
+UPLOAD_SESSION_EXPIRY = 24 * 60 * 60  # Seconds
+
+# Maintenance tasks run by api.periodic: dotted path -> interval in seconds.
+# Under ASGI every server process schedules them in the background, and one
+# process claims each run (api.models.PeriodicTaskRun); set
+# PERIODIC_TASKS_IN_PROCESS=0 and run `python manage.py run_periodic_tasks`
+# from cron instead when serving with WSGI.
+PERIODIC_TASKS = {
+    'api.uploads.expire_sessions': 15 * 60,
+    'api.media_gc.collect_garbage': 24 * 60 * 60,
+}
+PERIODIC_TASKS_IN_PROCESS = os.environ.get('PERIODIC_TASKS_IN_PROCESS', '1') != '0'
+
+# Orphaned media collection (api.media_gc): files under these MEDIA_ROOT
+# directories that no FileField refers to are deleted.
+MEDIA_GC_DIRECTORIES = ['medical_records']
+MEDIA_GC_MIN_AGE = 60 * 60  # Seconds; younger files may belong to a record being saved
+MEDIA_GC_BATCH_SIZE = 100
+MEDIA_GC_RATE = 50  # Files deleted per second
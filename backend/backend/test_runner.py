@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.db import connections
+from django.test.runner import DiscoverRunner
+
+
+class ShardedTestRunner(DiscoverRunner):
+    """
+    Run the tests with exactly ``shard_count`` shard databases (created in
+    memory like the other test databases), whatever shard files the checkout
+    has.
+    """
+    shard_count = 2
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        for alias in [alias for alias in settings.DATABASES if alias.startswith('shard_')]:
+            del settings.DATABASES[alias]
+        for index in range(self.shard_count):
+            settings.DATABASES[f'shard_{index}'] = {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': settings.SHARD_DIR / f'shard_{index}.sqlite3',
+            }
+        connections.configure_settings(settings.DATABASES)  # Fills in the defaults for the new aliases
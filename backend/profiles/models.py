@@ -1,20 +0,0 @@
-from django.db import models
-
-class Profile(models.Model):
-    name = models.CharField(max_length=100)
-    relationship = models.CharField(max_length=100)
-    created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
-
-    def __str__(self):
-        return f"{self.name} - {self.relationship}"
-
-class MedicalRecord(models.Model):
-    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='medical_records')
-    title = models.CharField(max_length=200)
-    description = models.TextField()
-    created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
-
-    def __str__(self):
-        return f"{self.title} - {self.profile.name}"
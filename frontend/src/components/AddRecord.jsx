@@ -1,6 +1,7 @@
 import { useState, useEffect } from 'react';
 import { useNavigate, useParams } from 'react-router-dom';
 import axios from 'axios';
+import { uploadRecord } from '../uploads';
 
 function AddRecord() {
   const { profileId } = useParams();
@@ -47,25 +48,9 @@ function AddRecord() {
     setIsUploading(true);
     
     try {
-      const formData = new FormData();
-      formData.append('title', title);
-      formData.append('date', date);
-      formData.append('description', description);
-      formData.append('image', image);
-      
-      const response = await axios.post(
-        `http://localhost:8000/api/profiles/${profileId}/records/`,
-        formData,
-        {
-          headers: {
-            'Content-Type': 'multipart/form-data',
-          },
-        }
-      );
-      
-      if (response.status === 201) {
-        navigate(`/profile/${profileId}`);
-      }
+      // Sent in resumable chunks; the record is created when the last one arrives
+      await uploadRecord(profileId, image, { title, date, description });
+      navigate(`/profile/${profileId}`);
     } catch (error) {
       console.error('Error uploading record:', error);
       alert('Failed to upload medical record. Please try again.');
@@ -89,13 +74,15 @@ function AddRecord() {
       imageData
     });
     
-    // Create a temporary record with the current form data
+    // Create a temporary record with the current form data. The base64 copy is
+    // only for the analysis requests; saving uploads `file` itself.
     const tempRecord = {
       title,
       date,
       description,
       image: imagePreview,
-      image_data: imageData
+      image_data: imageData,
+      file: image
     };
     
     navigate(`/medical-analysis/${profileId}/new`, { 
@@ -1,11 +1,13 @@
 import React from 'react';
 import { Link } from 'react-router-dom';
 
-function HighlightedLink({ word, isSpecialist }) {
+// `definition` is the term's entry from /api/terms/definitions/, if the record's
+// terms were already defined; MedicalTerm looks the term up itself otherwise
+function HighlightedLink({ word, isSpecialist, definition }) {
   return (
     <Link 
       to="/medical-term"
-      state={{ term: word, isSpecialist }}
+      state={{ term: word, isSpecialist, definition }}
       className="bg-yellow-200 text-blue-600 hover:text-blue-800 hover:underline"
     >
       {word}
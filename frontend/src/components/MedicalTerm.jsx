@@ -4,6 +4,8 @@ import axios from 'axios';
 import ReactMarkdown from 'react-markdown';
 import ScrollFadeIn from './ScrollFadeIn';
 
+const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
+
 // Define hints array
 const hints = [
   'Hint: Click on a medical term within an analysis to find Specialists in your area.',
@@ -59,6 +61,8 @@ function MedicalTerm() {
   const location = useLocation();
   const term = location.state?.term;
   const isSpecialist = location.state?.isSpecialist;
+  // Defined already by MedicalAnalysis with the rest of the record's terms
+  const preloadedDefinition = location.state?.definition;
 
   // Add a check for term existence
   if (!term) {
@@ -73,8 +77,7 @@ function MedicalTerm() {
   const [sources, setSources] = useState([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
-  const [specialistList, setSpecialistList] = useState(null); // Add a new state for specialist list
-  const [specialists, setSpecialists] = useState([]); // Add a new state for specialists
+  const [specialists, setSpecialists] = useState(null); // Nearest specialists from the directory
   const [userLocation, setUserLocation] = useState(null); // Add new state for user location
   const [locationError, setLocationError] = useState(null); // Add new state for location error
   const [showPrompt, setShowPrompt] = useState(false);
@@ -133,92 +136,17 @@ function MedicalTerm() {
       setError(null);
 
       try {
-        // Replace this with your Perplexity API key
-        const apiKey = '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';
-        const apiUrl = 'https://api.perplexity.ai/chat/completions';
-
-        // Prepare the request payload
-        const payload = {
-          model: isSpecialist ? `sonar-pro`:`sonar`,
-          messages: [
-            {
-              role: 'system',
-              content: isSpecialist
-                // UNCOMMENT TO USE LOCATION DATA
-                // ? `You are a helpful assistant that provides information about medical specialists. First list the top 5 specialists ${
-                //     userLocation ? "near the user's location" : 'in the area'
-                //   } with their Name, Address, Phone Number, and make sure to include WEBSITE specific to doctor (not list)with information in a clear format. Then explain their role and what conditions they treat. Divide the two with __ (two underscores). MAKE SURE TO KEEP SOURCES`
-                ? `You are a helpful assistant that provides information about medical specialists. First list the top 5 specialists near Hoboken, NJ with their Name, Address, Phone Number, and make sure to include WEBSITE specific to doctor (not list)with information in a clear format. Then explain their role and what conditions they treat. Divide the two with __ (two underscores). MAKE SURE TO KEEP SOURCES`
-                : 'You are a helpful assistant that provides concise medical definitions. Explain in simple terms that a high-schooler could understand. If possible, break down into bullet points. Use only single returns. Make sure to keep sources. If you cannot find a definition, say "Definition not found." and do not return any other text.',
-            },
-            {
-              role: 'user',
-            //   UNCOMMENT TO USE LOCATION DATA
-            //   content: isSpecialist
-            //     ? `List the top 5 ${term}s ${
-            //         userLocation
-            //           ? `near coordinates (${userLocation.lat.toFixed(
-            //               4
-            //             )}, ${userLocation.lng.toFixed(4)})`
-            //           : 'in the area'
-            //       } with their contact information:`
-            //     : `Define the medical term: ${term}`,
-                content: isSpecialist
-                ? `List the top 5 ${term}s in Hoboken, NJ with their contact information:`
-                : `Define the medical term: ${term}`,
-            },
-          ],
-        };
-
-        // Make the API request using axios
-        const response = await axios.post(apiUrl, payload, {
-          headers: {
-            Authorization: `Bearer ${apiKey}`,
-            'Content-Type': 'application/json',
-          },
-        });
-
-        console.log('API Response:', JSON.stringify(response.data)); // Log the full response for debugging
-        // Extract and set the definition from the API response
-        const completion = response.data.choices[0].message.content;
-
-        if (isSpecialist) {
-          // Split the content using the __ separator
-          const [list, description] = completion.split('__');
-          setSpecialistList(list.trim());
-          setDefinition(description.trim());
-
-          // Process the list to extract specialist information
-          const specialistsData = list
-            .split('\n\n')
-            .filter((s) => s.includes('Address:'))
-            .map((specialist) => {
-              const lines = specialist.split('\n');
-              return {
-                name: lines[0].trim(),
-                address:
-                  lines
-                    .find((l) => l.includes('Address:'))
-                    ?.replace('Address:', '')
-                    .trim() || '',
-                phone:
-                  lines
-                    .find((l) => l.includes('Phone:'))
-                    ?.replace('Phone:', '')
-                    .trim() || '',
-                website:
-                  lines
-                    .find((l) => l.includes('Website:'))
-                    ?.replace('Website:', '')
-                    .trim() || '',
-              };
-            });
-          setSpecialists(specialistsData);
-        } else {
-          setDefinition(completion);
+        let found = preloadedDefinition;
+        if (!found) {
+          // Definitions (and what a specialty treats) are cached on the backend,
+          // so a term is only looked up once
+          const response = await axios.post(`${API_URL}/api/terms/definitions/`, { terms: [term] });
+          found = response.data.definitions[term];
         }
+        // Terms the provider couldn't define are listed under `missing`
+        setDefinition(found ? found.definition : null);
+        const citations = found?.citations || [];
 
-        const citations = response.data.citations || [];
         const formattedSources = citations.map((citation, index) => ({
           id: `source-${index}`, // Create a more unique id
           url: citation,
@@ -235,7 +163,23 @@ function MedicalTerm() {
     if (term) {
       fetchDefinition();
     }
-  }, [term, isSpecialist]);
+  }, [term, preloadedDefinition]);
+
+  // Nearby specialists come from the local directory, searched around the user's location
+  useEffect(() => {
+    if (!isSpecialist || !userLocation) {
+      return;
+    }
+    axios
+      .get(`${API_URL}/api/specialists/`, {
+        params: { specialty: term, lat: userLocation.lat, lng: userLocation.lng, k: 5 },
+      })
+      .then((response) => setSpecialists(response.data))
+      .catch((err) => {
+        console.error('Error fetching specialists:', err);
+        setSpecialists([]);
+      });
+  }, [term, isSpecialist, userLocation]);
 
   const handleTextSelection = useCallback(() => {
     const selection = window.getSelection();
@@ -262,31 +206,12 @@ function MedicalTerm() {
     setShowPopup(true);
 
     try {
-      const apiKey = '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';
-      const apiUrl = 'https://api.perplexity.ai/chat/completions';
-
-      const payload = {
-        model: 'sonar',
-        messages: [
-          {
-            role: 'system',
-            content: 'You are a helpful medical assistant that explains medical terms in very simple language, using analogies when possible. Explain in simple terms that a high-schooler could understand.'
-          },
-          {
-            role: 'user',
-            content: `Please explain "${selectedText}" in the simplest possible terms, as if explaining to someone with no medical knowledge. Keep it to a maximum of 3 sentences total.`
-          }
-        ]
-      };
-
-      const response = await axios.post(apiUrl, payload, {
-        headers: {
-          'Authorization': `Bearer ${apiKey}`,
-          'Content-Type': 'application/json'
-        }
+      const response = await axios.post(`${API_URL}/api/ai/define/`, {
+        term: selectedText,
+        explain: true,
       });
 
-      setAiExplanation(response.data.choices[0].message.content);
+      setAiExplanation(response.data.content);
     } catch (error) {
       console.error('Error fetching AI explanation:', error);
       setAiExplanation('Error getting explanation. Please try again.');
@@ -340,14 +265,25 @@ function MedicalTerm() {
         </h1>
       </ScrollFadeIn>
       <ScrollFadeIn className="bg-white rounded-lg shadow-lg p-8">
-        {isSpecialist && specialistList && (
+        {isSpecialist && (
           <ScrollFadeIn className="mb-8 pb-6 border-b border-gray-200">
             <h2 className="text-2xl font-bold text-gray-800 mb-4 text-left">
-              Here are the top 5 {term}s {userLocation ? 'near you' : 'in Hoboken, NJ'} with their contact information:
+              {term}s near you
             </h2>
             <div className="text-gray-700 text-lg text-left space-y-4">
-              {specialists.map((specialist, index) => (
-                <div key={index} className="border-b border-gray-200 pb-4 last:border-b-0">
+              {!userLocation && (
+                <p className="text-gray-600">
+                  {locationError
+                    ? `Allow location access to see ${term}s near you (${locationError}).`
+                    : 'Finding your location...'}
+                </p>
+              )}
+              {userLocation && !specialists && <p className="text-gray-600">Searching the directory...</p>}
+              {specialists && specialists.length === 0 && (
+                <p className="text-gray-600">No {term}s found in the directory.</p>
+              )}
+              {specialists && specialists.map((specialist) => (
+                <div key={specialist.id} className="border-b border-gray-200 pb-4 last:border-b-0">
                   <p className="font-semibold">{specialist.name}</p>
                   {specialist.address && <p>Address: {specialist.address}</p>}
                   {specialist.phone && <p>Phone: {specialist.phone}</p>}
@@ -364,11 +300,16 @@ function MedicalTerm() {
                       </a>
                     </p>
                   )}
+                  {specialist.distance_km != null && (
+                    <p className="text-sm text-gray-500">{specialist.distance_km.toFixed(1)} km away</p>
+                  )}
                 </div>
               ))}
-              <p className="mt-4 text-sm text-gray-600">
-                Note: Please verify availability and insurance coverage before scheduling an appointment.
-              </p>
+              {specialists && specialists.length > 0 && (
+                <p className="mt-4 text-sm text-gray-600">
+                  Note: Please verify availability and insurance coverage before scheduling an appointment.
+                </p>
+              )}
             </div>
           </ScrollFadeIn>
         )}
@@ -1,8 +1,16 @@
 import { StrictMode } from 'react'
 import { createRoot } from 'react-dom/client'
+import axios from 'axios'
 import './index.css'
 import App from './App.jsx'
 
+// A signed-in Django session selects the user's family account; send it to the API
+// and answer Django's CSRF check with its cookie
+axios.defaults.withCredentials = true
+axios.defaults.withXSRFToken = true
+axios.defaults.xsrfCookieName = 'csrftoken'
+axios.defaults.xsrfHeaderName = 'X-CSRFToken'
+
 createRoot(document.getElementById('root')).render(
   <StrictMode>
     <App />
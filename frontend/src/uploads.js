@@ -0,0 +1,73 @@
+import axios from 'axios';
+
+const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
+
+const TUS_VERSION = '1.0.0';
+// Small chunks: under ASGI the server reads each whole chunk before storing it
+const CHUNK_SIZE = 1024 * 1024;
+const MAX_RETRIES = 5;
+
+// Upload-Metadata values are base64 of their UTF-8 bytes
+const encodeMetadata = (metadata) =>
+  Object.entries(metadata)
+    .map(([key, value]) => `${key} ${btoa(String.fromCharCode(...new TextEncoder().encode(String(value))))}`)
+    .join(',');
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+// Upload `file` as a new record of the profile with the resumable upload
+// endpoints (tus 1.0, see DOCUMENTATION.md), so the file is sent once, as
+// bytes, and a dropped connection resumes from the last stored offset.
+// `fields` are the record's title, date and description. Resolves to the id
+// of the record created from the finished upload.
+export async function uploadRecord(profileId, file, fields, onProgress) {
+  const created = await axios.post(`${API_URL}/api/profiles/${profileId}/uploads/`, null, {
+    headers: {
+      'Tus-Resumable': TUS_VERSION,
+      'Upload-Length': String(file.size),
+      'Upload-Metadata': encodeMetadata({ filename: file.name || 'upload', ...fields }),
+    },
+  });
+  const uploadUrl = created.headers.location;
+
+  let offset = 0;
+  let retries = 0;
+  while (true) {
+    try {
+      const response = await axios.patch(uploadUrl, file.slice(offset, offset + CHUNK_SIZE), {
+        headers: {
+          'Tus-Resumable': TUS_VERSION,
+          'Upload-Offset': String(offset),
+          'Content-Type': 'application/offset+octet-stream',
+        },
+      });
+      offset = Number(response.headers['upload-offset']);
+      retries = 0;
+      if (onProgress) {
+        onProgress(offset / file.size);
+      }
+      if (response.headers['upload-record-id']) {
+        return Number(response.headers['upload-record-id']);
+      }
+    } catch (error) {
+      // Invalid fields or files (4xx other than a stale offset) won't succeed on retry
+      const status = error.response?.status;
+      if ((status && status < 500 && status !== 409) || retries >= MAX_RETRIES) {
+        throw error;
+      }
+      retries += 1;
+      await sleep(1000 * 2 ** (retries - 1));
+      try {
+        // Carry on from what the server has stored
+        const head = await axios.head(uploadUrl, { headers: { 'Tus-Resumable': TUS_VERSION } });
+        if (head.headers['upload-record-id']) {
+          // Only the answer to the last chunk was lost
+          return Number(head.headers['upload-record-id']);
+        }
+        offset = Number(head.headers['upload-offset']);
+      } catch {
+        // Still offline; the PATCH is retried, and a wrong offset answers 409
+      }
+    }
+  }
+}